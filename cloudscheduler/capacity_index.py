@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# vim: set expandtab ts=4 sw=4:
+
+# Copyright (C) 2009 University of Victoria
+# You may distribute under the terms of either the GNU General Public
+# License or the Apache v2 License, as specified in the README file.
+
+## CAPACITY INDEX
+##
+## Groups the clusters of a resource pool by the (cpuarch, network) pairs
+## they can run VMs with, each group sorted by the clusters' load (number of
+## VMs). The index listens to its clusters and moves a cluster within its
+## groups as VMs are added, removed, or resources checked out and returned,
+## so the clusters which might fit a VM can be had least loaded first
+## without looking at the clusters of other architectures or networks. Its
+## generation tells when any cluster's capacity may have changed.
+##
+
+from __future__ import with_statement
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+
+import cluster_tools
+
+log = logging.getLogger("cloudscheduler")
+
+# Network part of the group key of the clusters which don't restrict the
+# networks VMs use, and of the group of every cluster with a cpuarch.
+ANY_NETWORK = None
+ALL_NETWORKS = ()
+
+
+class CapacityIndex:
+    """Clusters grouped by (cpuarch, network), least loaded first.
+
+    A group is a sorted list of (load, order, cluster) entries, where order
+    is the cluster's position in the pool and breaks ties between clusters
+    with the same load.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        # id(cluster) to (entry, group keys) of the clusters in the index
+        self.entries = {}
+        # Goes up each time the index is rebuilt or a cluster in it changes
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _group_keys(cluster):
+        keys = []
+        for cpuarch in cluster.cpu_archs:
+            keys.append((cpuarch, ALL_NETWORKS))
+            if isinstance(cluster, cluster_tools.NimbusCluster):
+                for network in cluster.network_pools:
+                    keys.append((cpuarch, network))
+            else:
+                keys.append((cpuarch, ANY_NETWORK))
+        return list(set(keys))
+
+    def rebuild(self, clusters):
+        """Replace the index with one of the given list of clusters."""
+        with self.lock:
+            self.groups.clear()
+            self.entries.clear()
+            for order, cluster in enumerate(clusters):
+                entry = (cluster.num_vms(), order, cluster)
+                keys = self._group_keys(cluster)
+                for key in keys:
+                    self.groups.setdefault(key, []).append(entry)
+                self.entries[id(cluster)] = (entry, keys)
+            for group in self.groups.itervalues():
+                group.sort()
+            self.generation += 1
+            log.debug("Capacity index rebuilt with %d clusters in %d groups" %
+                      (len(self.entries), len(self.groups)))
+
+    def update(self, cluster):
+        """Move a cluster to its place for its current load."""
+        with self.lock:
+            if id(cluster) not in self.entries:
+                return
+            self.generation += 1
+            (entry, keys) = self.entries[id(cluster)]
+            load = cluster.num_vms()
+            if load == entry[0]:
+                return
+            new_entry = (load, entry[1], cluster)
+            for key in keys:
+                group = self.groups[key]
+                del group[bisect_left(group, entry[:2])]
+                insort(group, new_entry)
+            self.entries[id(cluster)] = (new_entry, keys)
+
+    # Cluster listener interface, see ICluster.add_vm_listener()
+    def vm_added(self, cluster, vm):
+        self.update(cluster)
+
+    def vm_removed(self, cluster, vm):
+        self.update(cluster)
+
+    def resources_changed(self, cluster):
+        self.update(cluster)
+
+    def candidates(self, cpuarch, network):
+        """Returns the clusters with a cpuarch and network, least loaded
+        first. Any network will do if network is empty."""
+        with self.lock:
+            if not network:
+                return [entry[2] for entry in self.groups.get((cpuarch, ALL_NETWORKS), [])]
+            return [entry[2] for entry in heapq.merge(
+                    self.groups.get((cpuarch, network), []),
+                    self.groups.get((cpuarch, ANY_NETWORK), []))]
@@ -17,18 +17,20 @@ from __future__ import with_statement
 
 import os
 import re
+import heapq
 import sys
 import json
 import shlex
 import string
 import logging
+import tempfile
 import threading
 import subprocess
 import ConfigParser
 
 from suds.client import Client
 from urllib2 import URLError
-from decimal import *
+from fractions import Fraction
 from lxml import etree
 from StringIO import StringIO
 
@@ -39,6 +41,9 @@ except:
 
 import cluster_tools
 import cloudscheduler.config as config
+import cloudscheduler.parse_pool as parse_pool
+from cloudscheduler.vm_table import VMTable
+from cloudscheduler.capacity_index import CapacityIndex
 
 from cloudscheduler.utilities import determine_path
 from cloudscheduler.utilities import get_or_none
@@ -65,6 +70,12 @@ class ResourcePool:
     retired_resources = []
     config_file = ""
 
+    # Every machine classAd attribute cloud scheduler reads. This is the
+    # projection asked of condor_status when condor_attribute_projection is on
+    MACHINE_CLASSAD_ATTRIBUTES = ("Name", "Machine", "MyAddress", "VMType",
+            "Start", "RemoteOwner", "State", "Activity", "GlobalJobId",
+            "MyCurrentTime", "EnteredCurrentState")
+
     ## Instance methods
 
     def __init__(self, config_file, name="Resources", condor_query_type=""):
@@ -89,9 +100,28 @@ class ResourcePool:
         self.config_file = os.path.expanduser(config_file)
         self.ban_lock = threading.Lock()
         self.banned_job_resource = {}
+        # Goes up each time banned_job_resource changes
+        self.ban_generation = 0
         self.failures = {}
         self.setup_lock = threading.Lock()
         self.setup_queued = False
+        # Resources of the VMs on the clusters, kept up to date by the clusters
+        self.vm_table = VMTable()
+        # Clusters by cpuarch and network, least loaded first
+        self.capacity_index = CapacityIndex()
+        # Fitting clusters by requirements, for as long as no cluster's
+        # capacity and no ban changes. See get_fitting_resources()
+        self.placement_cache = {}
+        self.placement_version = None
+        self.placement_lock = threading.Lock()
+        # Clusters in the pool by name, and the cluster of each VM on them by
+        # id(vm). The pool listens to its clusters to keep vm_clusters current.
+        self.clusters_by_name = {}
+        self.vm_clusters = {}
+        self.cluster_lock = threading.RLock()
+
+        # Worker processes for parsing large machine queries, if enabled
+        self.parse_pool = parse_pool.get_parse_pool()
 
         if not condor_query_type:
             condor_query_type = config.condor_retrieval_method
@@ -167,14 +197,22 @@ class ResourcePool:
             log.debug("Updating clusters: %s" % updated_names)
 
         # Set resources list to empty to make sure no VMs are started
-        # while we're shuffling things around.
+        # while we're shuffling things around. Empty the capacity index and
+        # placement cache as well, so no fitting clusters are handed out
+        # from them either until the index is rebuilt below.
+        self.capacity_index.rebuild([])
+        with self.placement_lock:
+            self.placement_cache.clear()
         old_resources = []
         for cluster in reversed(self.resources):
             with cluster.res_lock:
                 cluster.vm_slots = 0
                 cluster.memory = []
+                cluster._index_memory()
             old_resources.append(cluster)
             self.resources.remove(cluster)
+        with self.cluster_lock:
+            self.clusters_by_name.clear()
 
         # Update resources
         # Do this by replacing each updated cluster object with the
@@ -219,6 +257,19 @@ class ResourcePool:
                             cluster.vm_destroy(vm, return_resources=False)
                     old_resources.remove(cluster)
 
+        # Have the VM table and capacity index follow the clusters now in the pool
+        for cluster in old_resources + self.retired_resources:
+            cluster.remove_vm_listener(self.vm_table)
+            cluster.remove_vm_listener(self.capacity_index)
+            cluster.remove_vm_listener(self)
+        for cluster in self.resources:
+            cluster.add_vm_listener(self.vm_table)
+            cluster.add_vm_listener(self.capacity_index)
+            cluster.add_vm_listener(self)
+        self.vm_table.rebuild(self.resources)
+        self.capacity_index.rebuild(self.resources)
+        self._index_clusters()
+
         self.setup_lock.release()
         if self.setup_queued:
             self.setup_queued = False
@@ -378,50 +429,73 @@ class ResourcePool:
             imageloc  - the image location url - used by Nimbus clouds
             targets   - list of target clouds 
         Return: a list of Cluster objects representing clusters that meet given
-            requirements for network, cpu, memory, and storage
+            requirements for network, cpu, memory, and storage, least loaded first
+        """
+        return list(self._cached_fitting_resources((network, cpuarch, memory, cpucores,
+                                                    storage, ami, imageloc, tuple(targets))))
+
+    def _cached_fitting_resources(self, requirements):
+        """Returns the fitting clusters for a tuple of the arguments of
+        get_fitting_resources, working them out only once for as long as no
+        cluster's capacity or load, and no ban of an image, changes. The list
+        returned is shared, so it must not be changed."""
+        with self.placement_lock:
+            version = (self.capacity_index.generation, self.ban_generation)
+            if version != self.placement_version:
+                self.placement_cache.clear()
+                self.placement_version = version
+            if requirements not in self.placement_cache:
+                fitting_clusters = list(self.iter_fitting_resources(*requirements))
+                # Log the list of clusters that fit given requirements
+                if fitting_clusters:
+                    log.debug("List of fitting clusters: ")
+                    self.log_list(fitting_clusters)
+                self.placement_cache[requirements] = fitting_clusters
+            return self.placement_cache[requirements]
+
+    def iter_fitting_resources(self, network, cpuarch, memory, cpucores, storage, ami, imageloc, targets=[]):
+        """Generate the Clusters that fit the given VM/Job requirements, least
+        loaded (fewest VMs) first.
+
+        Only the clusters with the cpuarch and network are looked at, as
+        found in the capacity index. Keywords are as for get_fitting_resources.
         """
         if len(self.resources) == 0:
             log.debug("Pool is empty... Cannot return list of fitting resources")
-            return []
+            return
 
-        fitting_clusters = []
         if len(targets) > 0:
-            clusters = self.filter_resources_by_names(targets)
+            target_names = set(targets)
         else:
-            clusters = self.resources
-        for cluster in clusters:
-            if cluster.__class__.__name__ == "NimbusCluster":
+            target_names = None
+        for cluster in self.capacity_index.candidates(cpuarch, network):
+            if target_names != None and cluster.name not in target_names:
+                continue
+            if isinstance(cluster, cluster_tools.NimbusCluster):
                 # If not valid image file to download
                 if imageloc == "":
                     continue
-                # If required network is NOT in cluster's network associations
-                # if network is undefined then it means pick whatever, so we
-                # just always okay it.
-                if network and (network not in cluster.network_pools):
-                    log.verbose("get_fitting_resources - No matching networks in %s" % cluster.name)
-                    continue
+                # Networks were matched by the capacity index. If network is
+                # undefined then it means pick whatever.
                 if network and network in cluster.net_slots.keys() and cluster.net_slots[network] <= 0:
                     log.verbose("get_fitting_resources - No Slots left in network %s on %s" % (network, cluster.name))
                     continue
                 if imageloc in self.banned_job_resource.keys():
                     if cluster.name in self.banned_job_resource[imageloc]:
                         continue
-            elif cluster.__class__.__name__ == "EC2Cluster":
+            elif isinstance(cluster, cluster_tools.EC2Cluster):
                 # If no valid ami to boot from
                 if ami == "":
                     continue
                 # If ami banned from cluster
-                if ami in self.banned_job_resource.keys():
-                    if cluster.name in self.banned_job_resource[ami]:
+                cluster_ami = self._ami_for(ami, cluster)
+                if cluster_ami in self.banned_job_resource.keys():
+                    if cluster.name in self.banned_job_resource[cluster_ami]:
                         continue
             # If the cluster has no open VM slots
             if (cluster.vm_slots <= 0):
                 log.verbose("get_fitting_resources - No free slots in %s" % cluster.name)
                 continue
-            # If the cluster does not have the required CPU architecture
-            if (cpuarch not in cluster.cpu_archs):
-                log.verbose("get_fitting_resources - No matching CPU archs in %s" % cluster.name)
-                continue
             # If the cluster has no sufficient memory entries for the VM
             if (cluster.find_mementry(memory) < 0):
                 log.verbose("get_fitting_resources - No available memory entry in %s" % cluster.name)
@@ -434,14 +508,8 @@ class ResourcePool:
             if (storage > cluster.storageGB):
                 log.verbose("get_fitting_resources - Not enough storage in %s" % cluster.name)
                 continue
-            # Add cluster to the list to be returned (meets all job reqs)
-            fitting_clusters.append(cluster)
-
-        # Return the list clusters that fit given requirements
-        if fitting_clusters:
-            log.debug("List of fitting clusters: ")
-            self.log_list(fitting_clusters)
-        return fitting_clusters
+            # Cluster meets all job reqs
+            yield cluster
 
 
     def get_resourceBF(self, network, cpuarch, memory, cpucores, storage, ami, imageloc, targets=[]):
@@ -476,8 +544,14 @@ class ResourcePool:
                 If no fitting clusters are found, (None, None) is returned.
 
         """
-        # Get a list of fitting clusters
-        fitting_clusters = self.get_fitting_resources(network, cpuarch, memory, cpucores, storage, ami, imageloc, targets)
+        # The two least loaded fitting clusters. Fitting clusters come least
+        # loaded first, so there's no need to look at the rest.
+        fitting_clusters = self._cached_fitting_resources((network, cpuarch, memory,
+                                cpucores, storage, ami, imageloc, tuple(targets)))
+        # Under best fit, the two clusters the VM fits most tightly in
+        if config.placement_policy.lower() == "best_fit":
+            fitting_clusters = self._best_fit_order(fitting_clusters, memory, cpucores, storage)
+        fitting_clusters = fitting_clusters[:2]
 
         # If list is empty (no resources fit), return None
         if len(fitting_clusters) == 0:
@@ -489,34 +563,92 @@ class ResourcePool:
             log.verbose("Only one cluster fits parameters. Returning that cluster.")
             return (fitting_clusters[0], None)
 
-        # Set the most-balanced and next-most-balanced initial values
-        # Note: mostbal_cluster stands for "most balanced cluster"
-        # Note: nextbal_cluster stands for "next most balanced cluster"
-        cluster1 = fitting_clusters.pop()
-        cluster2 = fitting_clusters.pop()
+        # Return the most balanced cluster and the next most balanced one
+        return (fitting_clusters[0], fitting_clusters[1])
 
-        if (cluster1.num_vms() < cluster2.num_vms()):
-            mostbal_cluster = cluster1
-            nextbal_cluster = cluster2
-        else:
-            mostbal_cluster = cluster2
-            nextbal_cluster = cluster1
-
-        mostbal_vms = mostbal_cluster.num_vms()
-        nextbal_vms = nextbal_cluster.num_vms()
+    @staticmethod
+    def _best_fit_order(clusters, memory, cpucores, storage):
+        """Returns a list of clusters sorted by how tightly a VM fits in them.
 
-        # Iterate through fitting clusters to check for most and next balanced clusters. (LINEAR search)
-        for cluster in fitting_clusters:
-            # If considered cluster has fewer running VMs, set it as the most balanced cluster
-            if (cluster.num_vms() < mostbal_vms):
-                mostbal_cluster = cluster
-                mostbal_vms = cluster.num_vms()
-            elif (cluster.num_vms() < nextbal_vms):
-                nextbal_cluster = cluster
-                nextbal_vms = cluster.num_vms()
+        A VM fits more tightly in a cluster with less memory left over in the
+        memory entry it would be started in, then less storage and fewer
+        cores left over. Clusters keep their order among equals.
+        """
+        keyed = []
+        for order, cluster in enumerate(clusters):
+            with cluster.res_lock:
+                mementry = cluster.find_best_mementry(memory)
+                if mementry < 0:
+                    continue
+                keyed.append((cluster.memory[mementry] - memory,
+                              cluster.storageGB - storage,
+                              cluster.cpu_cores - cpucores,
+                              order, cluster))
+        keyed.sort()
+        return [entry[-1] for entry in keyed]
+
+    def plan_placement(self, network, cpuarch, memory, cpucores, storage, ami, imageloc, targets, count):
+        """Plan where to start count identical VMs in one go.
+
+        Each VM goes to the least loaded fitting cluster which still has room
+        for it, as if get_resourceBF were asked once per VM and each VM
+        started before the next was asked for. Room is the cluster's free
+        vm_slots, net_slots of the network, storage, and memory entries.
+        Under the best_fit placement_policy the clusters are instead filled
+        one after another, tightest fit first.
+
+        Keywords: as for get_fitting_resources, with
+            count     - the number of VMs to place
+        Return: a list of (Cluster, number of VMs) tuples, in the order the
+            clusters were first picked. Fewer than count VMs are planned if
+            the fitting clusters don't have room for them all.
+        """
+        fitting_clusters = self._cached_fitting_resources((network, cpuarch, memory,
+                                cpucores, storage, ami, imageloc, tuple(targets)))
+        if config.placement_policy.lower() == "best_fit":
+            plan = []
+            for cluster in self._best_fit_order(fitting_clusters, memory, cpucores, storage):
+                if count <= 0:
+                    break
+                room = min(count, self._room_for(cluster, network, memory, storage))
+                if room > 0:
+                    plan.append((cluster, room))
+                    count -= room
+            return plan
+
+        loads = []
+        for order, cluster in enumerate(fitting_clusters):
+            room = self._room_for(cluster, network, memory, storage)
+            if room > 0:
+                loads.append((cluster.num_vms(), order, room))
+        heapq.heapify(loads)
+
+        planned = {}
+        plan = []
+        while count > 0 and loads:
+            (load, order, room) = heapq.heappop(loads)
+            cluster = fitting_clusters[order]
+            if order not in planned:
+                planned[order] = len(plan)
+                plan.append([cluster, 0])
+            plan[planned[order]][1] += 1
+            count -= 1
+            if room > 1:
+                heapq.heappush(loads, (load + 1, order, room - 1))
+        return [tuple(entry) for entry in plan]
 
-        # Return the most balanced cluster after considering all fitting clusters.
-        return (mostbal_cluster, nextbal_cluster)
+    @staticmethod
+    def _room_for(cluster, network, memory, storage):
+        """The number of VMs needing memory and storage the cluster has room for."""
+        with cluster.res_lock:
+            room = cluster.vm_slots
+            if isinstance(cluster, cluster_tools.NimbusCluster) and network in cluster.net_slots:
+                room = min(room, cluster.net_slots[network])
+            if storage > 0:
+                room = min(room, int(cluster.storageGB / storage))
+            if memory > 0:
+                room = min(room, sum([int(free / memory) for free in cluster.memory]))
+            return max(room, 0)
 
     def resourcePF(self, network, cpuarch, memory=0, disk=0):
         """
@@ -593,18 +725,34 @@ class ResourcePool:
 
     def get_cluster(self, cluster_name):
         """Return cluster that matches cluster_name."""
-        for cluster in self.resources:
-            if cluster.name == cluster_name:
-                return cluster
-        return None
+        return self.clusters_by_name.get(cluster_name)
 
     def get_cluster_with_vm(self, vm):
         """Find cluster that contains vm."""
-        cluster = None
-        for c in self.resources:
-            if vm in c.vms:
-                cluster = c
-        return cluster
+        return self.vm_clusters.get(id(vm))
+
+    def _index_clusters(self):
+        """Rebuild clusters_by_name and vm_clusters from the clusters in the pool."""
+        with self.cluster_lock:
+            self.clusters_by_name.clear()
+            self.vm_clusters.clear()
+            for cluster in self.resources:
+                self.clusters_by_name[cluster.name] = cluster
+                for vm in list(cluster.vms):
+                    self.vm_clusters[id(vm)] = cluster
+
+    # Cluster listener interface, see ICluster.add_vm_listener()
+    def vm_added(self, cluster, vm):
+        with self.cluster_lock:
+            self.vm_clusters[id(vm)] = cluster
+
+    def vm_removed(self, cluster, vm):
+        with self.cluster_lock:
+            if self.vm_clusters.get(id(vm)) is cluster:
+                del self.vm_clusters[id(vm)]
+
+    def resources_changed(self, cluster):
+        pass
 
     def convert_classad_dict(self, ad):
         """Convert the Condor class ad struct into a python dict.
@@ -635,19 +783,29 @@ class ResourcePool:
         """
         log.debug("Querying Condor Collector with %s" % config.condor_status_command)
 
+        condor_status = shlex.split(config.condor_status_command)
+        if config.condor_attribute_projection:
+            condor_status.extend(["-attributes", ",".join(self.MACHINE_CLASSAD_ATTRIBUTES)])
+
+        # Machine ads are parsed as condor_status writes them, so only one
+        # raw ad is held in memory at a time.
+        sp = None
         machine_list = []
         try:
-            condor_status = shlex.split(config.condor_status_command)
             sp = subprocess.Popen(condor_status, shell=False,
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (condor_out, condor_err) = sp.communicate(input=None)
+                       stdout=subprocess.PIPE, stderr=tempfile.TemporaryFile())
+            if self.parse_pool:
+                machine_list = self.parse_pool.parse_text(sp.stdout, self.MACHINE_CLASSAD_ATTRIBUTES)
+            else:
+                machine_list = self._condor_status_to_machine_list(sp.stdout)
+            sp.wait()
         except:
             log.exception("Problem running %s, unexpected error" % string.join(condor_status, " "))
+            if sp and sp.poll() == None:
+                sp.kill()
+                sp.wait()
             return None
 
-
-        machine_list = self._condor_status_to_machine_list(condor_out)
-
         return machine_list
 
 
@@ -660,8 +818,21 @@ class ResourcePool:
         """
         log.debug("Querying condor startd with SOAP API")
         try:
+            if config.condor_soap_streaming:
+                # Parse the machine ads as they arrive from the collector
+                response = utilities.condor_soap_request(config.condor_collector_url,
+                                                         "queryStartdAds")
+                try:
+                    return self._condor_machine_xml_to_machine_list(response)
+                finally:
+                    response.close()
+
             machines_xml = self.condor_collector_as_xml.service.queryStartdAds()
-            machine_list = self._condor_machine_xml_to_machine_list(machines_xml)
+            if self.parse_pool:
+                machine_list = self.parse_pool.parse_xml(machines_xml, "result", self.MACHINE_CLASSAD_ATTRIBUTES,
+                                                         keep_last=True)
+            else:
+                machine_list = self._condor_machine_xml_to_machine_list(machines_xml)
 
             return machine_list
 
@@ -685,28 +856,16 @@ class ResourcePool:
                condor_status -l to a list of dictionaries with the attributes
                from the Condor machine ad.
 
+               condor_status_output may be the output as a string, or any
+               iterable of output lines (like a pipe from condor_status)
+
                returns [] is there are no machines
         """
 
-        machines = []
+        if isinstance(condor_status_output, basestring):
+            condor_status_output = StringIO(condor_status_output)
 
-        # Each classad is seperated by '\n\n'
-        raw_machine_classads = condor_status_output.split("\n\n")
-        # Empty condor pools give us an empty string or stray \n in our list
-        raw_machine_classads = filter(lambda x: x != "" and x != "\n", raw_machine_classads)
-
-        for raw_classad in raw_machine_classads:
-            classad = {}
-            classad_lines = raw_classad.splitlines()
-            for classad_line in classad_lines:
-                classad_line = classad_line.strip()
-                (classad_key, classad_value) = classad_line.split(" = ", 1)
-                classad_value = classad_value.strip('"')
-                classad[classad_key] = classad_value
-
-            machines.append(classad)
-
-        return machines
+        return list(utilities.iter_condor_classads(condor_status_output))
 
 
     @staticmethod
@@ -716,28 +875,23 @@ class ResourcePool:
                 to a list of dictionarties with the attributes from the Condor 
                 machine ad.
 
+                condor_xml may be the XML as a string, or a file-like object
+                (like a streamed HTTP response) which is parsed as it is read.
+
                 returns [] if there are no machines
         """
-        def _item_attribute(xml, element):
-            try:
-                return xml.xpath(".//%s" % element)[0].text
-            except:
-                return ""
-
         machines = []
 
-        context = etree.iterparse(StringIO(condor_xml))
+        if isinstance(condor_xml, basestring):
+            condor_xml = StringIO(condor_xml)
+
+        context = etree.iterparse(condor_xml)
         for action, elem in context:
             if elem.tag == "item" and elem.getparent().tag == "result":
-                xml_machine = elem
-                machine = {}
-                for item in xml_machine.iter("item"):
-                    name = _item_attribute(item, "name")
-                    value = _item_attribute(item, "value")
-                    machine[name] = value
-
-                machines.append(machine)
+                machines.append(utilities.xml_classad_attributes(elem, keep_last=True))
                 elem.clear()
+                while elem.getprevious() != None:
+                    del elem.getparent()[0]
 
         return machines
 
@@ -815,31 +969,26 @@ class ResourcePool:
 
     def get_vmtypes_count_internal(self):
         """Get a dictionary of uservmtypes of VMs the scheduler is currently tracking."""
-        types = {}
-        for cluster in self.resources:
-            for vm in cluster.vms:
-                if vm.uservmtype in types:
-                    types[vm.uservmtype] += 1
-                else:
-                    types[vm.uservmtype] = 1
-        return types
+        return self.vm_table.count_by_type()
 
     def vm_count(self):
         """Count of VMs in the system."""
-        count = 0
-        for cluster in self.resources:
-            count = count + len(cluster.vms)
-        return count
+        return len(self.vm_table)
+
+    def get_vm_generation(self):
+        """Returns a value which changes whenever a VM is added to or removed
+        from a cluster, or the clusters are set up again. The VM distributions
+        only need to be worked out again when it changes."""
+        return self.vm_table.generation
 
     def vmtype_slot_distribution(self):
         """VM Type Distribution."""
         types = self.get_vmtypes_count_internal()
-        count = Decimal(self.vm_count())
+        count = self.vm_count()
         if count == 0:
             return {}
-        count = 1 / count
         for vmtype in types.keys():
-            types[vmtype] *= count
+            types[vmtype] = Fraction(types[vmtype], count)
         return types
 
     def vmtype_mem_distribution(self):
@@ -853,9 +1002,8 @@ class ResourcePool:
         del usage
         if mem_total == 0:
             return {}
-        mem_total = 1 / Decimal(mem_total)
         for vmtype in types.keys():
-            types[vmtype] *= mem_total
+            types[vmtype] = Fraction(types[vmtype], mem_total)
         return types
 
     def vmtype_mem_cpu_distribution(self):
@@ -870,9 +1018,8 @@ class ResourcePool:
         del usage
         if mem_cpu_total == 0:
             return {}
-        mem_cpu_total = 1 / Decimal(mem_cpu_total)
         for vmtype in types.keys():
-            types[vmtype] *= mem_cpu_total
+            types[vmtype] = Fraction(types[vmtype], mem_cpu_total)
         return types
 
     def vmtype_mem_cpu_storage_distribution(self):
@@ -886,18 +1033,16 @@ class ResourcePool:
             vol = 0
             if usage[vmtype][2] != 0:
                 vol = usage[vmtype][0] * usage[vmtype][1] * usage[vmtype][2] * weight_all
-                types[vmtype] = Decimal(str(vol))
             else:
                 vol = usage[vmtype][0] * usage[vmtype][1] * weight_cm
-                types[vmtype] = Decimal(str(vol))
+            vol = Fraction(vol)
+            types[vmtype] = vol
             vol_total += vol
         del usage
         if vol_total == 0:
             return {}
-        if vol_total != 0:
-            mem_cpu_storage_total = 1 / Decimal(str(vol_total))
         for vmtype in types.keys():
-            types[vmtype] *= mem_cpu_storage_total
+            types[vmtype] /= vol_total
         return types
 
     # Skipped creating an alternate usertypes version of this function
@@ -923,18 +1068,7 @@ class ResourcePool:
         Counts up how much/many of each resource (RAM, Cores, Storage)
         are being used by each type of VM
         """
-        types = {}
-        for cluster in self.resources:
-            for vm in cluster.vms:
-                if vm.uservmtype in types.keys():
-                    types[vm.uservmtype].append([vm.memory, vm.cpucores, vm.storage])
-                else:
-                    types[vm.uservmtype] = []
-                    types[vm.uservmtype].append([vm.memory, vm.cpucores, vm.storage])
-        results = {}
-        for vmtype in types.keys():
-            results[vmtype] = [sum(values) for values in zip(*types[vmtype])]
-        return results
+        return self.vm_table.usage_by_type()
 
     #def vm_slots_used(self):
         #types = {}
@@ -951,17 +1085,12 @@ class ResourcePool:
 
     def vm_slots_used(self):
         """Figure out the actual number of 'slots' being used when some VMs are using multi-job settings."""
-        types = {}
-        for cluster in self.resources:
-            for vm in cluster.vms:
-                if not types.has_key(vm.uservmtype):
-                    types[vm.uservmtype] = []
-                if hasattr(vm, "job_per_core") and vm.job_per_core:
-                    for core in range(vm.cpucores):
-                        types[vm.uservmtype].append({'memory': vm.memory, 'cores': 1, 'storage': vm.storage})
-                else:
-                    types[vm.uservmtype].append({'memory': vm.memory, 'cores': vm.cpucores, 'storage': vm.storage})
-        return types
+        return self.vm_table.slots_by_type()
+
+    def count_vm_slots(self, uservmtype, cores, memory, storage):
+        """Count the job slots with the given cores, memory and storage on
+        VMs of a uservmtype. A job_per_core VM has one single core slot per core."""
+        return self.vm_table.count_slots(uservmtype, cores, memory, storage)
 
     def machine_jobs_changed(self, current, previous):
         """Take the current and previous machineLists
@@ -1035,7 +1164,7 @@ class ResourcePool:
                     if new_cluster:
                         try:
                             new_cluster.resource_checkout(vm)
-                            new_cluster.vms.append(vm)
+                            new_cluster.add_vm(vm)
                             log.info("Persisted VM %s on %s." % (vm.id, new_cluster.name))
                         except cluster_tools.NoResourcesError, e:
                             log.warning("Shutting down vm %s on %s, because you no longer have enough %s" %
@@ -1073,9 +1202,10 @@ class ResourcePool:
                     queue.append(value)
                     self.failures[job.req_imageloc].append(queue)
             elif cluster.__class__.__name__ == 'EC2Cluster':
-                if job.req_ami in self.failures.keys():
+                ami = self._ami_for(job.req_ami, cluster)
+                if ami in self.failures.keys():
                     foundIt = False
-                    for resource in self.failures[job.req_ami]:
+                    for resource in self.failures[ami]:
                         if resource.name == cluster.name:
                             resource.append(value)
                             foundIt = True
@@ -1084,12 +1214,24 @@ class ResourcePool:
                         else:
                             queue = ErrTrackQueue(cluster.name)
                             queue.append(value)
-                            self.failures[job.req_ami].append(queue)
+                            self.failures[ami].append(queue)
                 else:
-                    self.failures[job.req_ami] = []
+                    self.failures[ami] = []
                     queue = ErrTrackQueue(cluster.name)
                     queue.append(value)
-                    self.failures[job.req_ami].append(queue)
+                    self.failures[ami].append(queue)
+
+    @staticmethod
+    def _ami_for(ami, cluster):
+        """Returns the AMI an EC2 cluster boots for a job's AMI requirement.
+
+        A job's req_ami is a dict of cloud address to AMI, with a 'default'
+        entry, as in vm_create. The AMI string is what failures and
+        banned_job_resource are keyed on, so the ban file can be saved as JSON.
+        """
+        if isinstance(ami, dict):
+            return ami.get(cluster.network_address, ami.get("default"))
+        return ami
 
     def check_failures(self):
         """Check if failures have crossed the threshold and ban job from resources."""
@@ -1108,6 +1250,7 @@ class ResourcePool:
                             self.banned_job_resource[img].append(cq.name)
                             banned_changed = True
             if banned_changed:
+                self.ban_generation += 1
                 self.save_banned_job_resource()
                 log.debug("Updating Banned job file")
 
@@ -1175,6 +1318,7 @@ class ResourcePool:
                                 if foundit:
                                     break
             self.banned_job_resource = updated_ban
+            self.ban_generation += 1
 
     def do_condor_off(self, machine_name, machine_addr):
         """Perform a condor_off on an execute node.
@@ -24,6 +24,7 @@ import tempfile
 import subprocess
 import threading
 
+from bisect import bisect_left, insort
 from subprocess import Popen
 from urlparse import urlparse
 
@@ -281,6 +282,7 @@ class ICluster:
         self.cloud_type = cloud_type
         self.memory = memory
         self.max_mem = tuple(memory)
+        self._index_memory()
         self.cpu_archs = cpu_archs
         self.network_pools = networks
         self.vm_slots = vm_slots
@@ -288,6 +290,7 @@ class ICluster:
         self.storageGB = storage
         self.max_storageGB = (storage)
         self.vms = [] # List of running VMs
+        self.vm_listeners = [] # Told about each VM added or removed
         self.vms_lock = threading.RLock()
         self.res_lock = threading.RLock()
 
@@ -298,12 +301,45 @@ class ICluster:
         state = self.__dict__.copy()
         del state['vms_lock']
         del state['res_lock']
+        del state['vm_listeners']
         return state
 
     def __setstate__(self, state):
         self.__dict__ = state
+        self.vm_listeners = []
         self.vms_lock = threading.RLock()
         self.res_lock = threading.RLock()
+        self._index_memory()
+
+    def add_vm_listener(self, listener):
+        """Have listener.vm_added(cluster, vm) and listener.vm_removed(cluster, vm)
+        called as VMs are added to and removed from the cluster, and
+        listener.resources_changed(cluster) called as resources are checked
+        out and returned.
+        """
+        if listener not in self.vm_listeners:
+            self.vm_listeners.append(listener)
+
+    def remove_vm_listener(self, listener):
+        if listener in self.vm_listeners:
+            self.vm_listeners.remove(listener)
+
+    def add_vm(self, vm):
+        """Add a VM to the cluster's list of VMs."""
+        with self.vms_lock:
+            self.vms.append(vm)
+            for listener in self.vm_listeners:
+                listener.vm_added(self, vm)
+
+    def remove_vm(self, vm):
+        """Remove a VM from the cluster's list of VMs.
+
+        Raises ValueError if the VM isn't in the list.
+        """
+        with self.vms_lock:
+            self.vms.remove(vm)
+            for listener in self.vm_listeners:
+                listener.vm_removed(self, vm)
 
     def setup_logging(self):
         global log
@@ -405,17 +441,72 @@ class ICluster:
     #         list.
     #         If no fitting memory entries are found, returns -1 (error!)
     def find_mementry(self, memory):
-        # Check for exact fit
-        if (memory in self.memory):
-            return self.memory.index(memory)
-
-        # Scan for any fit
-        for i in range(len(self.memory)):
-            if self.memory[i] >= memory:
-                return i
-
-        # If no entries found, return error code.
-        return(-1)
+        with self.res_lock:
+            entries = self.free_memory
+            # If no entries found, return error code.
+            if not entries or entries[-1][0] < memory:
+                return(-1)
+
+            # Check for exact fit
+            i = bisect_left(entries, (memory, -1))
+            if entries[i][0] == memory:
+                return entries[i][1]
+
+            # First of the entries which fit: walk down memory_tree, taking
+            # the left half whenever some entry in it has enough free memory
+            tree = self.memory_tree
+            node = 1
+            while node < len(tree) / 2:
+                node *= 2
+                if tree[node] < memory:
+                    node += 1
+            return node - len(tree) / 2
+
+    # Finds the memory entry the VM fits in most tightly: the one with the
+    # least free memory of those with enough. Returns -1 if none fit.
+    def find_best_mementry(self, memory):
+        with self.res_lock:
+            i = bisect_left(self.free_memory, (memory, -1))
+            if i == len(self.free_memory):
+                return(-1)
+            return self.free_memory[i][1]
+
+    # Picks the memory entry to start a VM in, as set by placement_policy.
+    def pick_mementry(self, memory):
+        if config.placement_policy.lower() == "best_fit":
+            return self.find_best_mementry(memory)
+        return self.find_mementry(memory)
+
+    # Rebuilds free_memory, the (free memory, index) pairs of the Cluster's
+    # 'memory' list sorted by free memory, and memory_tree, which
+    # find_mementry() search. memory_tree is a binary tree in a list, with
+    # the entries of 'memory' as its leaves and the most free memory under
+    # each node in the node, so the first entry with enough free memory is
+    # found in one walk from the root.
+    def _index_memory(self):
+        self.free_memory = sorted([(self.memory[i], i) for i in range(len(self.memory))])
+        leaves = 1
+        while leaves < len(self.memory):
+            leaves *= 2
+        self.memory_tree = [-1] * leaves + list(self.memory) + [-1] * (leaves - len(self.memory))
+        for node in range(leaves - 1, 0, -1):
+            self.memory_tree[node] = max(self.memory_tree[2 * node], self.memory_tree[2 * node + 1])
+
+    # Sets the free memory of a memory entry, keeping free_memory sorted and
+    # memory_tree up to date.
+    def _set_mementry(self, mementry, value):
+        del self.free_memory[bisect_left(self.free_memory, (self.memory[mementry], mementry))]
+        self.memory[mementry] = value
+        insort(self.free_memory, (value, mementry))
+        node = len(self.memory_tree) / 2 + mementry
+        self.memory_tree[node] = value
+        while node > 1:
+            node /= 2
+            self.memory_tree[node] = max(self.memory_tree[2 * node], self.memory_tree[2 * node + 1])
+
+    def _resources_changed(self):
+        for listener in self.vm_listeners:
+            listener.resources_changed(self)
 
     def find_potential_mementry(self, memory):
         potential_fit = False
@@ -454,7 +545,8 @@ class ICluster:
             # Otherwise, we can check out these resources
             self.vm_slots = remaining_vm_slots
             self.storageGB = remaining_storage
-            self.memory[vm.mementry] = remaining_memory
+            self._set_mementry(vm.mementry, remaining_memory)
+            self._resources_changed()
 
     # Returns the resources taken by the passed in VM to the Cluster's internal
     # storage.
@@ -467,9 +559,10 @@ class ICluster:
             self.storageGB += vm.storage
             # ISSUE: No way to know what mementry a VM is running on
             try:
-                self.memory[vm.mementry] += vm.memory
+                self._set_mementry(vm.mementry, self.memory[vm.mementry] + vm.memory)
             except:
                 log.warning("Couldn't return memory because I don't know about that mem entry anymore...")
+            self._resources_changed()
 
 
 class NimbusCluster(ICluster):
@@ -629,7 +722,7 @@ class NimbusCluster(ICluster):
 
         # Find the memory entry in the Cluster 'memory' list which _create will be
         # subtracted from
-        vm_mementry = self.find_mementry(vm_mem)
+        vm_mementry = self.pick_mementry(vm_mem)
         if (vm_mementry < 0):
             # At this point, there should always be a valid mementry, as the ResourcePool
             # get_resource methods have selected this cluster based on having an open
@@ -669,7 +762,7 @@ class NimbusCluster(ICluster):
             myproxy_server_port = myproxy_server_port, job_per_core = job_per_core)
 
         # Add the new VM object to the cluster's vms list And check out required resources
-        self.vms.append(new_vm)
+        self.add_vm(new_vm)
         try:
             self.resource_checkout(new_vm)
         except:
@@ -741,7 +834,7 @@ class NimbusCluster(ICluster):
         # Return checked out resources And remove VM from the Cluster's 'vms' list
         with self.vms_lock:
             try:
-                self.vms.remove(vm)
+                self.remove_vm(vm)
             except ValueError:
                 log.error("Attempted to remove vm from list that was already removed.")
                 return_resources = False
@@ -1035,6 +1128,7 @@ class NimbusCluster(ICluster):
                 raise NoResourceError("net_slots: " + vm.network)
             ICluster.resource_checkout(self, vm)
             self.net_slots[vm.network] = remaining_net_slots
+            self._resources_changed()
 
     # Returns the resources taken by the passed in VM to the Cluster's internal
     # storage.
@@ -1044,6 +1138,7 @@ class NimbusCluster(ICluster):
         with self.res_lock:
             self.net_slots[vm.network] += 1
             ICluster.resource_return(self, vm)
+            self._resources_changed()
 
 
 class EC2Cluster(ICluster):
@@ -1236,7 +1331,7 @@ class EC2Cluster(ICluster):
             log.exception("Problem creating EC2 instance on on %s" % self.name)
             return self.ERROR
 
-        vm_mementry = self.find_mementry(vm_mem)
+        vm_mementry = self.pick_mementry(vm_mem)
         if (vm_mementry < 0):
             #TODO: this is kind of pointless with EC2...
             log.debug("Cluster memory list has no sufficient memory " +\
@@ -1264,7 +1359,7 @@ class EC2Cluster(ICluster):
             self.vm_destroy(new_vm)
             return self.ERROR
 
-        self.vms.append(new_vm)
+        self.add_vm(new_vm)
 
         return 0
 
@@ -1348,7 +1443,7 @@ class EC2Cluster(ICluster):
         if return_resources:
             self.resource_return(vm)
         with self.vms_lock:
-            self.vms.remove(vm)
+            self.remove_vm(vm)
 
         return 0
 
@@ -18,10 +18,14 @@ import utilities
 
 # Set default values
 condor_webservice_url = "http://localhost:8080"
+condor_schedd_urls = []
 condor_collector_url = "http://localhost:9618"
 condor_retrieval_method = "soap"
 condor_q_command = "condor_q -l"
 condor_status_command = "condor_status -l"
+condor_attribute_projection = False
+parse_processes = 0
+condor_soap_streaming = False
 condor_off_command = "/usr/sbin/condor_off"
 condor_on_command = "/usr/sbin/condor_on"
 ssh_path = "/usr/bin/ssh"
@@ -56,6 +60,7 @@ retire_before_lifetime = False
 retire_before_lifetime_factor = 1.5
 getclouds = False
 scheduling_metric = "slot"
+placement_policy = "balanced"
 scheduling_algorithm = "fairshare"
 job_distribution_type = "normal"
 high_priority_job_support = False
@@ -66,8 +71,12 @@ storage_distribution_weight = 1.0
 cleanup_interval = 5
 vm_poller_interval = 5
 job_poller_interval = 5
+job_delta_polling = False
+job_full_resync_interval = 300
+job_container_shards = 1
 machine_poller_interval = 5
 scheduler_interval = 5
+scheduler_batch_size = 1
 job_proxy_refresher_interval = -1 # The current default is not to refresh the job proxies. (until code is thouroughly tested -- Andre C.)
 job_proxy_renewal_threshold = 15 * 60 # 15 minutes default
 vm_proxy_refresher_interval = -1 # The current default is not to refresh the VM proxies. (until code is thouroughly tested -- Andre C.)
@@ -108,9 +117,13 @@ def setup(path=None):
     """
 
     global condor_webservice_url
+    global condor_schedd_urls
     global condor_collector_url
     global condor_retrieval_method
     global condor_q_command
+    global condor_attribute_projection
+    global parse_processes
+    global condor_soap_streaming
     global condor_status_command
     global condor_off_command
     global condor_on_command
@@ -146,6 +159,7 @@ def setup(path=None):
     global retire_before_lifetime_factor
     global getclouds
     global scheduling_metric
+    global placement_policy
     global scheduling_algorithm
     global job_distribution_type
     global high_priority_job_support
@@ -156,8 +170,12 @@ def setup(path=None):
     global cleanup_interval
     global vm_poller_interval
     global job_poller_interval
+    global job_delta_polling
+    global job_full_resync_interval
+    global job_container_shards
     global machine_poller_interval
     global scheduler_interval
+    global scheduler_batch_size
     global job_proxy_refresher_interval
     global job_proxy_renewal_threshold
     global vm_proxy_refresher_interval
@@ -248,10 +266,30 @@ def setup(path=None):
         condor_status_command = config_file.get("global",
                                                 "condor_status_command")
 
+    if config_file.has_option("global", "condor_attribute_projection"):
+        condor_attribute_projection = config_file.getboolean("global",
+                                                "condor_attribute_projection")
+
+    if config_file.has_option("global", "parse_processes"):
+        try:
+            parse_processes = config_file.getint("global", "parse_processes")
+        except ValueError:
+            print "Configuration file problem: parse_processes must be an " \
+                  "integer value."
+            sys.exit(1)
+
+    if config_file.has_option("global", "condor_soap_streaming"):
+        condor_soap_streaming = config_file.getboolean("global",
+                                                "condor_soap_streaming")
+
     if config_file.has_option("global", "condor_webservice_url"):
         condor_webservice_url = config_file.get("global",
                                                 "condor_webservice_url")
 
+    if config_file.has_option("global", "condor_schedd_urls"):
+        condor_schedd_urls = [url.strip() for url in config_file.get("global",
+                                "condor_schedd_urls").split(',') if url.strip()]
+
     if config_file.has_option("global", "condor_collector_url"):
         condor_collector_url = config_file.get("global",
                                                 "condor_collector_url")
@@ -394,6 +432,13 @@ def setup(path=None):
     if config_file.has_option("global", "scheduling_metric"):
         scheduling_metric = config_file.get("global", "scheduling_metric")
 
+    if config_file.has_option("global", "placement_policy"):
+        placement_policy = config_file.get("global", "placement_policy")
+        if placement_policy.lower() not in ("balanced", "best_fit"):
+            print "Configuration file problem: placement_policy must be " \
+                  "balanced or best_fit."
+            sys.exit(1)
+
     if config_file.has_option("global", "job_distribution_type"):
         job_distribution_type = config_file.get("global", "job_distribution_type")
 
@@ -452,6 +497,14 @@ def setup(path=None):
                   "integer value."
             sys.exit(1)
 
+    if config_file.has_option("global", "scheduler_batch_size"):
+        try:
+            scheduler_batch_size = config_file.getint("global", "scheduler_batch_size")
+        except ValueError:
+            print "Configuration file problem: scheduler_batch_size must be an " \
+                  "integer value."
+            sys.exit(1)
+
     if config_file.has_option("global", "vm_poller_interval"):
         try:
             vm_poller_interval = config_file.getint("global", "vm_poller_interval")
@@ -468,6 +521,25 @@ def setup(path=None):
                   "integer value."
             sys.exit(1)
 
+    if config_file.has_option("global", "job_delta_polling"):
+        job_delta_polling = config_file.getboolean("global", "job_delta_polling")
+
+    if config_file.has_option("global", "job_full_resync_interval"):
+        try:
+            job_full_resync_interval = config_file.getint("global", "job_full_resync_interval")
+        except ValueError:
+            print "Configuration file problem: job_full_resync_interval must be an " \
+                  "integer value."
+            sys.exit(1)
+
+    if config_file.has_option("global", "job_container_shards"):
+        try:
+            job_container_shards = config_file.getint("global", "job_container_shards")
+        except ValueError:
+            print "Configuration file problem: job_container_shards must be an " \
+                  "integer value."
+            sys.exit(1)
+
     if config_file.has_option("global", "machine_poller_interval"):
         try:
             machine_poller_interval = config_file.getint("global", "machine_poller_interval")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# vim: set expandtab ts=4 sw=4:
+
+# Copyright (C) 2009 University of Victoria
+# You may distribute under the terms of either the GNU General Public
+# License or the Apache v2 License, as specified in the README file.
+
+## FAIR SHARE
+##
+## Works out how far the VMs in the resource pool are from a fair share of
+## the jobs in the job pool. The VM distribution, job distribution and their
+## difference are kept for as long as the VMs and jobs they were worked out
+## from stay the same, and handed to every thread asking for them in the
+## meantime.
+##
+
+from __future__ import with_statement
+import math
+import time
+import logging
+import threading
+
+log = logging.getLogger("cloudscheduler")
+
+
+class DiffTypes(dict):
+    """The difference between the VM and job distributions, by uservmtype.
+
+    A negative value means more VMs of that type are needed. The dictionary
+    is shared between threads, so it should not be changed.
+
+    version - The (job generation, VM generation) it was worked out from
+    current - (dict) The VM distribution it was worked out from
+    desired - (dict) The job distribution it was worked out from
+    timestamp - (float) When it was worked out
+    """
+
+    def __init__(self, version, current, desired):
+        dict.__init__(self, compute_diff_types(current, desired))
+        self.version = version
+        self.current = current
+        self.desired = desired
+        self.timestamp = time.time()
+
+
+def compute_diff_types(current_types, desired_types):
+    """Subtract the desired from the current distribution of each type."""
+    diff_types = {}
+    for vmtype in current_types.keys():
+        if vmtype in desired_types.keys():
+            diff_types[vmtype] = current_types[vmtype] - desired_types[vmtype]
+        else:
+            diff_types[vmtype] = 1 # changed from 0 to handle users with multiple job types
+    for vmtype in desired_types.keys():
+        if vmtype not in current_types.keys():
+            diff_types[vmtype] = -desired_types[vmtype]
+    return diff_types
+
+
+class FairShare:
+    """Keeps the current DiffTypes of a resource pool and a job pool."""
+
+    def __init__(self, resource_pool, job_pool):
+        """
+        resource_pool - (ResourcePool) The VMs to compare
+        job_pool      - (JobPool) The jobs to compare them to
+        """
+        self.resource_pool = resource_pool
+        self.job_pool = job_pool
+        self.diff_types = None
+        self.lock = threading.Lock()
+
+    def get_version(self):
+        return (self.job_pool.job_container.get_generation(),
+                self.resource_pool.get_vm_generation())
+
+    def get_diff_types(self):
+        """Returns the DiffTypes of the pools as they are now.
+
+        The distributions are only worked out again if a job or VM has
+        changed since the last call.
+        """
+        with self.lock:
+            version = self.get_version()
+            if self.diff_types == None or self.diff_types.version != version:
+                self.diff_types = DiffTypes(version,
+                        self.resource_pool.vmtype_distribution(),
+                        self.job_pool.job_type_distribution())
+                log.verbose("Worked out diff_types %s: %s" % (str(version), str(self.diff_types)))
+            return self.diff_types
+
+    def vms_to_share(self, diff_types, uservmtype):
+        """Returns how many more VMs of a uservmtype it takes for the type to
+        have its desired share of the VMs in diff_types, or None if it should
+        have all of them. VMs are counted as in the slot scheduling metric.
+        At least 1 is returned, as the scheduler only asks when it is going
+        to start a VM of the type.
+        """
+        desired = diff_types.desired.get(uservmtype, 0)
+        if desired >= 1:
+            return None
+        total = self.resource_pool.vm_count()
+        current = self.resource_pool.get_vmtypes_count_internal().get(uservmtype, 0)
+        # Starting n VMs of the type gives it (current + n) / (total + n) of them
+        needed = (desired * total - current) / (1 - desired)
+        return max(1, int(math.ceil(needed)))
@@ -151,43 +151,43 @@ class InfoServer(threading.Thread,):
                     return "You need to have Guppy installed to get developer " \
                            "information" 
             def get_newjobs(self):
-                jobs = job_pool.job_container.get_unscheduled_jobs()
+                jobs = job_pool.get_snapshot().get_unscheduled_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_schedjobs(self):
-                jobs = job_pool.job_container.get_scheduled_jobs()
+                jobs = job_pool.get_snapshot().get_scheduled_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_highjobs(self):
-                jobs = job_pool.job_container.get_high_priority_jobs()
+                jobs = job_pool.get_snapshot().get_high_priority_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_idlejobs(self):
-                jobs = job_pool.job_container.get_idle_jobs()
+                jobs = job_pool.get_snapshot().get_idle_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_runningjobs(self):
-                jobs = job_pool.job_container.get_running_jobs()
+                jobs = job_pool.get_snapshot().get_running_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_completejobs(self):
-                jobs = job_pool.job_container.get_complete_jobs()
+                jobs = job_pool.get_snapshot().get_complete_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
                 return output
             def get_heldjobs(self):
-                jobs = job_pool.job_container.get_held_jobs()
+                jobs = job_pool.get_snapshot().get_held_jobs()
                 output = Job.get_job_info_header()
                 for job in jobs:
                     output += job.get_job_info()
@@ -226,18 +226,10 @@ class InfoServer(threading.Thread,):
                         output += " Avg: %d " % (int(total_time) / len(cluster.vms))
                 return output
             def get_diff_types(self):
-                current_types = cloud_resources.vmtype_distribution()
-                desired_types = job_pool.job_type_distribution()
                 # Negative difference means will need to create that type
-                diff_types = {}
-                for type in current_types.keys():
-                    if type in desired_types.keys():
-                        diff_types[type] = current_types[type] - desired_types[type]
-                    else:
-                        diff_types[type] = 1 # changed from 0 to handle users with multiple job types
-                for type in desired_types.keys():
-                    if type not in current_types.keys():
-                        diff_types[type] = -desired_types[type]
+                diff_types = scheduler.fair_share.get_diff_types()
+                current_types = diff_types.current
+                desired_types = diff_types.desired
                 output = "Diff Types dictionary\n"
                 for key, value in diff_types.iteritems():
                     output += "type: %s, dist: %f\n" % (key, value)
@@ -348,11 +340,12 @@ class JobPoolJSONEncoder(json.JSONEncoder):
         if not isinstance(job_pool, JobPool):
             log.error("Cannot use JobPoolJSONEncoder on non JobPool Object")
             return
+        snapshot = job_pool.get_snapshot()
         new_queue = []
-        for job in job_pool.job_container.get_unscheduled_jobs():
+        for job in snapshot.get_unscheduled_jobs():
             new_queue.append(JobJSONEncoder().encode(job))
         sched_queue = []
-        for job in job_pool.job_container.get_scheduled_jobs():
+        for job in snapshot.get_scheduled_jobs():
             sched_queue.append(JobJSONEncoder().encode(job))
         new_decodes = []
         for job in new_queue:
@@ -361,4 +354,5 @@ class JobPoolJSONEncoder(json.JSONEncoder):
         sched_decodes = []
         for job in sched_queue:
             sched_decodes.append(job)
-        return {'new_jobs': new_decodes, 'sched_jobs': sched_decodes}
+        return {'new_jobs': new_decodes, 'sched_jobs': sched_decodes,
+                'generation': snapshot.generation, 'timestamp': str(snapshot.timestamp)}
@@ -1,5 +1,8 @@
 from abc import ABCMeta, abstractmethod
 import time
+import heapq
+import datetime
+import bisect
 import threading
 import logging
 import cloudscheduler.config as config
@@ -7,6 +10,235 @@ import cloudscheduler.config as config
 # Use this global variable for logging.
 log = None
 
+#
+# The fields of a job already held by a container which can change between
+# two job queries. Job queries produce these instead of full Job objects for
+# the jobs a container already has, see JobContainer.sync_jobs.
+#
+class JobStatusUpdate(object):
+    __slots__ = ('id', 'job_status', 'remote_host', 'servertime', 'jobstarttime')
+
+    def __init__(self, id, job_status, remote_host, servertime, jobstarttime):
+        self.id = id
+        self.job_status = job_status
+        self.remote_host = remote_host
+        self.servertime = servertime
+        self.jobstarttime = jobstarttime
+
+    def __repr__(self):
+        return "JobStatusUpdate '%s'" % self.id
+
+
+#
+# Jobs grouped by a key, with each group kept sorted from high to low job
+# priority (jobs of equal priority are ordered by id). Groups are updated as
+# jobs are added and removed, so reading them doesn't need a sort. A job's
+# priority must not change while it is in the index.
+# A group is a pair of Python lists: finding a job's place is a bisect, but
+# inserting or deleting it moves the jobs after it, so adding or removing one
+# job is O(group size). add_many and remove_many do a whole batch in one pass.
+#
+class _PriorityIndex(object):
+
+    def __init__(self):
+        # key -> (list of sort keys, list of jobs in the same order)
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def add(self, key, job):
+        if key not in self.groups:
+            self.groups[key] = ([], [])
+        sort_keys, jobs = self.groups[key]
+        sort_key = (-job.priority, job.id)
+        i = bisect.bisect_left(sort_keys, sort_key)
+        sort_keys.insert(i, sort_key)
+        jobs.insert(i, job)
+
+    def remove(self, key, job):
+        if key not in self.groups:
+            return
+        sort_keys, jobs = self.groups[key]
+        sort_key = (-job.priority, job.id)
+        i = bisect.bisect_left(sort_keys, sort_key)
+        if i < len(sort_keys) and sort_keys[i] == sort_key:
+            del sort_keys[i]
+            del jobs[i]
+            if not sort_keys:
+                del self.groups[key]
+
+    # Adds several jobs to one group, merging them in with a single pass.
+    def add_many(self, key, new_jobs):
+        if len(new_jobs) == 1:
+            self.add(key, new_jobs[0])
+            return
+        new_pairs = [((-job.priority, job.id), job) for job in new_jobs]
+        new_pairs.sort(key=lambda pair: pair[0])
+        if key in self.groups:
+            sort_keys, jobs = self.groups[key]
+            pairs = list(heapq.merge(zip(sort_keys, jobs), new_pairs))
+        else:
+            pairs = new_pairs
+        self.groups[key] = ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+
+    # Removes several jobs from one group with a single pass.
+    def remove_many(self, key, old_jobs):
+        if len(old_jobs) == 1:
+            self.remove(key, old_jobs[0])
+            return
+        if key not in self.groups:
+            return
+        old_ids = set(job.id for job in old_jobs)
+        sort_keys, jobs = self.groups[key]
+        kept = [i for i in xrange(len(jobs)) if jobs[i].id not in old_ids]
+        if not kept:
+            del self.groups[key]
+            return
+        self.groups[key] = ([sort_keys[i] for i in kept], [jobs[i] for i in kept])
+
+    def clear(self):
+        self.groups.clear()
+
+    # Returns a copy of the jobs in one group, highest priority first.
+    def get(self, key):
+        if key not in self.groups:
+            return []
+        return list(self.groups[key][1])
+
+    # Returns a copy of the first N jobs in one group, or all of them if N
+    # is 0.
+    def get_first(self, key, N=0):
+        if key not in self.groups:
+            return []
+        if N > 0:
+            return self.groups[key][1][:N]
+        return list(self.groups[key][1])
+
+    # Returns a dictionary of key to a copy of the jobs in that group.
+    def as_dict(self):
+        return dict((key, list(jobs)) for key, (sort_keys, jobs) in self.groups.iteritems())
+
+
+#
+# The jobs of one user with one VM type (req_vmtype) in a JobContainerView.
+# Segments are built from the container and never modified, so views share
+# the segments whose jobs have not changed, and a change to a job only
+# rebuilds the segment of its user and VM type.
+#
+class _JobSegment(object):
+    __slots__ = ('unscheduled', 'scheduled', 'by_status', 'high_priority')
+
+    def __init__(self, jobs):
+        unscheduled = []
+        scheduled = []
+        by_status = {}
+        high_priority = []
+        for job in jobs:
+            if job.status == "Unscheduled":
+                unscheduled.append(job)
+            else:
+                scheduled.append(job)
+            by_status.setdefault(job.job_status, []).append(job)
+            if job.high_priority:
+                high_priority.append(job)
+        self.unscheduled = tuple(unscheduled)
+        self.scheduled = tuple(scheduled)
+        self.by_status = dict((job_status, tuple(status_jobs)) for job_status, status_jobs in by_status.iteritems())
+        self.high_priority = tuple(high_priority)
+
+
+class JobContainerView(object):
+    """
+    JobContainerView - An immutable view of the jobs in a container at one
+    generation, see JobContainer.get_view().
+
+    Readers can iterate a view without holding the container lock while the
+    container goes on changing. The Job objects are shared with the
+    container, so fields like job.status go on changing; which jobs are in
+    the view, whether they were scheduled, and which job_status and high
+    priority views they are in when it was taken, does not.
+    """
+
+    def __init__(self, generation, segments):
+        """
+        generation - (int) The container's generation when the view was taken
+        segments   - (dict) (user, req_vmtype) to _JobSegment; must not be
+                     modified later
+        """
+        self.generation = generation
+        self.timestamp = datetime.datetime.now()
+        self.segments = segments
+        self.num_jobs = sum(len(segment.unscheduled) + len(segment.scheduled)
+                            for segment in segments.itervalues())
+        self.jobs_by_id = None
+        self.segments_by_user = None
+
+    def __len__(self):
+        return self.num_jobs
+
+    def __repr__(self):
+        return "JobContainerView %d [%s, %d jobs]" % (self.generation, self.timestamp, len(self))
+
+    # Returns a dictionary of user to the user's segments. Like the id map,
+    # it is only built if asked for.
+    def _get_segments_by_user(self):
+        if self.segments_by_user == None:
+            segments_by_user = {}
+            for (user, vmtype), segment in self.segments.iteritems():
+                segments_by_user.setdefault(user, []).append(segment)
+            self.segments_by_user = segments_by_user
+        return self.segments_by_user
+
+    def get_users(self):
+        return self._get_segments_by_user().keys()
+
+    def get_all_jobs(self):
+        return self.get_unscheduled_jobs() + self.get_scheduled_jobs()
+
+    def get_job_by_id(self, jobid):
+        # The id map is only built if asked for. Two readers may both build
+        # it, which is harmless as they build the same map.
+        if self.jobs_by_id == None:
+            self.jobs_by_id = dict((job.id, job) for job in self.get_all_jobs())
+        return self.jobs_by_id.get(jobid)
+
+    def get_jobs_for_user(self, user):
+        jobs = []
+        for segment in self._get_segments_by_user().get(user, ()):
+            jobs.extend(segment.unscheduled + segment.scheduled)
+        return jobs
+
+    def get_unscheduled_jobs(self):
+        return [job for segment in self.segments.itervalues() for job in segment.unscheduled]
+
+    def get_scheduled_jobs(self):
+        return [job for segment in self.segments.itervalues() for job in segment.scheduled]
+
+    def get_high_priority_jobs(self):
+        return [job for segment in self.segments.itervalues() for job in segment.high_priority]
+
+    def get_jobs_with_status(self, job_status):
+        return [job for segment in self.segments.itervalues()
+                for job in segment.by_status.get(job_status, ())]
+
+    def get_idle_jobs(self):
+        IDLE = 1
+        return self.get_jobs_with_status(IDLE)
+
+    def get_running_jobs(self):
+        RUNNING = 2
+        return self.get_jobs_with_status(RUNNING)
+
+    def get_complete_jobs(self):
+        COMPLETE = 4
+        return self.get_jobs_with_status(COMPLETE)
+
+    def get_held_jobs(self):
+        HELD = 5
+        return self.get_jobs_with_status(HELD)
+
+
 #
 # This is an abstract base class; do not intantiate directly.
 #
@@ -80,6 +312,19 @@ class JobContainer():
     def remove_all_not_in(self, jobs_to_keep):
         pass
 
+    # Synchronizes the container with the complete list of jobs given by a job
+    # query, in a single pass and under a single lock acquisition:
+    #  - jobs in the container but not in the given list are removed,
+    #  - jobs in the given list but not in the container are added,
+    #  - jobs in both have their status, remote host and times updated.
+    # The given list may hold JobStatusUpdate objects in place of jobs the
+    # container already has; these are ignored if the job is no longer there.
+    # Returns a tuple of lists (added, removed, changed) where changed holds
+    # the container jobs whose status, remote host or start time changed.
+    @abstractmethod
+    def sync_jobs(self, jobs):
+        pass
+
     # Updates the status and remote host of a job (job.job_status attribute) 
     # in the container.
     # Returns True if the job was found in the container, False otherwise.
@@ -87,6 +332,53 @@ class JobContainer():
     def update_job_status(self, jobid, status, remote):
         pass
 
+    # Bans a job from being scheduled for config.job_ban_timeout seconds, and
+    # sets its override_status to the given reason (like "TempBanned").
+    # Jobs must be banned through the container so its counts stay correct.
+    # Returns True if the job was in the container and not already banned.
+    @abstractmethod
+    def ban_job(self, job, reason):
+        pass
+
+    # Returns a JobContainerView of the jobs in the container.
+    # The container's generation goes up with every change to which jobs it
+    # holds, whether they are scheduled or banned, or their job_status. Views are
+    # rebuilt only for the (user, req_vmtype) segments whose jobs changed
+    # since the last view, and the same view is returned while the
+    # generation stays the same.
+    @abstractmethod
+    def get_view(self):
+        pass
+
+    # Returns the container's generation without taking a view, for callers
+    # which only need to know whether anything has changed.
+    @abstractmethod
+    def get_generation(self):
+        pass
+
+    # Lifts the bans which have lasted config.job_ban_timeout seconds.
+    # Returns the list of jobs which were unbanned.
+    @abstractmethod
+    def expire_bans(self, now=None):
+        pass
+
+    # Returns a list of the banned jobs in the container.
+    @abstractmethod
+    def get_banned_jobs(self):
+        pass
+
+    # Returns a dictionary of uservmtype to the number of jobs of that type
+    # which are idle or running and not banned. Types with no such jobs are
+    # left out.
+    @abstractmethod
+    def get_required_usertype_counts(self):
+        pass
+
+    # Same as get_required_usertype_counts() but keyed by the job's req_vmtype.
+    @abstractmethod
+    def get_required_vmtype_counts(self):
+        pass
+
     # Mark a job as being scheduled.
     # This will update the job's status attribute to "Scheduled".
     # Returns True if the job exist in the container and was previously unscheduled, returns False otherwise.
@@ -101,6 +393,20 @@ class JobContainer():
     def unschedule_job(self, job):
         pass
 
+    # Mark a set of jobs (by job ids, in a list) as being scheduled, all at
+    # once. Ids of jobs not in the container or already scheduled are ignored.
+    # Returns the number of jobs which were marked as scheduled.
+    @abstractmethod
+    def schedule_many(self, jobids):
+        pass
+
+    # Mark a set of jobs (by job ids, in a list) as being unscheduled, all at
+    # once. Ids of jobs not in the container or not scheduled are ignored.
+    # Returns the number of jobs which were marked as unscheduled.
+    @abstractmethod
+    def unschedule_many(self, jobids):
+        pass
+
 
 
 
@@ -186,8 +492,9 @@ class JobContainer():
     def get_high_priority_jobs_by_users(self, prioritized=False):
         pass
 
-    # Finds up to N jobs matching the requirements of the given job.
-    # If N == 0, then all matching jobs are returned.
+    # Finds up to N unscheduled jobs of the given user matching the
+    # requirements of the given job (see Job.req_signature), highest priority
+    # first. If N == 0, then all matching jobs are returned.
     @abstractmethod
     def find_unscheduled_jobs_with_matching_reqs(self, user, job, N=0):
         pass
@@ -220,6 +527,35 @@ class HashTableJobContainer(JobContainer):
     new_jobs = None
     sched_jobs = None
     jobs_by_user = None
+    # Priority ordered indexes of the unscheduled jobs, see _PriorityIndex.
+    # Banned jobs are left out of the one by signature only, which
+    # find_unscheduled_jobs_with_matching_reqs reads.
+    unsched_by_user = None
+    unsched_by_usertype = None
+    unsched_by_vmtype = None
+    unsched_by_user_type = None
+    unsched_high_by_user = None
+    unsched_by_signature = None
+    # Job counts by uservmtype and by req_vmtype, each split into buckets
+    # keyed by (job_status <= RUNNING, banned), see _count_job
+    counts_by_usertype = None
+    counts_by_vmtype = None
+    # Jobs by job_status (job_status -> {job id -> job}), and high priority jobs
+    jobs_by_status = None
+    high_jobs = None
+    # Banned jobs by id, and a heap of (ban expiry time, job id, ban_time)
+    banned_jobs = None
+    ban_expiry = None
+    # Change counter, and the state get_view() builds views from: the jobs
+    # and _JobSegment of each (user, req_vmtype), the ones changed since,
+    # and the last view
+    generation = 0
+    jobs_by_segment = None
+    segments = None
+    changed_segments = None
+    view = None
+
+    RUNNING = 2
 
     # constructor
     def __init__(self):
@@ -228,6 +564,21 @@ class HashTableJobContainer(JobContainer):
         self.new_jobs = {}
         self.sched_jobs = {}
         self.jobs_by_user = {}
+        self.unsched_by_user = _PriorityIndex()
+        self.unsched_by_usertype = _PriorityIndex()
+        self.unsched_by_vmtype = _PriorityIndex()
+        self.unsched_by_user_type = {} # user -> _PriorityIndex by req_vmtype
+        self.unsched_high_by_user = _PriorityIndex()
+        self.unsched_by_signature = _PriorityIndex() # job.req_signature -> jobs
+        self.counts_by_usertype = {}
+        self.counts_by_vmtype = {}
+        self.jobs_by_status = {}
+        self.high_jobs = {}
+        self.banned_jobs = {}
+        self.ban_expiry = []
+        self.jobs_by_segment = {}
+        self.segments = {}
+        self.changed_segments = set()
         log.debug('HashTableJobContainer instance created.')
 
     # methods
@@ -239,14 +590,25 @@ class HashTableJobContainer(JobContainer):
 
     def add_job(self, job):
         with self.lock:
+            if job.id in self.all_jobs:
+                self.remove_job(self.all_jobs[job.id])
             self.all_jobs[job.id] = job
+            self._count_job(job, 1)
+            self._add_to_status(job)
+            if job.high_priority:
+                self.high_jobs[job.id] = job
+            if job.banned:
+                self._track_ban(job)
+            self._changed(job)
             if job.user not in self.jobs_by_user:
                 self.jobs_by_user[job.user] = {}
             self.jobs_by_user[job.user][job.id] = job
+            self.jobs_by_segment.setdefault((job.user, job.req_vmtype), {})[job.id] = job
 
             # Update scheduled/unscheduled maps too:
             if(job.status == "Unscheduled"):
                 self.new_jobs[job.id] = job
+                self._index_unscheduled(job)
             else:
                 self.sched_jobs[job.id] = job
 
@@ -263,22 +625,184 @@ class HashTableJobContainer(JobContainer):
             self.jobs_by_user.clear()
             self.new_jobs.clear()
             self.sched_jobs.clear()
+            self.unsched_by_user.clear()
+            self.unsched_by_usertype.clear()
+            self.unsched_by_vmtype.clear()
+            self.unsched_by_user_type.clear()
+            self.unsched_high_by_user.clear()
+            self.unsched_by_signature.clear()
+            self.counts_by_usertype.clear()
+            self.counts_by_vmtype.clear()
+            self.jobs_by_status.clear()
+            self.high_jobs.clear()
+            self.banned_jobs.clear()
+            del self.ban_expiry[:]
+            self.jobs_by_segment.clear()
+            self.segments.clear()
+            self.changed_segments.clear()
+            self.generation += 1
             log.debug('job container cleared')
 
     def remove_job(self, job):
         with self.lock:
             if job.id in self.all_jobs:
-                del self.all_jobs[job.id]
+                stored_job = self.all_jobs.pop(job.id)
+                self._count_job(stored_job, -1)
+                self._changed(stored_job)
+                self._remove_from_status(stored_job)
+                if job.id in self.high_jobs:
+                    del self.high_jobs[job.id]
+                if job.id in self.banned_jobs:
+                    # Its entry in ban_expiry is skipped when it comes up
+                    del self.banned_jobs[job.id]
+                key = (stored_job.user, stored_job.req_vmtype)
+                del self.jobs_by_segment[key][job.id]
+                if len(self.jobs_by_segment[key]) == 0:
+                    del self.jobs_by_segment[key]
             if job.user in self.jobs_by_user and (job.id in self.jobs_by_user[job.user]):
                 del self.jobs_by_user[job.user][job.id]
                 if len(self.jobs_by_user[job.user]) == 0:
                     del self.jobs_by_user[job.user]
             if job.id in self.new_jobs:
                 del self.new_jobs[job.id]
+                self._unindex_unscheduled(job)
             if job.id in self.sched_jobs:
                 del self.sched_jobs[job.id]
             #log.debug('job %s removed from container' % job.id)
 
+    # Adds delta to the count of the bucket a job is in. Call with the lock held.
+    def _count_job(self, job, delta):
+        bucket = (job.job_status <= self.RUNNING, bool(job.banned))
+        for counts, key in ((self.counts_by_usertype, job.uservmtype),
+                            (self.counts_by_vmtype, job.req_vmtype)):
+            if key not in counts:
+                counts[key] = {}
+            counts[key][bucket] = counts[key].get(bucket, 0) + delta
+            if counts[key][bucket] == 0:
+                del counts[key][bucket]
+                if len(counts[key]) == 0:
+                    del counts[key]
+
+    # Records a change to a job for get_view(). Call with the lock held.
+    def _changed(self, job):
+        self.generation += 1
+        self.changed_segments.add((job.user, job.req_vmtype))
+
+    def get_generation(self):
+        return self.generation
+
+    def get_view(self):
+        with self.lock:
+            if self.view != None and self.view.generation == self.generation:
+                return self.view
+            for key in self.changed_segments:
+                if key in self.jobs_by_segment:
+                    self.segments[key] = _JobSegment(self.jobs_by_segment[key].itervalues())
+                elif key in self.segments:
+                    del self.segments[key]
+            self.changed_segments.clear()
+            self.view = JobContainerView(self.generation, dict(self.segments))
+            return self.view
+
+    # Adds a job to the bucket of its job_status. Call with the lock held.
+    def _add_to_status(self, job):
+        if job.job_status not in self.jobs_by_status:
+            self.jobs_by_status[job.job_status] = {}
+        self.jobs_by_status[job.job_status][job.id] = job
+
+    # Removes a job from the bucket of its job_status. Call with the lock held.
+    def _remove_from_status(self, job):
+        bucket = self.jobs_by_status.get(job.job_status)
+        if bucket != None and job.id in bucket:
+            del bucket[job.id]
+            if len(bucket) == 0:
+                del self.jobs_by_status[job.job_status]
+
+    # Returns the (index, key) pairs a job belongs to in the indexes of
+    # unscheduled jobs. Call with the lock held.
+    def _unscheduled_index_keys(self, job):
+        if job.user not in self.unsched_by_user_type:
+            self.unsched_by_user_type[job.user] = _PriorityIndex()
+        keys = [(self.unsched_by_usertype, job.uservmtype),
+                (self.unsched_by_vmtype, job.req_vmtype),
+                (self.unsched_by_user_type[job.user], job.req_vmtype)]
+        keys.append((self.unsched_by_user, job.user))
+        if job.high_priority:
+            keys.append((self.unsched_high_by_user, job.user))
+        if not job.banned:
+            keys.append((self.unsched_by_signature, job.req_signature))
+        return keys
+
+    # Groups jobs by the (index, key) pairs they belong to.
+    def _group_by_index_keys(self, jobs):
+        groups = {}
+        for job in jobs:
+            for index, key in self._unscheduled_index_keys(job):
+                if (id(index), key) not in groups:
+                    groups[(id(index), key)] = (index, key, [])
+                groups[(id(index), key)][2].append(job)
+        return groups.values()
+
+    # Drops the by type index of users with no unscheduled jobs left.
+    def _prune_user_type_index(self, user):
+        if user in self.unsched_by_user_type and len(self.unsched_by_user_type[user]) == 0:
+            del self.unsched_by_user_type[user]
+
+    # Adds a job to the indexes of unscheduled jobs. Call with the lock held.
+    def _index_unscheduled(self, job):
+        for index, key in self._unscheduled_index_keys(job):
+            index.add(key, job)
+
+    # Removes a job from the indexes of unscheduled jobs. Call with the lock held.
+    def _unindex_unscheduled(self, job):
+        for index, key in self._unscheduled_index_keys(job):
+            index.remove(key, job)
+        self._prune_user_type_index(job.user)
+
+    # Adds several jobs to the indexes of unscheduled jobs, updating each
+    # group they go in once. Call with the lock held.
+    def _index_unscheduled_many(self, jobs):
+        for index, key, group_jobs in self._group_by_index_keys(jobs):
+            index.add_many(key, group_jobs)
+
+    # Removes several jobs from the indexes of unscheduled jobs, updating
+    # each group they were in once. Call with the lock held.
+    def _unindex_unscheduled_many(self, jobs):
+        for index, key, group_jobs in self._group_by_index_keys(jobs):
+            index.remove_many(key, group_jobs)
+        for user in set(job.user for job in jobs):
+            self._prune_user_type_index(user)
+
+    # Adds a banned job to banned_jobs and ban_expiry. Call with the lock held.
+    def _track_ban(self, job):
+        self.banned_jobs[job.id] = job
+        if job.ban_time:
+            heapq.heappush(self.ban_expiry,
+                           (job.ban_time + config.job_ban_timeout, job.id, job.ban_time))
+
+    # Sets a job held by the container as banned or not, keeping the counts
+    # and the index which leaves out banned jobs up to date. Call with the lock held.
+    def _set_banned(self, job, banned, reason=None):
+        unscheduled = job.id in self.new_jobs
+        self._count_job(job, -1)
+        if unscheduled:
+            self._unindex_unscheduled(job)
+        if banned:
+            job.banned = True
+            job.ban_time = time.time()
+            job.override_status = reason
+            self._track_ban(job)
+        else:
+            job.banned = False
+            job.ban_time = None
+            job.override_status = None
+            if job.id in self.banned_jobs:
+                del self.banned_jobs[job.id]
+        self._count_job(job, 1)
+        if unscheduled:
+            self._index_unscheduled(job)
+        self._changed(job)
+
     def remove_jobs(self, jobs):
         with self.lock:
             for job in jobs:
@@ -320,37 +844,30 @@ class HashTableJobContainer(JobContainer):
         except KeyError:
             return None
 
+    def get_jobs_with_status(self, job_status):
+        with self.lock:
+            return self.jobs_by_status.get(job_status, {}).values()
+
+    # Returns a dictionary of job_status to the list of jobs with that status.
+    def get_jobs_by_status(self):
+        with self.lock:
+            return dict((job_status, jobs.values()) for job_status, jobs in self.jobs_by_status.iteritems())
+
     def get_held_jobs(self):
         HELD = 5
-        held_jobs = []
-        for job in self.all_jobs.values():
-            if job.job_status == HELD:
-                held_jobs.append(job)
-        return held_jobs
+        return self.get_jobs_with_status(HELD)
     
     def get_idle_jobs(self):
         IDLE = 1
-        idle_jobs = []
-        for job in self.all_jobs.values():
-            if job.job_status == IDLE:
-                idle_jobs.append(job)
-        return idle_jobs
+        return self.get_jobs_with_status(IDLE)
 
     def get_running_jobs(self):
         RUNNING = 2
-        run_jobs = []
-        for job in self.all_jobs.values():
-            if job.job_status == RUNNING:
-                run_jobs.append(job)
-        return run_jobs
+        return self.get_jobs_with_status(RUNNING)
 
     def get_complete_jobs(self):
         COMPLETE = 4
-        comp_jobs = []
-        for job in self.all_jobs.values():
-            if job.job_status == COMPLETE:
-                comp_jobs.append(job)
-        return comp_jobs
+        return self.get_jobs_with_status(COMPLETE)
 
     def get_jobs_for_user(self, user, prioritized=False):
         with self.lock:
@@ -410,52 +927,23 @@ class HashTableJobContainer(JobContainer):
     def get_unscheduled_jobs(self):
         return self.new_jobs.values()
 
+    # The unscheduled job lists are always in priority order, as they are
+    # read from the indexes, so prioritized makes no difference to them.
+    # They include banned jobs, as the job lists of a user always have.
     def get_unscheduled_jobs_by_users(self, prioritized=False):
         with self.lock:
- 
-            return_value = {}
-            for job in self.new_jobs.values():
-                if job.user not in return_value:
-                    return_value[job.user] = []
-                return_value[job.user].append(job)
-            # Now lets sort if needed.
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
-            return return_value
+            return self.unsched_by_user.as_dict()
 
     def get_unscheduled_jobs_by_type(self, prioritized=False):
         with self.lock:
-            return_value = {}
-            for job in self.new_jobs.values():
-                if job.req_vmtype not in return_value:
-                    return_value[job.req_vmtype] = []
-                return_value[job.req_vmtype].append(job)
-            # Now sort if needed.
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
-            return return_value
+            return self.unsched_by_vmtype.as_dict()
 
     def get_unscheduled_jobs_by_usertype(self, prioritized=False):
         with self.lock:
-            return_value = {}
-            for job in self.new_jobs.values():
-                if job.uservmtype not in return_value:
-                    return_value[job.uservmtype] = []
-                return_value[job.uservmtype].append(job)
-            # Now sort if needed.
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
-            return return_value
+            return self.unsched_by_usertype.as_dict()
 
     def get_high_priority_jobs(self):
-        jobs = []
-        for job in self.all_jobs.values():
-            if job.high_priority:
-                jobs.append(job)
-        return jobs
+        return self.high_jobs.values()
 
     def get_high_priority_jobs_by_users(self, prioritized=False):
         with self.lock:
@@ -474,23 +962,15 @@ class HashTableJobContainer(JobContainer):
             return return_value
 
     def get_unscheduled_high_priority_jobs(self):
-        jobs = []
-        for job in self.all_jobs.values():
-            if job.high_priority and job.status == 'Unscheduled':
-                jobs.append(job)
-        return jobs
+        with self.lock:
+            jobs = []
+            for job_list in self.unsched_high_by_user.as_dict().values():
+                jobs.extend(job_list)
+            return jobs
 
     def get_unscheduled_high_priority_jobs_by_users(self, prioritized=False):
         with self.lock:
-            return_value = {}
-            for job in self.get_unscheduled_high_priority_jobs():
-                if job.user not in return_value:
-                    return_value[job.user] = []
-                return_value[job.user].append(job)
-            # Now lets sort if needed.
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
+            return_value = self.unsched_high_by_user.as_dict()
 
             log.verbose("(OUT) get_unscheduled_high_priority_jobs_by_users")
 
@@ -499,22 +979,101 @@ class HashTableJobContainer(JobContainer):
     def is_empty(self):
         return len(self.all_jobs) == 0
 
+    def sync_jobs(self, jobs):
+        added = []
+        changed = []
+        with self.lock:
+            self.expire_bans()
+            query_ids = set()
+            for query_job in jobs:
+                query_ids.add(query_job.id)
+                job = self.all_jobs.get(query_job.id)
+                if job == None:
+                    if isinstance(query_job, JobStatusUpdate):
+                        continue
+                    self.add_job(query_job)
+                    added.append(query_job)
+                elif self._update_job(job, query_job.job_status, query_job.remote_host,
+                                      query_job.servertime, query_job.jobstarttime):
+                    changed.append(job)
+
+            removed = [job for job in self.all_jobs.itervalues() if job.id not in query_ids]
+            for job in removed:
+                self.remove_job(job)
+        return (added, removed, changed)
+
     def update_job_status(self, jobid, status, remote, servertime, starttime):
         with self.lock:
             job = self.get_job_by_id(jobid)
-        if job != None:
-            job.job_status = status
-            job.remote_host = remote
-            job.servertime = int(servertime)
-            job.jobstarttime = int(starttime)
-            if job.banned and job.ban_time:
-                if (time.time() - job.ban_time) > config.job_ban_timeout:
-                    job.banned = False
-                    job.ban_time = None
-                    job.override_status = None
+            if job != None:
+                self._update_job(job, status, remote, servertime, starttime)
+                return True
+            else:
+                return False
+
+    # Sets the status fields of a job held by the container. Call with the
+    # lock held.
+    # Returns True if the status, remote host or start time changed.
+    def _update_job(self, job, status, remote, servertime, starttime):
+        status = int(status)
+        starttime = int(starttime)
+        changed = job.job_status != status or job.remote_host != remote \
+                  or job.jobstarttime != starttime
+        self._count_job(job, -1)
+        self._remove_from_status(job)
+        if job.job_status != status:
+            self._changed(job)
+        job.job_status = status
+        job.remote_host = remote
+        job.servertime = int(servertime)
+        job.jobstarttime = starttime
+        self._count_job(job, 1)
+        self._add_to_status(job)
+        return changed
+
+    def ban_job(self, job, reason):
+        with self.lock:
+            if job.banned or self.all_jobs.get(job.id) is not job:
+                return False
+            self._set_banned(job, True, reason)
             return True
-        else:
-            return False
+
+    def expire_bans(self, now=None):
+        if now == None:
+            now = time.time()
+        unbanned = []
+        with self.lock:
+            while self.ban_expiry and self.ban_expiry[0][0] < now:
+                (expiry, jobid, ban_time) = heapq.heappop(self.ban_expiry)
+                job = self.banned_jobs.get(jobid)
+                # Skip entries of jobs since removed, unbanned or banned again
+                if job == None or job.ban_time != ban_time:
+                    continue
+                self._set_banned(job, False)
+                unbanned.append(job)
+        if unbanned:
+            log.debug("Lifted the ban on %d job(s)" % len(unbanned))
+        return unbanned
+
+    def get_banned_jobs(self):
+        with self.lock:
+            return self.banned_jobs.values()
+
+    # Returns the counts of one bucket as a dictionary, leaving out zeros.
+    def _bucket_counts(self, counts, bucket):
+        return_value = {}
+        for key, buckets in counts.iteritems():
+            if bucket in buckets:
+                return_value[key] = buckets[bucket]
+        return return_value
+
+    def get_required_usertype_counts(self):
+        with self.lock:
+            return self._bucket_counts(self.counts_by_usertype, (True, False))
+
+    def get_required_vmtype_counts(self):
+        with self.lock:
+            return self._bucket_counts(self.counts_by_vmtype, (True, False))
 
     def schedule_job(self, jobid):
         with self.lock:
@@ -523,6 +1082,8 @@ class HashTableJobContainer(JobContainer):
                 job.set_status("Scheduled")
                 self.sched_jobs[jobid] = job
                 del self.new_jobs[jobid]
+                self._unindex_unscheduled(job)
+                self._changed(job)
                 log.verbose('Job %s marked as scheduled in the job container' % (jobid))
                 return True
             else:
@@ -536,60 +1097,59 @@ class HashTableJobContainer(JobContainer):
                 job.set_status("Unscheduled")
                 self.new_jobs[jobid] = job
                 del self.sched_jobs[jobid]
+                self._index_unscheduled(job)
+                self._changed(job)
                 log.verbose('Job %s marked as unscheduled in the job container' % (jobid))
                 return True
             else:
                 return False
 
-    def find_unscheduled_jobs_with_matching_reqs(self, user, job, N=0):
+    def schedule_many(self, jobids):
         with self.lock:
-            counter = 0
-            unscheduled_jobs_for_user = []
-            try:
-                unscheduled_jobs_for_user = self.get_unscheduled_jobs_by_users()[user]
-            except KeyError:
-                # User has no unscheduled jobs.
-                # Simply return an empty list right away.
-                return []
+            jobs = [self.new_jobs[jobid] for jobid in set(jobids) if jobid in self.new_jobs]
+            self._unindex_unscheduled_many(jobs)
+            for job in jobs:
+                job.set_status("Scheduled")
+                self.sched_jobs[job.id] = job
+                del self.new_jobs[job.id]
+                self._changed(job)
+        if jobs:
+            log.verbose('%d job(s) marked as scheduled in the job container' % len(jobs))
+        return len(jobs)
 
-            matching_jobs = []
-            for j in unscheduled_jobs_for_user:
-                if j.has_same_reqs(job):
-                    matching_jobs.append(j)
-                    counter += 1
-                    if counter > 0 and counter == N:
-                        break
+    def unschedule_many(self, jobids):
+        with self.lock:
+            jobs = [self.sched_jobs[jobid] for jobid in set(jobids) if jobid in self.sched_jobs]
+            for job in jobs:
+                job.set_status("Unscheduled")
+                self.new_jobs[job.id] = job
+                del self.sched_jobs[job.id]
+                self._changed(job)
+            self._index_unscheduled_many(jobs)
+        if jobs:
+            log.verbose('%d job(s) marked as unscheduled in the job container' % len(jobs))
+        return len(jobs)
 
-            return matching_jobs
+    def find_unscheduled_jobs_with_matching_reqs(self, user, job, N=0):
+        with self.lock:
+            # The user's jobs with the same requirements share a signature
+            signature = (user,) + job.req_signature[1:]
+            return self.unsched_by_signature.get_first(signature, N)
 
     def get_unscheduled_user_jobs_by_type(self, user, prioritized=False):
         with self.lock:
-            unsched = self.get_unscheduled_jobs_by_users()
-            return_value = {}
-            if user in unsched.keys():
-                for job in unsched[user]:
-                    if job.req_vmtype not in return_value:
-                        return_value[job.req_vmtype] = []
-                    return_value[job.req_vmtype].append(job)
-            # Sort if needed
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
-        return return_value
+            if user not in self.unsched_by_user_type:
+                return {}
+            return self.unsched_by_user_type[user].as_dict()
 
     def get_unscheduled_user_jobs_by_usertype(self, user, prioritized=False):
         with self.lock:
-            unsched = self.get_unscheduled_jobs_by_users()
+            if user not in self.unsched_by_user_type:
+                return {}
+            # All of a user's jobs of one VM type have the same uservmtype
             return_value = {}
-            if user in unsched.keys():
-                for job in unsched[user]:
-                    if job.uservmtype not in return_value:
-                        return_value[job.uservmtype] = []
-                    return_value[job.uservmtype].append(job)
-            # Sort if needed
-            if prioritized:
-                for job_list in return_value.values():
-                    job_list.sort(key=lambda job: job.get_priority(), reverse=True)
+            for job_list in self.unsched_by_user_type[user].as_dict().values():
+                return_value[job_list[0].uservmtype] = job_list
         return return_value
     
     def get_scheduled_user_jobs_by_type(self, user, prioritized=False):
@@ -620,4 +1180,381 @@ class HashTableJobContainer(JobContainer):
             if prioritized:
                 for job_list in return_value.values():
                     job_list.sort(key=lambda job: job.get_priority(), reverse=True)
-        return return_value
\ No newline at end of file
+        return return_value
+
+
+#
+# Acquires the locks of all the shards of a ShardedJobContainer, always in
+# the same order. Holding it gives the same guarantee as holding the lock of
+# a HashTableJobContainer.
+#
+class _ShardLocks(object):
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def acquire(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def release(self):
+        for lock in reversed(self.locks):
+            lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+#
+# This class implements a job container split into shards by job owner.
+# Each shard is a HashTableJobContainer with its own lock and indexes, so
+# work on the jobs of one user doesn't wait for work on another user's jobs
+# in a different shard. Queries over all users gather the shards' results.
+#
+class ShardedJobContainer(JobContainer):
+    # class attributes
+    shards = None
+    job_shards = None
+
+    # constructor
+    def __init__(self, num_shards):
+        JobContainer.__init__(self)
+        self.shards = [HashTableJobContainer() for i in range(max(1, num_shards))]
+        # Job id -> shard holding the job. Only changed while holding the
+        # lock of the job's shard, and job_shards_lock, which is always taken
+        # last and only around job_shards itself.
+        self.job_shards = {}
+        self.job_shards_lock = threading.Lock()
+        self.lock = _ShardLocks([shard.lock for shard in self.shards])
+        self.view = None
+        log.debug('ShardedJobContainer instance created with %d shards.' % len(self.shards))
+
+    # methods
+    def __str__(self):
+        return 'ShardedJobContainer [# of jobs: %d in %d shards]' % (len(self.job_shards), len(self.shards))
+
+    # Returns the shard holding the jobs of a user.
+    def shard_for_user(self, user):
+        return self.shards[hash(user) % len(self.shards)]
+
+    # Returns the shard holding a job, or None if no shard has it.
+    def _shard_for_job(self, jobid):
+        with self.job_shards_lock:
+            return self.job_shards.get(jobid)
+
+    # Records a job as held by shard. Call with the shard's lock held.
+    def _set_job_shard(self, jobid, shard):
+        with self.job_shards_lock:
+            self.job_shards[jobid] = shard
+
+    # Forgets a job's shard, if it is still the given one. Call with the
+    # shard's lock held.
+    def _drop_job_shard(self, jobid, shard):
+        with self.job_shards_lock:
+            if self.job_shards.get(jobid) is shard:
+                del self.job_shards[jobid]
+
+    # Concatenates the lists returned by a method of each shard.
+    def _gather_lists(self, method, *args):
+        return_value = []
+        for shard in self.shards:
+            return_value.extend(getattr(shard, method)(*args))
+        return return_value
+
+    # Merges the dictionaries of lists returned by a method of each shard.
+    # Lists for the same key in several shards are joined, and put back in
+    # priority order if prioritized.
+    def _gather_dicts(self, method, prioritized=False):
+        return_value = {}
+        shared_keys = set()
+        for shard in self.shards:
+            for key, job_list in getattr(shard, method)(prioritized).iteritems():
+                if key in return_value:
+                    return_value[key].extend(job_list)
+                    shared_keys.add(key)
+                else:
+                    return_value[key] = job_list
+        if prioritized:
+            for key in shared_keys:
+                return_value[key].sort(key=lambda job: (-job.priority, job.id))
+        return return_value
+
+    # Sums the dictionaries of counts returned by a method of each shard.
+    def _gather_counts(self, method):
+        return_value = {}
+        for shard in self.shards:
+            for key, count in getattr(shard, method)().iteritems():
+                return_value[key] = return_value.get(key, 0) + count
+        return return_value
+
+    def has_job(self, jobid):
+        return self.get_job_by_id(jobid) != None
+
+    def add_job(self, job):
+        shard = self.shard_for_user(job.user)
+        with shard.lock:
+            with self.job_shards_lock:
+                old_shard = self.job_shards.get(job.id)
+                if old_shard == None or old_shard is shard:
+                    self.job_shards[job.id] = shard
+            if old_shard == None or old_shard is shard:
+                shard.add_job(job)
+                return
+        # A job with the same id is held by another shard. Move it with every
+        # shard locked, so it is never seen in both shards or in neither.
+        with self.lock:
+            old_shard = self._shard_for_job(job.id)
+            if old_shard != None and old_shard is not shard:
+                old_shard.remove_job(old_shard.get_job_by_id(job.id))
+            shard.add_job(job)
+            self._set_job_shard(job.id, shard)
+
+    def add_jobs(self, jobs):
+        for job in jobs:
+            self.add_job(job)
+
+    def clear(self):
+        with self.lock:
+            for shard in self.shards:
+                shard.clear()
+            with self.job_shards_lock:
+                self.job_shards.clear()
+
+    def remove_job(self, job):
+        while True:
+            shard = self._shard_for_job(job.id)
+            if shard == None:
+                return
+            with shard.lock:
+                if self._shard_for_job(job.id) is not shard:
+                    continue # Moved to another shard meanwhile
+                shard.remove_job(job)
+                if not shard.has_job(job.id):
+                    self._drop_job_shard(job.id, shard)
+                return
+
+    def remove_jobs(self, jobs):
+        for job in jobs:
+            self.remove_job(job)
+
+    def remove_job_by_id(self, jobid):
+        job = self.get_job_by_id(jobid)
+        if job != None:
+            self.remove_job(job)
+
+    def remove_jobs_by_id(self, jobids):
+        for jobid in jobids:
+            self.remove_job_by_id(jobid)
+
+    def remove_all_not_in(self, jobs_to_keep):
+        removed_jobs = []
+        for shard in self.shards:
+            with shard.lock:
+                shard_removed = shard.remove_all_not_in(jobs_to_keep)
+                for job in shard_removed:
+                    self._drop_job_shard(job.id, shard)
+            removed_jobs.extend(shard_removed)
+        return removed_jobs
+
+    def get_users(self):
+        return self._gather_lists('get_users')
+
+    def get_all_jobs(self):
+        return self._gather_lists('get_all_jobs')
+
+    def get_job_by_id(self, jobid):
+        shard = self._shard_for_job(jobid)
+        if shard == None:
+            return None
+        return shard.get_job_by_id(jobid)
+
+    def get_jobs_with_status(self, job_status):
+        return self._gather_lists('get_jobs_with_status', job_status)
+
+    def get_jobs_by_status(self):
+        return_value = {}
+        for shard in self.shards:
+            for job_status, jobs in shard.get_jobs_by_status().iteritems():
+                return_value.setdefault(job_status, []).extend(jobs)
+        return return_value
+
+    def get_held_jobs(self):
+        return self._gather_lists('get_held_jobs')
+
+    def get_idle_jobs(self):
+        return self._gather_lists('get_idle_jobs')
+
+    def get_running_jobs(self):
+        return self._gather_lists('get_running_jobs')
+
+    def get_complete_jobs(self):
+        return self._gather_lists('get_complete_jobs')
+
+    def get_jobs_for_user(self, user, prioritized=False):
+        return self.shard_for_user(user).get_jobs_for_user(user, prioritized)
+
+    def get_scheduled_jobs(self):
+        return self._gather_lists('get_scheduled_jobs')
+
+    def get_scheduled_jobs_by_users(self, prioritized=False):
+        return self._gather_dicts('get_scheduled_jobs_by_users', prioritized)
+
+    def get_scheduled_jobs_by_type(self, prioritized=False):
+        return self._gather_dicts('get_scheduled_jobs_by_type', prioritized)
+
+    def get_scheduled_jobs_by_usertype(self, prioritized=False):
+        return self._gather_dicts('get_scheduled_jobs_by_usertype', prioritized)
+
+    def get_unscheduled_jobs(self):
+        return self._gather_lists('get_unscheduled_jobs')
+
+    def get_unscheduled_jobs_by_users(self, prioritized=False):
+        return self._gather_dicts('get_unscheduled_jobs_by_users', prioritized)
+
+    def get_unscheduled_jobs_by_type(self, prioritized=False):
+        return self._gather_dicts('get_unscheduled_jobs_by_type', prioritized)
+
+    def get_unscheduled_jobs_by_usertype(self, prioritized=False):
+        return self._gather_dicts('get_unscheduled_jobs_by_usertype', prioritized)
+
+    def get_high_priority_jobs(self):
+        return self._gather_lists('get_high_priority_jobs')
+
+    def get_high_priority_jobs_by_users(self, prioritized=False):
+        return self._gather_dicts('get_high_priority_jobs_by_users', prioritized)
+
+    def get_unscheduled_high_priority_jobs(self):
+        return self._gather_lists('get_unscheduled_high_priority_jobs')
+
+    def get_unscheduled_high_priority_jobs_by_users(self, prioritized=False):
+        return self._gather_dicts('get_unscheduled_high_priority_jobs_by_users', prioritized)
+
+    def is_empty(self):
+        for shard in self.shards:
+            if not shard.is_empty():
+                return False
+        return True
+
+    def sync_jobs(self, jobs):
+        # Split the query by shard. Every shard is synced, even with no jobs,
+        # so that it removes the jobs which have left the queue.
+        shard_jobs = dict((id(shard), []) for shard in self.shards)
+        for query_job in jobs:
+            if isinstance(query_job, JobStatusUpdate):
+                shard = self._shard_for_job(query_job.id)
+                if shard == None:
+                    continue
+            else:
+                shard = self.shard_for_user(query_job.user)
+            shard_jobs[id(shard)].append(query_job)
+
+        added = []
+        removed = []
+        changed = []
+        for shard in self.shards:
+            with shard.lock:
+                (shard_added, shard_removed, shard_changed) = shard.sync_jobs(shard_jobs[id(shard)])
+                for job in shard_removed:
+                    self._drop_job_shard(job.id, shard)
+                for job in shard_added:
+                    self._set_job_shard(job.id, shard)
+            added.extend(shard_added)
+            removed.extend(shard_removed)
+            changed.extend(shard_changed)
+        return (added, removed, changed)
+
+    def update_job_status(self, jobid, status, remote, servertime, starttime):
+        shard = self._shard_for_job(jobid)
+        if shard == None:
+            return False
+        return shard.update_job_status(jobid, status, remote, servertime, starttime)
+
+    def ban_job(self, job, reason):
+        shard = self._shard_for_job(job.id)
+        if shard == None:
+            return False
+        return shard.ban_job(job, reason)
+
+    def expire_bans(self, now=None):
+        return self._gather_lists('expire_bans', now)
+
+    def get_banned_jobs(self):
+        return self._gather_lists('get_banned_jobs')
+
+    def get_required_usertype_counts(self):
+        return self._gather_counts('get_required_usertype_counts')
+
+    def get_required_vmtype_counts(self):
+        return self._gather_counts('get_required_vmtype_counts')
+
+    # The views of the shards are taken one shard at a time, so the jobs of
+    # each user are consistent but different shards may be from slightly
+    # different moments. The generation is the sum of the shards'.
+    def get_generation(self):
+        return sum([shard.get_generation() for shard in self.shards])
+
+    def get_view(self):
+        views = [shard.get_view() for shard in self.shards]
+        generation = sum([view.generation for view in views])
+        if self.view != None and self.view.generation == generation:
+            return self.view
+        segments = {}
+        for view in views:
+            segments.update(view.segments)
+        self.view = JobContainerView(generation, segments)
+        return self.view
+
+    def schedule_job(self, jobid):
+        shard = self._shard_for_job(jobid)
+        if shard == None:
+            return False
+        return shard.schedule_job(jobid)
+
+    def unschedule_job(self, jobid):
+        shard = self._shard_for_job(jobid)
+        if shard == None:
+            return False
+        return shard.unschedule_job(jobid)
+
+    # Splits job ids by the shard holding them.
+    def _ids_by_shard(self, jobids):
+        shard_ids = {}
+        for jobid in jobids:
+            shard = self._shard_for_job(jobid)
+            if shard != None:
+                if id(shard) not in shard_ids:
+                    shard_ids[id(shard)] = (shard, [])
+                shard_ids[id(shard)][1].append(jobid)
+        return shard_ids.values()
+
+    def schedule_many(self, jobids):
+        count = 0
+        for shard, shard_ids in self._ids_by_shard(jobids):
+            count += shard.schedule_many(shard_ids)
+        return count
+
+    def unschedule_many(self, jobids):
+        count = 0
+        for shard, shard_ids in self._ids_by_shard(jobids):
+            count += shard.unschedule_many(shard_ids)
+        return count
+
+    def find_unscheduled_jobs_with_matching_reqs(self, user, job, N=0):
+        return self.shard_for_user(user).find_unscheduled_jobs_with_matching_reqs(user, job, N)
+
+    def get_unscheduled_user_jobs_by_type(self, user, prioritized=False):
+        return self.shard_for_user(user).get_unscheduled_user_jobs_by_type(user, prioritized)
+
+    def get_unscheduled_user_jobs_by_usertype(self, user, prioritized=False):
+        return self.shard_for_user(user).get_unscheduled_user_jobs_by_usertype(user, prioritized)
+
+    def get_scheduled_user_jobs_by_type(self, user, prioritized=False):
+        return self.shard_for_user(user).get_scheduled_user_jobs_by_type(user, prioritized)
+
+    def get_scheduled_user_jobs_by_usertype(self, user, prioritized=False):
+        return self.shard_for_user(user).get_scheduled_user_jobs_by_usertype(user, prioritized)
@@ -29,9 +29,12 @@ import re
 import sys
 import shlex
 import string
+import time
 import logging
 import datetime
+import tempfile
 import threading
+import weakref
 import subprocess
 from urllib2 import URLError
 from StringIO import StringIO
@@ -47,10 +50,15 @@ except:
     sys.exit(1)
 
 import cloudscheduler.config as config
+import cloudscheduler.parse_pool as parse_pool
 from cloudscheduler.utilities import determine_path
+from cloudscheduler.utilities import condor_soap_request
 from cloudscheduler.utilities import get_cert_expiry_time
+from cloudscheduler.utilities import iter_condor_classads
+from cloudscheduler.utilities import xml_classad_attributes
 import job_containers
-from decimal import *
+from job_containers import JobStatusUpdate
+from fractions import Fraction
 
 ##
 ## LOGGING
@@ -63,12 +71,27 @@ log = None
 ## CLASSES
 ##
 
-class Job:
+class Job(object):
     """
     Job Class - Represents a job as read from the Job Scheduler
 
-
+    Jobs use __slots__ to stay small, since every queued job is kept in
+    memory. Repeated strings are interned and identical AMI dicts and target
+    cloud lists are shared between jobs, so these must not be modified.
     """
+    __slots__ = ('id', 'user', 'uservmtype', 'priority', 'job_status',
+                 'cluster_id', 'proc_id', 'req_vmtype', 'req_network',
+                 'req_cpuarch', 'req_image', 'req_imageloc', 'req_ami',
+                 'req_memory', 'req_cpucores', 'req_storage', 'keep_alive',
+                 'high_priority', 'instance_type', 'maximum_price',
+                 'myproxy_server', 'myproxy_server_port', 'myproxy_creds_name',
+                 'x509userproxysubject', 'x509userproxy',
+                 'original_x509userproxy', 'spool_dir',
+                 'x509userproxy_expiry_time', 'job_per_core', 'remote_host',
+                 'running_cloud', 'running_vm', 'servertime', 'jobstarttime',
+                 'banned', 'ban_time', 'status', 'override_status',
+                 'target_clouds', 'schedd', 'req_signature')
+
     # A list of possible statuses for internal job representation
     SCHEDULED = "Scheduled"
     UNSCHEDULED = "Unscheduled"
@@ -120,29 +143,29 @@ class Job:
         if VMType == "":
             VMType = config.default_VMType
         self.id           = GlobalJobId
-        self.user         = Owner
-        self.uservmtype   = ':'.join([Owner, VMType])
+        self.user         = _shared(Owner)
+        self.uservmtype   = _shared(':'.join([Owner, VMType]))
         self.priority     = int(JobPrio)
         self.job_status   = int(JobStatus)
         self.cluster_id   = int(ClusterId)
         self.proc_id      = int(ProcId)
-        self.req_vmtype   = VMType
-        self.req_network  = VMNetwork
-        self.req_cpuarch  = VMCPUArch
-        self.req_image    = VMName
-        self.req_imageloc = VMLoc
-        self.req_ami      = VMAMI
+        self.req_vmtype   = _shared(VMType)
+        self.req_network  = _shared(VMNetwork)
+        self.req_cpuarch  = _shared(VMCPUArch)
+        self.req_image    = _shared(VMName)
+        self.req_imageloc = _shared(VMLoc)
+        self.req_ami      = _shared_dict(VMAMI)
         self.req_memory   = int(VMMem)
         self.req_cpucores = int(VMCPUCores)
         self.req_storage  = int(VMStorage)
         self.keep_alive   = int(VMKeepAlive) * 60 # Convert to seconds
         self.high_priority = int(VMHighPriority)
-        self.instance_type = VMInstanceType
+        self.instance_type = _shared_dict(VMInstanceType)
         self.maximum_price = int(VMMaximumPrice)
-        self.myproxy_server = CSMyProxyServer
-        self.myproxy_server_port = CSMyProxyServerPort
-        self.myproxy_creds_name = CSMyProxyCredsName
-        self.x509userproxysubject = x509userproxysubject
+        self.myproxy_server = _shared(CSMyProxyServer)
+        self.myproxy_server_port = _shared(CSMyProxyServerPort)
+        self.myproxy_creds_name = _shared(CSMyProxyCredsName)
+        self.x509userproxysubject = _shared(x509userproxysubject)
         self.x509userproxy = x509userproxy
         self.original_x509userproxy = SUBMIT_x509userproxy
         self.spool_dir = Iwd
@@ -155,6 +178,11 @@ class Job:
         self.jobstarttime = JobStartDate
         self.banned = False
         self.ban_time = None
+        self.schedd = None # URL of the schedd the job was read from, if any
+        # Jobs with the same signature can share a VM, see has_same_reqs()
+        self.req_signature = _shared((self.user, self.req_vmtype, self.req_cpucores,
+                                      self.req_memory, self.req_storage,
+                                      self.req_cpuarch, self.req_network))
 
         # Set the new job's status
         self.status = self.statuses[1]
@@ -163,11 +191,10 @@ class Job:
         global log
         log = logging.getLogger("cloudscheduler")
 
-        self.target_clouds = []
+        self.target_clouds = ()
         try:
             if len(TargetClouds) != 0:
-                for cloud in TargetClouds.split(','):
-                    self.target_clouds.append(cloud.strip())
+                self.target_clouds = tuple([_shared(cloud.strip()) for cloud in TargetClouds.split(',')])
         except:
             log.error("Failed to parse TargetClouds - use a comma separated list")
 
@@ -320,7 +347,7 @@ class Job:
 
     def has_same_reqs(self, job):
         """A method that will compare a job's requirements listed below with another job to see if they all match."""
-        return self.req_vmtype == job.req_vmtype and self.req_cpucores == job.req_cpucores and self.req_memory == job.req_memory and self.req_storage == job.req_storage and self.req_cpuarch == job.req_cpuarch and self.req_network == job.req_network and self.user == job.user
+        return self.req_signature == job.req_signature
 
 
 class JobPool:
@@ -333,6 +360,12 @@ class JobPool:
     # The job container that will hold and maintain the job instances.
     job_container = None
 
+    # The latest JobContainerView of the job container, replaced after every
+    # poll and whenever get_snapshot() finds the container's generation changed.
+    # Read-only passes (the info server, proxy refresher, scheduler and
+    # cleanup) iterate it rather than the live container.
+    snapshot = None
+
 
     ## Condor Job Status mapping
     NEW      = 0
@@ -347,6 +380,10 @@ class JobPool:
     # can take a REALLY long time to return the XML list of jobs
     CONDOR_TIMEOUT = 1200 # seconds (20min)
 
+    # Delta queries ask for jobs that changed status slightly before the last
+    # ServerTime we saw, so that nothing is missed between two queries
+    DELTA_QUERY_OVERLAP = 60 # seconds
+
     ## Instance Methods
 
     def __init__(self, name, condor_query_type=""):
@@ -361,19 +398,34 @@ class JobPool:
         global log
         log = logging.getLogger("cloudscheduler")
         log.debug("New JobPool %s created" % name)
-        self.job_container = job_containers.HashTableJobContainer()
+        if config.job_container_shards > 1:
+            self.job_container = job_containers.ShardedJobContainer(config.job_container_shards)
+        else:
+            self.job_container = job_containers.HashTableJobContainer()
 
         self.name = name
         self.last_query = None
+        self.last_full_query = None
+        self.last_server_time = None
+        self.last_update_stats = {}
+        self.publish_snapshot()
         self.write_lock = threading.RLock()
 
+        # One pair of SOAP clients per schedd, keyed by the schedd's URL
+        self.schedd_urls = config.condor_schedd_urls or [config.condor_webservice_url]
+        self.condor_schedds = {}
+        self.condor_schedds_as_xml = {}
         _schedd_wsdl  = "file://" + determine_path() \
                         + "/wsdl/condorSchedd.wsdl"
-        self.condor_schedd = Client(_schedd_wsdl,
-                                    location=config.condor_webservice_url)
-        self.condor_schedd_as_xml = Client(_schedd_wsdl,
-                                    location=config.condor_webservice_url,
+        for url in self.schedd_urls:
+            self.condor_schedds[url] = Client(_schedd_wsdl, location=url)
+            self.condor_schedds_as_xml[url] = Client(_schedd_wsdl, location=url,
                                     retxml=True, timeout=self.CONDOR_TIMEOUT)
+        self.condor_schedd = self.condor_schedds[self.schedd_urls[0]]
+        self.condor_schedd_as_xml = self.condor_schedds_as_xml[self.schedd_urls[0]]
+
+        # Worker processes for parsing large job queries, if enabled
+        self.parse_pool = parse_pool.get_parse_pool()
 
         if not condor_query_type:
             condor_query_type = config.condor_retrieval_method
@@ -408,290 +460,402 @@ class JobPool:
             jobs.extend(job_list)
         return jobs
 
-    def job_query_local(self):
-        """job_query_local -- query and parse condor_q for job information."""
+    def job_query_local(self, constraint=None):
+        """job_query_local -- query and parse condor_q for job information.
+
+        Keywords:
+            constraint - (str) Optional ClassAd constraint to pass to condor_q
+        """
         log.debug("Querying Condor scheduler daemon (schedd) with %s" % config.condor_q_command)
+        condor_q = shlex.split(config.condor_q_command)
+        if config.condor_attribute_projection:
+            condor_q.extend(["-attributes", ",".join(JOB_CLASSAD_ATTRIBUTES)])
+        if constraint:
+            condor_q.extend(["-constraint", constraint])
+
+        # Job ads are parsed as condor_q writes them, so only one raw ad
+        # is held in memory at a time.
+        sp = None
         try:
-            condor_q = shlex.split(config.condor_q_command)
+            condor_err_file = tempfile.TemporaryFile()
             sp = subprocess.Popen(condor_q, shell=False,
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (condor_out, condor_err) = sp.communicate(input=None)
-            returncode = sp.returncode
+                       stdout=subprocess.PIPE, stderr=condor_err_file)
+            job_factory = lambda classad: self._job_from_classad(classad, _job_from_condor_q_classad)
+            if self.parse_pool:
+                job_ads = [job_factory(classad) for classad in
+                        self.parse_pool.parse_text(sp.stdout, JOB_CLASSAD_ATTRIBUTES)]
+            else:
+                job_ads = self._condor_q_to_job_list(sp.stdout, job_factory)
+            returncode = sp.wait()
         except:
             log.exception("Problem running %s, unexpected error" % string.join(condor_q, " "))
+            if sp and sp.poll() == None:
+                sp.kill()
+                sp.wait()
             return None
 
         if returncode != 0:
+            condor_err_file.seek(0)
             log.error("Got non-zero return code '%s' from '%s'. stderr was: %s" %
-                              (returncode, string.join(condor_q, " "), condor_err))
+                              (returncode, string.join(condor_q, " "), condor_err_file.read()))
             return None
 
-        job_ads = self._condor_q_to_job_list(condor_out)
         self.last_query = datetime.datetime.now()
         return job_ads
 
 
-    def job_query_SOAP(self):
-        """job_qury_SOAP - query and parse condor for job information via SOAP API."""
-        log.debug("Querying Condor scheduler daemon (schedd)")
+    def job_query_SOAP(self, constraint=None):
+        """job_qury_SOAP - query and parse condor for job information via SOAP API.
+
+        With several schedds (condor_schedd_urls), they are all queried at
+        the same time and their jobs are merged by GlobalJobId.
+
+        Keywords:
+            constraint - (str) Optional ClassAd constraint to pass to the schedd
+        """
+        if len(self.schedd_urls) == 1:
+            condor_jobs = self._schedd_job_query_SOAP(self.schedd_urls[0], constraint)
+        else:
+            condor_jobs = self._federated_job_query_SOAP(constraint)
+
+        if condor_jobs != None:
+            # When querying finishes successfully, reset last query timestamp
+            self.last_query = datetime.datetime.now()
+        return condor_jobs
+
+    def _schedd_job_query_SOAP(self, url, constraint=None):
+        """Query and parse the jobs of one schedd. Returns None on failure."""
+        log.debug("Querying Condor scheduler daemon (schedd) at %s" % url)
+        job_factory = lambda classad: self._job_from_classad(classad, _job_from_xml_classad)
+
+        if config.condor_soap_streaming:
+            condor_jobs = self._schedd_job_query_SOAP_streamed(url, constraint, job_factory)
+            if condor_jobs == None:
+                return None
+            for job in condor_jobs:
+                if isinstance(job, Job):
+                    job.schedd = url
+            log.debug("Done parsing jobs streamed from Condor Schedd SOAP (%d job(s) parsed)" % len(condor_jobs))
+            return condor_jobs
 
         # Get job classAds from the condor scheduler
         try:
-            job_ads = self.condor_schedd_as_xml.service.getJobAds(None, None)
+            job_ads = self.condor_schedds_as_xml[url].service.getJobAds(None, constraint)
         except URLError, e:
             log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s) for the following "
                       "reason: %s"
-                      % (config.condor_webservice_url, e.reason))
+                      % (url, e.reason))
             return None
         except:
             log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s). Unknown reason."
-                      % (config.condor_webservice_url))
+                      % (url))
             return None
 
         # Create the condor_jobs list to store jobs
         log.debug("Parsing Condor job data from schedd")
-        condor_jobs = self._condor_job_xml_to_job_list(job_ads)
+        if self.parse_pool:
+            condor_jobs = [job_factory(classad) for classad in
+                    self.parse_pool.parse_xml(job_ads, "classAdArray", JOB_CLASSAD_ATTRIBUTES)]
+        else:
+            condor_jobs = self._condor_job_xml_to_job_list(job_ads, job_factory)
         del job_ads
-        # When querying finishes successfully, reset last query timestamp
-        self.last_query = datetime.datetime.now()
+        for job in condor_jobs:
+            if isinstance(job, Job):
+                job.schedd = url
         log.debug("Done parsing jobs from Condor Schedd SOAP (%d job(s) parsed)" % len(condor_jobs))
 
         # Return condor_jobs list
         return condor_jobs
 
-    @staticmethod
-    def _condor_q_to_job_list(condor_q_output):
+    def _schedd_job_query_SOAP_streamed(self, url, constraint, job_factory):
+        """Query the jobs of one schedd, parsing the SOAP response as it
+        arrives from the network rather than after it has all been read.
+        Returns None on failure.
         """
-        _condor_q_to_job_list - Converts the output of condor_q
-                to a list of Job Objects
+        try:
+            response = condor_soap_request(url, "getJobAds",
+                    (("transaction", None), ("constraint", constraint)),
+                    timeout=self.CONDOR_TIMEOUT)
+        except URLError, e:
+            log.error("There was a problem connecting to the "
+                      "Condor scheduler web service (%s) for the following "
+                      "reason: %s"
+                      % (url, e.reason))
+            return None
+        except:
+            log.error("There was a problem connecting to the "
+                      "Condor scheduler web service (%s). Unknown reason."
+                      % (url))
+            return None
 
-                returns [] if there are no jobs
+        log.debug("Parsing Condor job data streamed from schedd")
+        try:
+            return self._condor_job_xml_to_job_list(response, job_factory)
+        except:
+            log.exception("Problem reading the job classAds from the "
+                          "Condor scheduler web service (%s)" % url)
+            return None
+        finally:
+            response.close()
+
+    def _federated_job_query_SOAP(self, constraint=None):
+        """Query all schedds concurrently and merge their jobs by GlobalJobId.
+
+        Each schedd gets up to CONDOR_TIMEOUT seconds. If a schedd fails
+        during a full query, the jobs already known from it are kept as
+        they are, rather than being removed. Returns None if every schedd
+        failed.
         """
+        results = {}
+        def query(url):
+            results[url] = self._schedd_job_query_SOAP(url, constraint)
+
+        threads = []
+        for url in self.schedd_urls:
+            thread = threading.Thread(target=query, args=(url,), name="JobQuery %s" % url)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        deadline = time.time() + self.CONDOR_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+
+        condor_jobs = {}
+        failed = []
+        for url in self.schedd_urls:
+            schedd_jobs = results.get(url)
+            if schedd_jobs == None:
+                log.error("No jobs from schedd %s this cycle" % url)
+                failed.append(url)
+                continue
+            for job in schedd_jobs:
+                condor_jobs.setdefault(job.id, job)
 
-        def _attribute_from_requirements(requirements, attribute):
-            regex = "%s\s=\?=\s\"(?P<value>.+?)\"" % attribute
-            match = re.search(regex, requirements)
-            if match:
-                return match.group("value")
-            else:
-                return ""
+        if len(failed) == len(self.schedd_urls):
+            return None
+        if failed and constraint == None:
+            for job in self.job_container.get_all_jobs():
+                if job.schedd in failed:
+                    condor_jobs.setdefault(job.id, job)
+        return condor_jobs.values()
+
+    def _schedd_for(self, job):
+        """Returns the SOAP client of the schedd which owns a job."""
+        return self.condor_schedds.get(job.schedd, self.condor_schedd)
+
+    def full_query_due(self):
+        """Returns True if the next job query should fetch the whole queue.
+
+        A full query is always done when delta polling is disabled, when no
+        full query has succeeded yet, and every job_full_resync_interval
+        seconds so that jobs which have left the queue are noticed.
+        """
+        if not config.job_delta_polling:
+            return True
+        if self.last_full_query == None or self.last_server_time == None:
+            return True
+        since_full = datetime.datetime.now() - self.last_full_query
+        return since_full >= datetime.timedelta(seconds=config.job_full_resync_interval)
+
+    def job_query_delta(self):
+        """job_query_delta -- query only for jobs which have changed status
+        since the last successful query. Returns None on failure.
+        """
+        since = self.last_server_time - self.DELTA_QUERY_OVERLAP
+        log.debug("Querying for jobs changed since %d" % since)
+        return self.job_query(constraint="EnteredCurrentStatus >= %d" % since)
 
-        def _attribute_from_list(classad, attribute):
+    def _track_server_time(self, query_jobs):
+        """Remember the newest schedd ServerTime seen in a query result."""
+        for job in query_jobs:
             try:
-                attr_list = classad[attribute]
-                try:
-                    attr_dict = _attr_list_to_dict(attr_list)
-                    classad[attribute] = attr_dict
-                except ValueError:
-                    log.exception("Problem extracting %s attribute '%s'" % (attribute, attr_list))
-            except:
-                pass
+                servertime = int(job.servertime)
+            except (TypeError, ValueError):
+                continue
+            if self.last_server_time == None or servertime > self.last_server_time:
+                self.last_server_time = servertime
 
-        jobs = []
+    @staticmethod
+    def _condor_q_to_job_list(condor_q_output, job_factory=None):
+        """
+        _condor_q_to_job_list - Converts the output of condor_q
+                to a list of Job Objects
 
-        # The first three lines look like:
-        # \n\n\t-- Submitter: hostname : <ip> : hostname
-        # we can just strip these.
-        condor_q_output = re.sub('\n\n.*?Submitter:.*?\n', "", condor_q_output, re.MULTILINE)
-
-        # Each classad is seperated by '\n\n'
-        raw_job_classads = condor_q_output.split("\n\n")
-        # Empty condor pools give us an empty string in our list
-        raw_job_classads = filter(lambda x: x != "", raw_job_classads)
-
-        for raw_classad in raw_job_classads:
-            classad = {}
-            classad_lines = raw_classad.splitlines()
-            for classad_line in classad_lines:
-                classad_line = classad_line.strip()
-                (classad_key, classad_value) = classad_line.split(" = ", 1)
-                classad_value = classad_value.strip('"')
-                classad[classad_key] = classad_value
+                condor_q_output may be the output as a string, or any
+                iterable of output lines (like a pipe from condor_q)
 
-            try:
-                classad["VMType"] = _attribute_from_requirements(classad["Requirements"], "VMType")
-            except:
-                log.exception("Problem extracting VMType from Requirements")
+                job_factory is called with each classAd dictionary to build
+                the job (see JobPool._job_from_classad); by default a new Job
+                is built for every classAd.
+
+                returns [] if there are no jobs
+        """
+        if job_factory == None:
+            job_factory = _job_from_condor_q_classad
+
+        jobs = []
 
-            # VMAMI requires special fiddling
-            _attribute_from_list(classad, "VMAMI")
-            _attribute_from_list(classad, "VMInstanceType")
+        if isinstance(condor_q_output, basestring):
+            condor_q_output = StringIO(condor_q_output)
 
-            jobs.append(Job(**classad))
+        for classad in iter_condor_classads(condor_q_output):
+            jobs.append(job_factory(classad))
         return jobs
 
     @staticmethod
-    def _condor_job_xml_to_job_list(condor_xml):
+    def _condor_job_xml_to_job_list(condor_xml, job_factory=None):
         """
         _condor_job_xml_to_job_list - Converts Condor SOAP XML from Condor
                 to a list of Job Objects
 
+                condor_xml may be the XML as a string, or a file-like object
+                (like a streamed HTTP response) which is parsed as it is read.
+
+                Each job classAd is walked exactly once to build a map of
+                attribute names to values, and the Job is built from that map.
+                Parsed classAds are dropped from the tree, so memory use
+                doesn't grow with the size of the response.
+
+                job_factory is called with each map to build the job (see
+                JobPool._job_from_classad); by default a new Job is built for
+                every classAd.
+
                 returns [] if there are no jobs
         """
-        def _job_attribute(xml, element):
-            try:
-                return xml.xpath(".//item[name='%s']/value" % element)[0].text
-            except:
-                return ""
-
-        def _add_if_exists(xml, dictionary, attribute):
-            job_value = string.strip(_job_attribute(xml, attribute))
-            if job_value:
-                dictionary[attribute] = job_value
-
-        def _add_dict_if_exists(xml, dictionary, attribute):
-            attr_list = _job_attribute(xml_job, attribute)
-            if attr_list:
-                try:
-                    attr_dict = _attr_list_to_dict(attr_list)
-                    dictionary[attribute] = attr_dict
-                except:
-                    log.exception("Problem extracting %s attribute '%s'" % (attribute, attr_list))
-
-        def _attribute_from_requirements(requirements, attribute):
-            regex = "%s\s=\?=\s\"(?P<value>.+?)\"" % attribute
-            match = re.search(regex, requirements)
-            if match:
-                return match.group("value")
-            else:
-                return ""
+        if job_factory == None:
+            job_factory = _job_from_xml_classad
 
         jobs = []
 
-        context = etree.iterparse(StringIO(condor_xml))
+        if isinstance(condor_xml, basestring):
+            condor_xml = StringIO(condor_xml)
+
+        context = etree.iterparse(condor_xml)
         for action, elem in context:
             if elem.tag == "item" and elem.getparent().tag == "classAdArray":
-                xml_job = elem
-                job_dictionary = {}
-                # Mandatory parameters
-                job_dictionary['GlobalJobId'] = _job_attribute(xml_job, "GlobalJobId")
-                job_dictionary['Owner'] = _job_attribute(xml_job, "Owner")
-                job_dictionary['JobPrio'] = _job_attribute(xml_job, "JobPrio")
-                job_dictionary['JobStatus'] = _job_attribute(xml_job, "JobStatus")
-                job_dictionary['ClusterId'] = _job_attribute(xml_job, "ClusterId")
-                job_dictionary['ProcId'] = _job_attribute(xml_job, "ProcId")
-                job_dictionary['ServerTime'] = _job_attribute(xml_job, "ServerTime")
-
-                # Optional parameters
-                _add_if_exists(xml_job, job_dictionary, "VMNetwork")
-                _add_if_exists(xml_job, job_dictionary, "VMCPUArch")
-                _add_if_exists(xml_job, job_dictionary, "VMName")
-                _add_if_exists(xml_job, job_dictionary, "VMLoc")
-                _add_if_exists(xml_job, job_dictionary, "VMMem")
-                _add_if_exists(xml_job, job_dictionary, "VMCPUCores")
-                _add_if_exists(xml_job, job_dictionary, "VMStorage")
-                _add_if_exists(xml_job, job_dictionary, "VMKeepAlive")
-                _add_if_exists(xml_job, job_dictionary, "VMMaximumPrice")
-                _add_if_exists(xml_job, job_dictionary, "CSMyProxyCredsName")
-                _add_if_exists(xml_job, job_dictionary, "CSMyProxyServer")
-                _add_if_exists(xml_job, job_dictionary, "CSMyProxyServerPort")
-                _add_if_exists(xml_job, job_dictionary, "x509userproxysubject")
-                _add_if_exists(xml_job, job_dictionary, "x509userproxy")
-                _add_if_exists(xml_job, job_dictionary, "VMHighPriority")
-                _add_if_exists(xml_job, job_dictionary, "VMJobPerCore")
-                _add_if_exists(xml_job, job_dictionary, "RemoteHost")
-                _add_if_exists(xml_job, job_dictionary, "TargetClouds")
-                _add_if_exists(xml_job, job_dictionary, "JobStartDate")
-                _add_if_exists(xml_job, job_dictionary, "Iwd")
-                _add_if_exists(xml_job, job_dictionary, "SUBMIT_x509userproxy")
-
-                # Requirements requires special fiddling
-                requirements = _job_attribute(xml_job, "Requirements")
-                if requirements:
-                    vmtype = _attribute_from_requirements(requirements, "VMType")
-                    if vmtype:
-                        job_dictionary['VMType'] = vmtype
-
-                # VMAMI requires special fiddling
-                _add_dict_if_exists(xml_job, job_dictionary, "VMAMI")
-                _add_dict_if_exists(xml_job, job_dictionary, "VMInstanceType")
-
-                jobs.append(Job(**job_dictionary))
+                jobs.append(job_factory(xml_classad_attributes(elem)))
 
                 elem.clear()
+                while elem.getprevious() != None:
+                    del elem.getparent()[0]
         return jobs
 
+    def _job_from_classad(self, classad, new_job):
+        """Job factory for the query parsers which reuses the jobs in the container.
+
+        For a job already in the container only the fields which change
+        between polls are read, into a JobStatusUpdate. A new Job is built
+        with new_job(classad) only for jobs the container doesn't have yet.
+        """
+        job = self.job_container.get_job_by_id(classad.get("GlobalJobId"))
+        if job == None:
+            return new_job(classad)
+        return JobStatusUpdate(job.id, int(classad.get("JobStatus") or 0),
+                               classad.get("RemoteHost", "").strip() or None,
+                               classad.get("ServerTime") or 0,
+                               classad.get("JobStartDate", "").strip() or 0)
 
  
     def update_jobs(self, query_jobs):
         """Updates the system jobs:
             - Removes finished or deleted jobs from the system
-            - Ignores jobs already in the system and still in Condor
+            - Updates the status of jobs already in the system
             - Adds all new jobs to the system
+           The counts and timings of each phase are kept in last_update_stats.
            Keywords:
             - query_jobs - (list of Job objects) The jobs received from a condor query
         """
-        # If no jobs recvd, remove all jobs from the system (all have finished or have been removed)
-        if (query_jobs == []):
-            log.debug("No jobs received from job query. Removing all jobs from the system.")
-            self.job_container.clear()
-            return
+        self.last_full_query = datetime.datetime.now()
+        self._track_server_time(query_jobs)
 
         # Filter out any jobs in an error status (from the given job list)
-        for job in query_jobs:
-            if job.job_status >= self.ERROR or job.job_status == self.REMOVED or job.job_status == self.COMPLETE:
-                query_jobs.remove(job)
-
-        # Update all system jobs:
-        #   - remove jobs already in the system from the jobs list
-        #   - remove finished jobs (job in system, not in jobs list)
-
-        # DBG: print both jobs dicts before updating system.
-        #log.verbose("System jobs prior to system update:")
-        #log.verbose("Unscheduled Jobs (new_jobs):")
-        #self.log_unsched_jobs()
-        #log.verbose("Scheduled Jobs (sched_jobs):")
-        #self.log_sched_jobs()
-        #log.verbose("High Priority Jobs (high_jobs):")
-        #self.log_high_jobs()
-
-        # Lets remove all jobs in the container that do not appear in the
-        # given condor job list.
-        # Keep a list of the removed jobs
-        removed = self.job_container.remove_all_not_in(query_jobs)
+        filter_start = time.time()
+        query_jobs = [job for job in query_jobs if job.job_status < self.ERROR
+                      and job.job_status != self.REMOVED and job.job_status != self.COMPLETE]
+
+        # Bring the container in line with condor: jobs not in the query are
+        # removed, new jobs are added and known jobs have their status updated
+        sync_start = time.time()
+        (added, removed, changed) = self.job_container.sync_jobs(query_jobs)
+
+        track_start = time.time()
         self.track_run_time(removed)
+        track_end = time.time()
+
+        self.last_update_stats = {'added': len(added), 'removed': len(removed),
+                                  'changed': len(changed),
+                                  'filter_time': sync_start - filter_start,
+                                  'sync_time': track_start - sync_start,
+                                  'track_time': track_end - track_start}
+        log.debug("Updated jobs: %d added, %d removed, %d changed [filter %.3fs, sync %.3fs, run times %.3fs]"
+                  % (len(added), len(removed), len(changed), sync_start - filter_start,
+                     track_start - sync_start, track_end - track_start))
+        self.publish_snapshot()
+
+    def update_jobs_delta(self, query_jobs):
+        """Merges the result of a delta query into the system jobs:
+            - Removes jobs which have finished, been removed or errored
+            - Updates the status of jobs already in the system
+            - Adds all new jobs to the system
+           Jobs which leave the Condor queue are not seen by a delta query,
+           they are removed by the next full query (see full_query_due).
+           Keywords:
+            - query_jobs - (list of Job objects) The jobs received from a delta query
+        """
+        self._track_server_time(query_jobs)
 
-        # Now lets loop through the remaining jobs given by condor and
-        # check if each job is in the job container.
-        # If yes, then it means the job is not new (the container already
-        # knows about it) and we simply need to update it.
-        # In that case, we also remove it from the query_jobs, so that
-        # only new jobs will remain in query_jobs after this step.
-        jobs_to_update = []
-        new_jobs = []
+        finished = []
+        added = 0
+        updated = 0
         for job in query_jobs:
-            if self.job_container.has_job(job.id):
-                jobs_to_update.append(job)
+            if job.job_status >= self.ERROR or job.job_status == self.REMOVED or job.job_status == self.COMPLETE:
+                system_job = self.job_container.get_job_by_id(job.id)
+                if system_job != None:
+                    finished.append(system_job)
+            elif self.job_container.has_job(job.id):
+                self.update_job_status(job)
+                updated += 1
+            elif isinstance(job, JobStatusUpdate):
+                # The job left the container since the query was parsed
+                continue
             else:
-                new_jobs.append(job)
-        query_jobs = new_jobs
+                if job.high_priority == 0:
+                    self.add_new_job(job)
+                else:
+                    self.add_high_job(job)
+                added += 1
+                log.verbose("Job %s added to unscheduled jobs list" % job.id)
+
+        if finished:
+            self.job_container.remove_jobs(finished)
+            self.track_run_time(finished)
+        self.job_container.expire_bans()
+        log.debug("Delta update: %d added, %d updated, %d removed" % (added, updated, len(finished)))
+        self.publish_snapshot()
+
+    def publish_snapshot(self):
+        """Publish a new view of the job container (see JobContainerView).
+
+        The view is swapped in with a single assignment, so readers of
+        job_pool.snapshot always see one complete generation, and can
+        iterate it without taking the container lock.
+        """
+        self.snapshot = self.job_container.get_view()
 
-        # Add all jobs remaining in jobs list to the Unscheduled job set (new_jobs)
-        for job in query_jobs:
-            if job.high_priority == 0:
-                self.add_new_job(job)
-            else:
-                self.add_high_job(job)
-            log.verbose("Job %s added to unscheduled jobs list" % job.id)
-        del query_jobs
-
-
-        # Update job status of all the non-new jobs
-        log.debug("Updating job status of %d jobs" % (len(jobs_to_update)))
-        for job in jobs_to_update:
-            self.update_job_status(job)
-        del jobs_to_update
-
-        # DBG: print both jobs dicts before updating system.
-        #log.verbose("System jobs after system update:")
-        #log.verbose("Unscheduled Jobs (new_jobs):")
-        #self.log_unsched_jobs()
-        #log.verbose("Scheduled Jobs (sched_jobs):")
-        #self.log_sched_jobs()
-        #log.verbose("High Priority Jobs (high_jobs):")
-        #self.log_high_jobs()
+    def get_snapshot(self):
+        """Returns the JobContainerView of the container's current generation.
+
+        A new view is published as soon as the generation changes, so jobs
+        scheduled, banned or removed between polls are seen by readers
+        straight away; while nothing changes the published view is reused.
+        """
+        snapshot = self.snapshot
+        if snapshot == None or snapshot.generation != self.job_container.get_generation():
+            self.publish_snapshot()
+            snapshot = self.snapshot
+        return snapshot
 
     def add_new_job(self, job):
         """Add New Job
@@ -750,6 +914,24 @@ class JobPool:
         """
         self.job_container.unschedule_job(job.id)
 
+    def schedule_many(self, jobs):
+        """Marks a list of jobs as scheduled all at once.
+
+            Keywords:
+                jobs - (list of Job objects) The jobs to mark as scheduled
+            Returns the number of jobs which were newly marked as scheduled.
+        """
+        return self.job_container.schedule_many([job.id for job in jobs])
+
+    def unschedule_many(self, jobs):
+        """Marks a list of jobs as unscheduled all at once.
+
+            Keywords:
+                jobs - (list of Job objects) The jobs to mark as unscheduled
+            Returns the number of jobs which were newly marked as unscheduled.
+        """
+        return self.job_container.unschedule_many([job.id for job in jobs])
+
     def get_required_vmtypes(self):
         """Get a list of required VM types.
 
@@ -759,11 +941,7 @@ class JobPool:
            required_vmtypes - (list of strings) A list of required VM types
 
         """
-        required_vmtypes = []
-        for job in self.job_container.get_all_jobs():
-            if job.req_vmtype not in required_vmtypes and job.job_status <= self.RUNNING \
-            and not job.banned:
-                required_vmtypes.append(job.req_vmtype)
+        required_vmtypes = self.job_container.get_required_vmtype_counts().keys()
 
         log.debug("get_required_vmtypes - Required VM types: " + ", ".join(required_vmtypes))
         return required_vmtypes
@@ -778,11 +956,7 @@ class JobPool:
             required_vmtypes - (list of strings) A list of required VM types
 
         """
-        required_vmtypes = []
-        for job in self.job_container.get_all_jobs():
-            if job.uservmtype not in required_vmtypes and job.job_status <= self.RUNNING \
-               and not job.banned:
-                required_vmtypes.append(job.uservmtype)
+        required_vmtypes = self.job_container.get_required_usertype_counts().keys()
 
         log.debug("get_required_uservmtypes - Required VM types: " + ", ".join(required_vmtypes))
         return required_vmtypes
@@ -797,13 +971,7 @@ class JobPool:
             required_vmtypes - (dictionary, string key, int value)
 
         """
-        required_vmtypes = {}
-        for job in self.job_container.get_all_jobs():
-            if job.req_vmtype not in required_vmtypes and job.job_status <= self.RUNNING \
-               and not job.banned:
-                required_vmtypes[job.req_vmtype] = 1
-            elif job.job_status <= self.RUNNING and not job.banned:
-                required_vmtypes[job.req_vmtype] += 1
+        required_vmtypes = self.job_container.get_required_vmtype_counts()
         log.debug("get_required_vm_types_dict - Required VM Type : Count " + str(required_vmtypes))
         return required_vmtypes
 
@@ -814,13 +982,7 @@ class JobPool:
         Returns:
             required_vmtypes - (dictionary, string key, int value) A dict of required VM types
         """
-        required_vmtypes = {}
-        for job in self.job_container.get_all_jobs():
-            if job.uservmtype not in required_vmtypes and job.job_status <= self.RUNNING \
-               and not job.banned:
-                required_vmtypes[job.uservmtype] = 1
-            elif job.job_status <= self.RUNNING and not job.banned:
-                required_vmtypes[job.uservmtype] += 1
+        required_vmtypes = self.job_container.get_required_usertype_counts()
         log.debug("get_required_vm_usertypes_dict - Required VM Type : Count " + str(required_vmtypes))
         return required_vmtypes
 
@@ -845,9 +1007,9 @@ class JobPool:
                 held_user_adjust -= 1 #This user is completely held
                 break
             if vmtype in type_desired.keys():
-                type_desired[vmtype] += 1 * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                type_desired[vmtype] += (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
             else:
-                type_desired[vmtype] = 1 * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                type_desired[vmtype] = (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
         for user in high_priority_jobs_by_users.keys():
             vmtype = None
             for job in high_priority_jobs_by_users[user]:
@@ -861,12 +1023,12 @@ class JobPool:
                 type_desired[vmtype] += 1 * config.high_priority_job_weight
             else:
                 type_desired[vmtype] = 1 * config.high_priority_job_weight
-        num_users = Decimal(held_user_adjust + len(new_jobs_by_users.keys()) + len(high_priority_jobs_by_users.keys()))
+        num_users = held_user_adjust + len(new_jobs_by_users.keys()) + len(high_priority_jobs_by_users.keys())
         if num_users == 0:
             log.debug("All users held, completed, or banned")
             return {}
         for vmtype in type_desired.keys():
-            type_desired[vmtype] = type_desired[vmtype] / num_users
+            type_desired[vmtype] = Fraction(type_desired[vmtype], num_users)
         return type_desired
 
     def job_usertype_distribution_normal(self):
@@ -889,9 +1051,9 @@ class JobPool:
                 held_user_adjust -= 1 #This user is completely held
                 continue
             if vmtype in type_desired.keys():
-                type_desired[vmtype] += 1 * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                type_desired[vmtype] += (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
             else:
-                type_desired[vmtype] = 1 * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                type_desired[vmtype] = (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
         for user in high_priority_jobs_by_users.keys():
             vmtype = None
             for job in high_priority_jobs_by_users[user]:
@@ -905,12 +1067,12 @@ class JobPool:
                 type_desired[vmtype] += 1 * config.high_priority_job_weight
             else:
                 type_desired[vmtype] = 1 * config.high_priority_job_weight
-        num_users = Decimal(held_user_adjust + len(new_jobs_by_users.keys()) + len(high_priority_jobs_by_users.keys()))
+        num_users = held_user_adjust + len(new_jobs_by_users.keys()) + len(high_priority_jobs_by_users.keys())
         if num_users == 0:
             log.debug("All users held, completed, or banned")
             return {}
         for vmtype in type_desired.keys():
-            type_desired[vmtype] = type_desired[vmtype] / num_users
+            type_desired[vmtype] = Fraction(type_desired[vmtype], num_users)
         return type_desired
 
     def job_type_distribution_multi_vmtype(self):
@@ -951,18 +1113,18 @@ class JobPool:
         for user in user_types.keys():
             for vmtype in user_types[user]:
                 if vmtype in type_desired.keys():
-                    type_desired[vmtype] += Decimal('1.0') / len(user_types[user]) * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                    type_desired[vmtype] += Fraction(1, len(user_types[user])) * (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
                 else:
-                    type_desired[vmtype] = Decimal('1.0') / len(user_types[user]) * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                    type_desired[vmtype] = Fraction(1, len(user_types[user])) * (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
         for user in high_user_types.keys():
             for vmtype in high_user_types[user]:
                 if vmtype in type_desired.keys():
-                    type_desired[vmtype] += Decimal('1.0') / len(high_user_types[user]) * config.high_priority_job_weight
+                    type_desired[vmtype] += Fraction(config.high_priority_job_weight, len(high_user_types[user]))
                 else:
-                    type_desired[vmtype] = Decimal('1.0') / len(high_user_types[user]) * config.high_priority_job_weight
+                    type_desired[vmtype] = Fraction(config.high_priority_job_weight, len(high_user_types[user]))
         num_users = held_user_adjust + len(set(user_types.keys() + high_user_types.keys()))
         if num_users != 0:
-            num_users = Decimal('1.0') / num_users
+            num_users = Fraction(1, num_users)
         else:
             log.debug("All users' jobs held, complete, or banned")
             return {}
@@ -1009,18 +1171,18 @@ class JobPool:
         for user in user_types.keys():
             for vmtype in user_types[user]:
                 if vmtype in type_desired.keys():
-                    type_desired[vmtype] += Decimal('1.0') / len(user_types[user]) * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                    type_desired[vmtype] += Fraction(1, len(user_types[user])) * (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
                 else:
-                    type_desired[vmtype] = Decimal('1.0') / len(user_types[user]) * (1 / Decimal(config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
+                    type_desired[vmtype] = Fraction(1, len(user_types[user])) * (Fraction(1, config.high_priority_job_weight) if high_priority_jobs_by_users else 1)
         for user in high_user_types.keys():
             for vmtype in high_user_types[user]:
                 if vmtype in type_desired.keys():
-                    type_desired[vmtype] += Decimal('1.0') / len(high_user_types[user]) * config.high_priority_job_weight
+                    type_desired[vmtype] += Fraction(config.high_priority_job_weight, len(high_user_types[user]))
                 else:
-                    type_desired[vmtype] = Decimal('1.0') / len(high_user_types[user]) * config.high_priority_job_weight
+                    type_desired[vmtype] = Fraction(config.high_priority_job_weight, len(high_user_types[user]))
         num_users = held_user_adjust + len(set(user_types.keys() + high_user_types.keys()))
         if num_users != 0:
-            num_users = Decimal('1.0') / num_users
+            num_users = Fraction(1, num_users)
         else:
             log.debug("All users' jobs held, complete, or banned")
             return {}
@@ -1051,19 +1213,19 @@ class JobPool:
         failed = []
         for job in jobs:
             try:
-                job_ret = self.condor_schedd.service.holdJob(None, job.cluster_id, job.proc_id, None, False, False, True)
+                job_ret = self._schedd_for(job).service.holdJob(None, job.cluster_id, job.proc_id, None, False, False, True)
                 if job_ret.code != "SUCCESS":
                     failed.append(job)
             except URLError, e:
                 log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s) for the following "
                       "reason: %s"
-                      % (config.condor_webservice_url, e.reason))
+                      % (job.schedd or config.condor_webservice_url, e.reason))
                 return None
             except:
                 log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s). Unknown reason."
-                      % (config.condor_webservice_url))
+                      % (job.schedd or config.condor_webservice_url))
                 return None
         return failed
 
@@ -1076,19 +1238,19 @@ class JobPool:
         failed = []
         for job in jobs:
             try:
-                job_ret = self.condor_schedd.service.releaseJob(None, job.cluster_id, job.proc_id, None, False, False)
+                job_ret = self._schedd_for(job).service.releaseJob(None, job.cluster_id, job.proc_id, None, False, False)
                 if job_ret.code != "SUCCESS":
                     failed.append(job)
             except URLError, e:
                 log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s) for the following "
                       "reason: %s"
-                      % (config.condor_webservice_url, e.reason))
+                      % (job.schedd or config.condor_webservice_url, e.reason))
                 return None
             except:
                 log.error("There was a problem connecting to the "
                       "Condor scheduler web service (%s). Unknown reason."
-                      % (config.condor_webservice_url))
+                      % (job.schedd or config.condor_webservice_url))
                 return None
         return failed
 
@@ -1218,6 +1380,53 @@ class JobPool:
 
 
 
+# shared immutable values
+
+# Values shared between jobs. Job queues hold many jobs with the same owner,
+# VM type, image and AMIs, so each distinct value is kept only once, and only
+# for as long as some job still uses it: strings are interned, and read-only
+# dicts are held weakly.
+_shared_dicts = weakref.WeakValueDictionary()
+
+def _shared(value):
+    """
+    _shared -- return the shared instance of a string equal to the given one.
+    Other values, like tuples, unicode strings and None, are returned as they
+    are.
+    """
+    if type(value) == str:
+        return intern(value)
+    return value
+
+class _ReadOnlyDict(dict):
+    """A dict which can't be modified, so it can be shared and hashed."""
+    def __hash__(self):
+        return hash(frozenset(self.iteritems()))
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'%s' object is read-only" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+def _shared_dict(value):
+    """
+    _shared_dict -- return a shared read-only copy of a dict (like a job's
+    VMAMI). Values which aren't dicts are shared with _shared.
+    """
+    if not isinstance(value, dict):
+        return _shared(value)
+    key = frozenset(value.iteritems())
+    shared = _shared_dicts.get(key)
+    if shared == None:
+        if not isinstance(value, _ReadOnlyDict):
+            value = _ReadOnlyDict(value)
+        shared = _shared_dicts.setdefault(key, value)
+    return shared
+
 # utility parsing methods
 
 def _attr_list_to_dict(attr_list):
@@ -1248,3 +1457,82 @@ def _attr_list_to_dict(attr_list):
             raise ValueError("Can't split '%s' into suitable host attribute pair" % host_attr)
 
     return attr_dict
+
+# Job classAd attributes copied into a Job when present and non-empty
+_OPTIONAL_JOB_ATTRIBUTES = ("VMNetwork", "VMCPUArch", "VMName", "VMLoc",
+        "VMMem", "VMCPUCores", "VMStorage", "VMKeepAlive", "VMMaximumPrice",
+        "CSMyProxyCredsName", "CSMyProxyServer", "CSMyProxyServerPort",
+        "x509userproxysubject", "x509userproxy", "VMHighPriority",
+        "VMJobPerCore", "RemoteHost", "TargetClouds", "JobStartDate", "Iwd",
+        "SUBMIT_x509userproxy")
+
+# Every job classAd attribute cloud scheduler reads. This is the projection
+# asked of condor_q when condor_attribute_projection is enabled.
+JOB_CLASSAD_ATTRIBUTES = ("GlobalJobId", "Owner", "JobPrio", "JobStatus",
+        "ClusterId", "ProcId", "ServerTime", "Requirements", "VMAMI",
+        "VMInstanceType") + _OPTIONAL_JOB_ATTRIBUTES
+
+def _attribute_from_requirements(requirements, attribute):
+    regex = "%s\s=\?=\s\"(?P<value>.+?)\"" % attribute
+    match = re.search(regex, requirements)
+    if match:
+        return match.group("value")
+    else:
+        return ""
+
+def _job_dictionary_from_attributes(attributes):
+    """
+    _job_dictionary_from_attributes -- build the keyword arguments for a Job
+    from a dictionary of raw classAd attribute values.
+    """
+    job_dictionary = {}
+    # Mandatory parameters
+    for attribute in ("GlobalJobId", "Owner", "JobPrio", "JobStatus",
+                      "ClusterId", "ProcId", "ServerTime"):
+        job_dictionary[attribute] = attributes.get(attribute, "")
+
+    # Optional parameters
+    for attribute in _OPTIONAL_JOB_ATTRIBUTES:
+        job_value = attributes.get(attribute, "").strip()
+        if job_value:
+            job_dictionary[attribute] = job_value
+
+    # Requirements requires special fiddling
+    requirements = attributes.get("Requirements")
+    if requirements:
+        vmtype = _attribute_from_requirements(requirements, "VMType")
+        if vmtype:
+            job_dictionary['VMType'] = vmtype
+
+    # VMAMI requires special fiddling
+    for attribute in ("VMAMI", "VMInstanceType"):
+        attr_list = attributes.get(attribute)
+        if attr_list:
+            try:
+                job_dictionary[attribute] = _attr_list_to_dict(attr_list)
+            except:
+                log.exception("Problem extracting %s attribute '%s'" % (attribute, attr_list))
+
+    return job_dictionary
+
+def _job_from_xml_classad(attributes):
+    """Build a Job from the attribute map of a SOAP job classAd."""
+    return Job(**_job_dictionary_from_attributes(attributes))
+
+def _job_from_condor_q_classad(classad):
+    """Build a Job from a condor_q -l classAd dictionary."""
+    try:
+        classad["VMType"] = _attribute_from_requirements(classad["Requirements"], "VMType")
+    except:
+        log.exception("Problem extracting VMType from Requirements")
+
+    # VMAMI requires special fiddling
+    for attribute in ("VMAMI", "VMInstanceType"):
+        if attribute in classad:
+            attr_list = classad[attribute]
+            try:
+                classad[attribute] = _attr_list_to_dict(attr_list)
+            except ValueError:
+                log.exception("Problem extracting %s attribute '%s'" % (attribute, attr_list))
+
+    return Job(**classad)
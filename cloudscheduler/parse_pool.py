@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# vim: set expandtab ts=4 sw=4:
+
+# Copyright (C) 2009 University of Victoria
+# You may distribute under the terms of either the GNU General Public
+# License or the Apache v2 License, as specified in the README file.
+
+## PARSE POOL
+##
+## Parses large Condor query responses in worker processes. A response is
+## split into chunks at classAd boundaries, each chunk is parsed by a worker
+## into plain dictionaries of attribute names to values, and the parent turns
+## those into Job objects or machine dictionaries. This keeps the parsing off
+## the GIL the other cloud scheduler threads need.
+##
+
+from __future__ import with_statement
+import re
+import logging
+import threading
+import multiprocessing
+from StringIO import StringIO
+
+from lxml import etree
+
+import cloudscheduler.config as config
+from cloudscheduler.utilities import iter_condor_classads
+from cloudscheduler.utilities import xml_classad_attributes
+
+log = logging.getLogger("cloudscheduler")
+
+# Responses smaller than this are parsed in the calling process
+MIN_PARALLEL_BYTES = 1024 * 1024
+
+# Number of ads sent to a worker at a time when parsing text output
+TEXT_CHUNK_ADS = 2000
+
+# A SOAP classAd starts with an item element whose first child is an item
+_XML_AD_START = re.compile(r"<item>\s*<item>")
+_XML_NAMESPACES = re.compile(r"""\sxmlns(?::\w+)?=(?:"[^"]*"|'[^']*')""")
+
+
+class ParsePool:
+    """A pool of worker processes parsing Condor SOAP XML and -l text output."""
+
+    def __init__(self, processes):
+        """
+        processes - (int) The number of worker processes to start
+        """
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes)
+        log.debug("ParsePool started with %d worker processes" % processes)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def parse_xml(self, condor_xml, list_tag, attributes=None, keep_last=False):
+        """Parse the classAds of a Condor SOAP response.
+
+        Keywords:
+            condor_xml - (str) The SOAP response
+            list_tag   - (str) The element holding the ads, like 'classAdArray'
+            attributes - (sequence) Only keep these attributes, or all if None
+            keep_last  - (bool) Keep the last value of a repeated attribute
+                         rather than the first, see xml_classad_attributes
+        Returns a list of dictionaries, one per classAd, in response order.
+        """
+        chunks = split_xml_classads(condor_xml, list_tag, self.processes * 4)
+        if len(chunks) <= 1 or len(condor_xml) < MIN_PARALLEL_BYTES:
+            return _parse_xml_chunk((condor_xml, list_tag, attributes, keep_last))
+
+        ads = []
+        for chunk_ads in self.pool.map(_parse_xml_chunk,
+                [(chunk, list_tag, attributes, keep_last) for chunk in chunks]):
+            ads.extend(chunk_ads)
+        return ads
+
+    def parse_text(self, lines, attributes=None):
+        """Parse the classAds of condor_q -l or condor_status -l output.
+
+        The lines are read and sent to the workers a chunk at a time, so the
+        output of a command can be parsed as it is produced.
+
+        Keywords:
+            lines      - Iterable of output lines, like a pipe from condor_q
+            attributes - (sequence) Only keep these attributes, or all if None
+        Returns a list of dictionaries, one per classAd, in output order.
+        """
+        ads = []
+        for chunk_ads in self.pool.imap(_parse_text_chunk,
+                ((chunk, attributes) for chunk in split_text_classads(lines, TEXT_CHUNK_ADS))):
+            ads.extend(chunk_ads)
+        return ads
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    """Returns the shared ParsePool, or None if parse_processes is not set.
+
+    The pool is started on first use. It should first be asked for before
+    the cloud scheduler threads start, so that the workers are forked from
+    a process with a single thread.
+    """
+    global _parse_pool
+    if config.parse_processes < 1:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool == None:
+            _parse_pool = ParsePool(config.parse_processes)
+    return _parse_pool
+
+
+def split_xml_classads(condor_xml, list_tag, num_chunks):
+    """Split a SOAP response into at most num_chunks XML documents, each
+    holding whole classAds in a list_tag element. Splits are found by
+    searching for the start of an ad near evenly spaced offsets, so the
+    response isn't scanned ad by ad.
+
+    Returns [] if the response has no list_tag element.
+    """
+    list_start = condor_xml.find("<%s>" % list_tag)
+    list_end = condor_xml.rfind("</%s>" % list_tag)
+    if list_start == -1 or list_end == -1:
+        return []
+    ads_start = list_start + len(list_tag) + 2
+
+    # Namespaces declared on the envelope are declared again on each chunk
+    root_start = condor_xml.find("<", condor_xml.find("?>") + 1)
+    root_tag = condor_xml[root_start:condor_xml.find(">", root_start)]
+    namespaces = "".join(_XML_NAMESPACES.findall(root_tag))
+
+    boundaries = [ads_start]
+    step = max(1, (list_end - ads_start) / max(1, num_chunks))
+    offset = ads_start + step
+    while offset < list_end:
+        match = _XML_AD_START.search(condor_xml, offset, list_end)
+        if not match:
+            break
+        if match.start() > boundaries[-1]:
+            boundaries.append(match.start())
+        offset = max(match.end(), boundaries[-1] + step)
+    boundaries.append(list_end)
+
+    chunks = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        chunks.append("<%s%s>%s</%s>" % (list_tag, namespaces, condor_xml[start:end], list_tag))
+    return chunks
+
+
+def split_text_classads(lines, ads_per_chunk):
+    """Generate strings of ads_per_chunk classAds each from -l output lines,
+    splitting only at the blank lines between ads."""
+    chunk = []
+    ads = 0
+    for line in lines:
+        chunk.append(line)
+        if not line.strip():
+            ads += 1
+            if ads >= ads_per_chunk:
+                yield "".join(chunk)
+                chunk = []
+                ads = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def _project(ads, attributes):
+    if attributes == None:
+        return ads
+    return [dict((name, ad[name]) for name in attributes if name in ad) for ad in ads]
+
+def _parse_xml_chunk((condor_xml, list_tag, attributes, keep_last)):
+    """Worker: parse the classAds in list_tag elements of an XML document."""
+    ads = []
+    for action, elem in etree.iterparse(StringIO(condor_xml)):
+        if elem.tag == "item" and elem.getparent().tag == list_tag:
+            ads.append(xml_classad_attributes(elem, keep_last))
+            elem.clear()
+            while elem.getprevious() != None:
+                del elem.getparent()[0]
+    return _project(ads, attributes)
+
+def _parse_text_chunk((output, attributes)):
+    """Worker: parse the classAds in a piece of -l output."""
+    return _project(list(iter_condor_classads(StringIO(output))), attributes)
@@ -40,7 +40,7 @@ class JobProxyRefresher(threading.Thread):
                 # The following timestamp is use to time this proxy refresh cycle.
                 cycle_start_ts = datetime.datetime.today()
 
-                jobs = self.job_pool.job_container.get_all_jobs()
+                jobs = self.job_pool.get_snapshot().get_all_jobs()
                 log.debug("Refreshing job user proxies. [%d proxies to process]" % (len(jobs)))
                 for job in jobs:
                     jobcertextime = job.get_x509userproxy_expiry_time()
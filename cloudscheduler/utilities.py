@@ -9,7 +9,9 @@ import ConfigParser
 import subprocess
 import time
 import errno
+import urllib2
 from urlparse import urlparse
+from xml.sax.saxutils import escape
 from datetime import datetime
 import config
 try:
@@ -67,6 +69,82 @@ def splitnstrip(sep, str):
     return [x.strip() for x in str.split(sep)];
 
 
+def iter_condor_classads(lines):
+    """
+    Generate classAds, one dictionary at a time, from the lines of condor_q -l
+    or condor_status -l output. Ads are separated by blank lines, and lines
+    which aren't 'Name = Value' pairs (like the condor_q Submitter header)
+    are skipped. Quotes around values are removed.
+    """
+    classad = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if classad:
+                yield classad
+                classad = {}
+            continue
+        try:
+            (classad_key, classad_value) = line.split(" = ", 1)
+        except ValueError:
+            continue
+        classad[classad_key] = classad_value.strip('"')
+    if classad:
+        yield classad
+
+
+def xml_classad_attributes(xml_classad, keep_last=False):
+    """
+    xml_classad_attributes -- walk the attribute items of one SOAP classAd
+    a single time, returning a dictionary of attribute name to value text.
+
+    Missing or empty values are returned as "". If an attribute name appears
+    more than once, the first value wins, as in a job ad lookup, or the last
+    value with keep_last, as in a machine ad.
+    """
+    attributes = {}
+    for xml_attribute in xml_classad.iterchildren("item"):
+        name = None
+        value = ""
+        for child in xml_attribute.iterchildren():
+            if child.tag == "name":
+                name = child.text
+            elif child.tag == "value":
+                value = child.text or ""
+        if name and (keep_last or name not in attributes):
+            attributes[name] = value
+    return attributes
+
+
+SOAP_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+<SOAP-ENV:Body><condor:%(operation)s>%(parameters)s</condor:%(operation)s></SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+def condor_soap_request(url, operation, parameters=(), timeout=None):
+    """
+    condor_soap_request -- call a Condor SOAP operation and return the
+    response as an open file-like object, so that it can be parsed as it
+    arrives instead of being read into memory first.
+
+    parameters is a sequence of (name, value) pairs with string values, sent
+    in order. Parameters with a value of None are left out.
+
+    Raises urllib2.URLError (or HTTPError on a SOAP fault) on failure. The
+    caller should close the returned response.
+    """
+    xml_parameters = ""
+    for name, value in parameters:
+        if value != None:
+            xml_parameters += "<%s>%s</%s>" % (name, escape(value), name)
+    request = urllib2.Request(url,
+            SOAP_REQUEST % {"operation": operation, "parameters": xml_parameters},
+            {"Content-Type": "text/xml; charset=utf-8", "SOAPAction": '""'})
+    if timeout == None:
+        return urllib2.urlopen(request)
+    return urllib2.urlopen(request, timeout=timeout)
+
+
 def get_globus_path(executable="grid-proxy-init"):
     """
     Finds the path for Globus executables on the machine. 
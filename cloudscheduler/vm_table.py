@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# vim: set expandtab ts=4 sw=4:
+
+# Copyright (C) 2009 University of Victoria
+# You may distribute under the terms of either the GNU General Public
+# License or the Apache v2 License, as specified in the README file.
+
+## VM TABLE
+##
+## Keeps the resources of every VM in a resource pool in columns, one row per
+## VM, along with running totals for each uservmtype. The table listens to
+## the pool's clusters, so the totals the scheduling metrics need are kept up
+## to date as VMs are added and removed instead of being summed up again from
+## every VM each time they are asked for.
+##
+
+from __future__ import with_statement
+import logging
+import threading
+from array import array
+
+log = logging.getLogger("cloudscheduler")
+
+# Indexes into the running totals of a type
+COUNT = 0
+MEMORY = 1
+CORES = 2
+STORAGE = 3
+
+
+class VMTable:
+    """Columns of the memory, cores, storage, type and job_per_core setting of
+    a set of VMs, with running totals by uservmtype.
+
+    Rows are removed by moving the last row into their place, so adding and
+    removing a VM takes constant time.
+    """
+
+    def __init__(self):
+        self.memory = array('l')
+        self.cores = array('l')
+        self.storage = array('l')
+        self.type_codes = array('l')
+        self.job_per_core = array('b')
+        self.vms = []           # The VM of each row
+        self.rows = {}          # id(vm) to its row
+        self.types = []         # uservmtype of each type code
+        self.type_codes_by_name = {}
+        # type code to [count, memory, cores, storage] of its VMs
+        self.totals = {}
+        # (type code, cores, memory, storage) to the number of job slots
+        # of that shape. A job_per_core VM gives one single core slot per core.
+        self.slot_counts = {}
+        # Goes up each time a VM is added or removed, or the table is rebuilt
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.vms)
+
+    # Cluster listener interface, see ICluster.add_vm_listener()
+    def vm_added(self, cluster, vm):
+        self.add(vm)
+
+    def vm_removed(self, cluster, vm):
+        self.remove(vm)
+
+    def resources_changed(self, cluster):
+        pass
+
+    def _type_code(self, uservmtype):
+        if uservmtype not in self.type_codes_by_name:
+            self.type_codes_by_name[uservmtype] = len(self.types)
+            self.types.append(uservmtype)
+        return self.type_codes_by_name[uservmtype]
+
+    # Adds a row's resources to the running totals, or takes them away when
+    # sign is -1. Call with the lock held.
+    def _total_row(self, row, sign):
+        code = self.type_codes[row]
+        if code not in self.totals:
+            self.totals[code] = [0, 0, 0, 0]
+        totals = self.totals[code]
+        totals[COUNT] += sign
+        totals[MEMORY] += sign * self.memory[row]
+        totals[CORES] += sign * self.cores[row]
+        totals[STORAGE] += sign * self.storage[row]
+        if totals[COUNT] == 0:
+            del self.totals[code]
+
+        if self.job_per_core[row]:
+            slot = (code, 1, self.memory[row], self.storage[row])
+            slots = self.cores[row]
+        else:
+            slot = (code, self.cores[row], self.memory[row], self.storage[row])
+            slots = 1
+        self.slot_counts[slot] = self.slot_counts.get(slot, 0) + sign * slots
+        if self.slot_counts[slot] == 0:
+            del self.slot_counts[slot]
+
+    def add(self, vm):
+        """Add a row for a VM. Does nothing if the VM already has one."""
+        with self.lock:
+            if id(vm) in self.rows:
+                return
+            row = len(self.vms)
+            self.vms.append(vm)
+            self.rows[id(vm)] = row
+            self.memory.append(int(vm.memory))
+            self.cores.append(int(vm.cpucores))
+            self.storage.append(int(vm.storage))
+            self.type_codes.append(self._type_code(vm.uservmtype))
+            self.job_per_core.append(bool(getattr(vm, "job_per_core", False)))
+            self._total_row(row, 1)
+            self.generation += 1
+
+    def remove(self, vm):
+        """Remove the row of a VM. Does nothing if the VM has no row."""
+        with self.lock:
+            row = self.rows.pop(id(vm), None)
+            if row == None:
+                return
+            self._total_row(row, -1)
+            last = len(self.vms) - 1
+            if row != last:
+                moved = self.vms[last]
+                self.vms[row] = moved
+                self.rows[id(moved)] = row
+                for column in (self.memory, self.cores, self.storage,
+                               self.type_codes, self.job_per_core):
+                    column[row] = column[last]
+            self.vms.pop()
+            for column in (self.memory, self.cores, self.storage,
+                           self.type_codes, self.job_per_core):
+                column.pop()
+            self.generation += 1
+
+    def rebuild(self, clusters):
+        """Replace the rows with the VMs of a list of clusters."""
+        with self.lock:
+            for column in (self.memory, self.cores, self.storage,
+                           self.type_codes, self.job_per_core):
+                del column[:]
+            del self.vms[:]
+            self.rows.clear()
+            self.totals.clear()
+            self.slot_counts.clear()
+            for cluster in clusters:
+                for vm in list(cluster.vms):
+                    self.add(vm)
+            self.generation += 1
+            log.debug("VM table rebuilt with %d VMs" % len(self.vms))
+
+    def count_by_type(self):
+        """Returns a dictionary of uservmtype to the number of VMs of it."""
+        with self.lock:
+            return dict((self.types[code], totals[COUNT])
+                        for code, totals in self.totals.iteritems())
+
+    def usage_by_type(self):
+        """Returns a dictionary of uservmtype to the total
+        [memory, cores, storage] of the VMs of it."""
+        with self.lock:
+            return dict((self.types[code], totals[MEMORY:])
+                        for code, totals in self.totals.iteritems())
+
+    def count_slots(self, uservmtype, cores, memory, storage):
+        """Returns the number of job slots of a shape on VMs of a uservmtype."""
+        with self.lock:
+            code = self.type_codes_by_name.get(uservmtype)
+            return self.slot_counts.get((code, cores, memory, storage), 0)
+
+    def slots_by_type(self):
+        """Returns a dictionary of uservmtype to a list of the job slots on
+        VMs of it, as {'memory': , 'cores': , 'storage': } dictionaries."""
+        with self.lock:
+            types = {}
+            for row in xrange(len(self.vms)):
+                slots = types.setdefault(self.types[self.type_codes[row]], [])
+                if self.job_per_core[row]:
+                    slot = {'memory': self.memory[row], 'cores': 1, 'storage': self.storage[row]}
+                    slots.extend([dict(slot) for core in xrange(self.cores[row])])
+                else:
+                    slots.append({'memory': self.memory[row], 'cores': self.cores[row],
+                                  'storage': self.storage[row]})
+            return types
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Benchmark for the memory used by queued jobs.
+#
+# Builds Job objects from synthetic classAds, like a job poll would, adds them
+# to a HashTableJobContainer and reports the resident memory used per job.
+#
+# Usage: ./scripts/develop/bench_job_memory.py [number of jobs] [number of users]
+#
+
+import os
+import gc
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import cloudscheduler.utilities as utilities
+import cloudscheduler.job_containers as job_containers
+from cloudscheduler.job_management import Job, _attr_list_to_dict
+
+log = utilities.get_cloudscheduler_logger()
+log.setLevel(100)
+
+
+def resident_bytes():
+    """Return the resident set size of this process, in bytes."""
+    statm = open("/proc/self/statm")
+    try:
+        resident_pages = int(statm.read().split()[1])
+    finally:
+        statm.close()
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def make_classad(i, num_users):
+    # Build every value with string formatting, as a parser would, so that
+    # equal values in different jobs start out as different string objects
+    user = i % num_users
+    return {"GlobalJobId": "bench.example.com#%d.%d#1274118681" % (i / 100, i % 100),
+            "Owner": "user%d" % user,
+            "JobPrio": "%d" % (i % 5),
+            "JobStatus": "%d" % (1 + i % 2),
+            "ClusterId": "%d" % (i / 100),
+            "ProcId": "%d" % (i % 100),
+            "ServerTime": "1274118753",
+            "VMType": "%s-vm%d" % ("canfarbase", user % 3),
+            "VMNetwork": "%s" % "private",
+            "VMCPUArch": "%s" % "x86",
+            "VMName": "canfarbase%d" % (user % 3),
+            "VMLoc": "http://vmrepo.example.com/vms/canfarbase%d.img.gz" % (user % 3),
+            "VMAMI": _attr_list_to_dict("us-east-1.ec2.amazonaws.com:ami-%08d,ami-%08d" % (user % 3, user % 3)),
+            "VMMem": "2048",
+            "VMCPUCores": "1",
+            "VMStorage": "10",
+            "TargetClouds": "cloud%d, cloud%d" % (user % 2, 2 + user % 2),
+            "x509userproxysubject": "/C=CA/O=Grid/CN=User %d" % user,
+            "x509userproxy": "/home/user%d/spool/%d/proxy" % (user, i),
+            "Iwd": "/home/user%d/spool/%d" % (user, i),
+            }
+
+
+def main(argv):
+    num_jobs = 100000
+    num_users = 50
+    if len(argv) > 1:
+        num_jobs = int(argv[1])
+    if len(argv) > 2:
+        num_users = int(argv[2])
+
+    container = job_containers.HashTableJobContainer()
+    gc.collect()
+    before = resident_bytes()
+
+    start = time.time()
+    for i in xrange(num_jobs):
+        container.add_job(Job(**make_classad(i, num_users)))
+    elapsed = time.time() - start
+
+    gc.collect()
+    after = resident_bytes()
+
+    print "%d jobs from %d users, built and stored in %.2f s" % (num_jobs, num_users, elapsed)
+    print "  resident memory:  %8.1f MB" % ((after - before) / 1048576.0)
+    print "  bytes per job:    %8.0f" % (float(after - before) / num_jobs)
+    print "  Job object size:  %8d bytes (excluding referenced values)" % sys.getsizeof(container.get_all_jobs()[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
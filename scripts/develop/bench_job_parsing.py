@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Benchmark for parsing Condor SOAP job ads into Job objects.
+#
+# Generates a synthetic getJobAds response and times the single pass parser
+# in JobPool._condor_job_xml_to_job_list against the previous implementation,
+# which ran one xpath query per attribute on every job.
+#
+# Usage: ./scripts/develop/bench_job_parsing.py [number of jobs] [repeats]
+#
+
+import os
+import sys
+import time
+import string
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from lxml import etree
+
+import cloudscheduler.utilities as utilities
+import cloudscheduler.job_management as job_management
+from cloudscheduler.job_management import Job, JobPool, _attr_list_to_dict
+
+log = utilities.get_cloudscheduler_logger()
+log.setLevel(100)
+
+JOB_AD = """          <item>
+            <item><name>MyType</name><type>STRING-ATTR</type><value>Job</value></item>
+            <item><name>TargetType</name><type>STRING-ATTR</type><value>Machine</value></item>
+            <item><name>ServerTime</name><type>INTEGER-ATTR</type><value>1274118753</value></item>
+            <item><name>GlobalJobId</name><type>STRING-ATTR</type><value>bench.example.com#%(cluster)d.%(proc)d#1274118681</value></item>
+            <item><name>Owner</name><type>STRING-ATTR</type><value>user%(user)d</value></item>
+            <item><name>JobPrio</name><type>INTEGER-ATTR</type><value>%(prio)d</value></item>
+            <item><name>JobStatus</name><type>INTEGER-ATTR</type><value>%(status)d</value></item>
+            <item><name>ClusterId</name><type>INTEGER-ATTR</type><value>%(cluster)d</value></item>
+            <item><name>ProcId</name><type>INTEGER-ATTR</type><value>%(proc)d</value></item>
+            <item><name>Cmd</name><type>STRING-ATTR</type><value>/home/user%(user)d/job.sh</value></item>
+            <item><name>Iwd</name><type>STRING-ATTR</type><value>/home/user%(user)d</value></item>
+            <item><name>QDate</name><type>INTEGER-ATTR</type><value>1274118681</value></item>
+            <item><name>EnteredCurrentStatus</name><type>INTEGER-ATTR</type><value>1274118697</value></item>
+            <item><name>JobUniverse</name><type>INTEGER-ATTR</type><value>5</value></item>
+            <item><name>ImageSize</name><type>INTEGER-ATTR</type><value>1</value></item>
+            <item><name>NumJobStarts</name><type>INTEGER-ATTR</type><value>0</value></item>
+            <item><name>RemoteHost</name><type>STRING-ATTR</type><value>vm%(proc)d.example.com</value></item>
+            <item><name>JobStartDate</name><type>INTEGER-ATTR</type><value>1274118697</value></item>
+            <item><name>VMName</name><type>STRING-ATTR</type><value>canfarbase</value></item>
+            <item><name>VMLoc</name><type>STRING-ATTR</type><value>http://vmrepo.example.com/vms/canfarbase_i386.img.gz</value></item>
+            <item><name>VMAMI</name><type>STRING-ATTR</type><value>ami-fdee0094</value></item>
+            <item><name>VMMem</name><type>STRING-ATTR</type><value>2048</value></item>
+            <item><name>VMCPUCores</name><type>STRING-ATTR</type><value>1</value></item>
+            <item><name>VMStorage</name><type>STRING-ATTR</type><value>10</value></item>
+            <item><name>VMNetwork</name><type>STRING-ATTR</type><value>private</value></item>
+            <item><name>VMCPUArch</name><type>STRING-ATTR</type><value>x86</value></item>
+            <item><name>Requirements</name><type>EXPRESSION-ATTR</type><value>VMType =?= "canfarbase" &amp;&amp; Arch == "INTEL"</value></item>
+          </item>
+"""
+
+RESPONSE_HEAD = """<?xml version="1.0" encoding="utf-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+  <SOAP-ENV:Body>
+    <condor:getJobAdsResponse>
+      <response>
+        <status><code>SUCCESS</code><message>Success</message></status>
+        <classAdArray>
+"""
+
+RESPONSE_TAIL = """        </classAdArray>
+      </response>
+    </condor:getJobAdsResponse>
+  </SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+
+def make_response(num_jobs):
+    ads = []
+    for i in range(num_jobs):
+        ads.append(JOB_AD % {"cluster": i / 100, "proc": i % 100, "user": i % 10,
+                             "prio": i % 5, "status": 1 + i % 2})
+    return RESPONSE_HEAD + "".join(ads) + RESPONSE_TAIL
+
+
+def xpath_job_xml_to_job_list(condor_xml):
+    """The previous parser: one xpath subtree scan per attribute per job."""
+    def _job_attribute(xml, element):
+        try:
+            return xml.xpath(".//item[name='%s']/value" % element)[0].text
+        except:
+            return ""
+
+    def _add_if_exists(xml, dictionary, attribute):
+        job_value = string.strip(_job_attribute(xml, attribute))
+        if job_value:
+            dictionary[attribute] = job_value
+
+    jobs = []
+    context = etree.iterparse(StringIO(condor_xml))
+    for action, elem in context:
+        if elem.tag == "item" and elem.getparent().tag == "classAdArray":
+            job_dictionary = {}
+            for attribute in ("GlobalJobId", "Owner", "JobPrio", "JobStatus",
+                              "ClusterId", "ProcId", "ServerTime"):
+                job_dictionary[attribute] = _job_attribute(elem, attribute)
+            for attribute in job_management._OPTIONAL_JOB_ATTRIBUTES:
+                _add_if_exists(elem, job_dictionary, attribute)
+            requirements = _job_attribute(elem, "Requirements")
+            if requirements:
+                vmtype = job_management._attribute_from_requirements(requirements, "VMType")
+                if vmtype:
+                    job_dictionary['VMType'] = vmtype
+            for attribute in ("VMAMI", "VMInstanceType"):
+                attr_list = _job_attribute(elem, attribute)
+                if attr_list:
+                    job_dictionary[attribute] = _attr_list_to_dict(attr_list)
+            jobs.append(Job(**job_dictionary))
+            elem.clear()
+    return jobs
+
+
+def best_time(parser, condor_xml, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        jobs = parser(condor_xml)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, len(jobs)
+
+
+def main(argv):
+    num_jobs = 10000
+    repeats = 3
+    if len(argv) > 1:
+        num_jobs = int(argv[1])
+    if len(argv) > 2:
+        repeats = int(argv[2])
+
+    condor_xml = make_response(num_jobs)
+    print "Parsing %d job ads (%.1f MB of XML), best of %d runs" % (num_jobs, len(condor_xml) / 1048576.0, repeats)
+
+    xpath_time, xpath_count = best_time(xpath_job_xml_to_job_list, condor_xml, repeats)
+    single_time, single_count = best_time(JobPool._condor_job_xml_to_job_list, condor_xml, repeats)
+    if xpath_count != single_count:
+        print >> sys.stderr, "Parsers disagree on job count: %d vs %d" % (xpath_count, single_count)
+        return 1
+
+    print "  xpath per attribute: %8.3f s  (%8.0f jobs/s)" % (xpath_time, num_jobs / xpath_time)
+    print "  single pass:         %8.3f s  (%8.0f jobs/s)" % (single_time, num_jobs / single_time)
+    print "  speedup:             %8.2fx" % (xpath_time / single_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
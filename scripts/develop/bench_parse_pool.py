@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Benchmark for parsing Condor SOAP job ads with a ParsePool.
+#
+# Generates a synthetic getJobAds response (see bench_job_parsing.py) and times
+# parsing it into Job objects in the calling process against parsing it with
+# ParsePools of 1 up to the number of cores on this machine.
+#
+# Usage: ./scripts/develop/bench_parse_pool.py [number of jobs] [repeats]
+#
+
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cloudscheduler.utilities as utilities
+import cloudscheduler.parse_pool as parse_pool
+from cloudscheduler.job_management import JobPool, JOB_CLASSAD_ATTRIBUTES
+from cloudscheduler.job_management import _job_from_xml_classad
+from bench_job_parsing import make_response
+
+log = utilities.get_cloudscheduler_logger()
+log.setLevel(100)
+
+
+def best_time(parser, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        jobs = parser()
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, len(jobs)
+
+
+def main(argv):
+    num_jobs = 50000
+    repeats = 3
+    if len(argv) > 1:
+        num_jobs = int(argv[1])
+    if len(argv) > 2:
+        repeats = int(argv[2])
+
+    condor_xml = make_response(num_jobs)
+    cores = multiprocessing.cpu_count()
+    print "Parsing %d job ads (%.1f MB of XML) on %d core(s), best of %d runs" % (
+            num_jobs, len(condor_xml) / 1048576.0, cores, repeats)
+
+    serial_time, serial_count = best_time(
+            lambda: JobPool._condor_job_xml_to_job_list(condor_xml), repeats)
+    print "  in process:    %8.3f s  (%8.0f jobs/s)" % (serial_time, num_jobs / serial_time)
+
+    for processes in range(1, cores + 1):
+        pool = parse_pool.ParsePool(processes)
+        try:
+            pool_time, pool_count = best_time(lambda: [_job_from_xml_classad(classad)
+                    for classad in pool.parse_xml(condor_xml, "classAdArray", JOB_CLASSAD_ATTRIBUTES)],
+                    repeats)
+        finally:
+            pool.close()
+        if pool_count != serial_count:
+            print >> sys.stderr, "Parsers disagree on job count: %d vs %d" % (serial_count, pool_count)
+            return 1
+        print "  %2d process(es): %7.3f s  (%8.0f jobs/s, %.2fx)" % (processes, pool_time,
+                num_jobs / pool_time, serial_time / pool_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Simulation benchmark for the VM placement policies.
+#
+# Builds a resource pool of Nimbus clusters with mixed-size memory entries and
+# a random list of mixed-size VMs asking for as much memory in total as the
+# pool has (times a load factor), then places as many of the VMs as fit, once
+# in arrival order with each placement_policy and once largest first with
+# best_fit (best-fit decreasing). Reports how many VMs each placed per unit of
+# configured capacity.
+#
+# Usage: ./scripts/develop/bench_placement.py [number of clusters] [load factor] [seed]
+#
+
+import os
+import sys
+import time
+import random
+import tempfile
+import ConfigParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import cloudscheduler.config as config
+import cloudscheduler.utilities as utilities
+from cloudscheduler.cloud_management import ResourcePool
+from cloudscheduler.cluster_tools import VM
+
+log = utilities.get_cloudscheduler_logger()
+log.setLevel(100)
+
+MEMORY_ENTRIES = [[8192, 4096, 4096], [6144, 6144], [16384], [3072, 3072, 3072, 3072], [12288, 2048]]
+VM_MEMORY = [512, 1024, 1536, 2048, 3072, 4096]
+VM_CORES = [1, 1, 2, 4]
+VM_STORAGE = [5, 10, 20, 40]
+
+
+def write_cloud_config(num_clusters, rng):
+    (fd, path) = tempfile.mkstemp()
+    os.close(fd)
+    cloud_config = ConfigParser.RawConfigParser()
+    for n in range(num_clusters):
+        name = "cloud%d" % n
+        cloud_config.add_section(name)
+        cloud_config.set(name, "host", "%s.example.com" % name)
+        cloud_config.set(name, "cloud_type", "Nimbus")
+        cloud_config.set(name, "vm_slots", 64)
+        cloud_config.set(name, "cpu_cores", 8)
+        cloud_config.set(name, "storage", rng.choice([200, 400, 800]))
+        cloud_config.set(name, "memory", ",".join(map(str, rng.choice(MEMORY_ENTRIES))))
+        cloud_config.set(name, "cpu_archs", "x86")
+        cloud_config.set(name, "networks", "private")
+    config_file = open(path, "wb")
+    cloud_config.write(config_file)
+    config_file.close()
+    return path
+
+
+def make_vms(total_memory, rng):
+    vms = []
+    while total_memory > 0:
+        vm = (rng.choice(VM_MEMORY), rng.choice(VM_CORES), rng.choice(VM_STORAGE))
+        vms.append(vm)
+        total_memory -= vm[0]
+    return vms
+
+
+def empty(pool):
+    for cluster in pool.resources:
+        for vm in list(cluster.vms):
+            cluster.resource_return(vm)
+            cluster.remove_vm(vm)
+
+
+def simulate(pool, policy, vms, decreasing=False):
+    config.placement_policy = policy
+    if decreasing:
+        vms = sorted(vms, reverse=True)
+    placed = []
+    start = time.time()
+    for (memory, cores, storage) in vms:
+        (cluster, next_cluster) = pool.get_resourceBF("private", "x86", memory, cores,
+                                                      storage, "", "http://repo/image", ())
+        if cluster == None:
+            continue
+        mementry = cluster.pick_mementry(memory)
+        if mementry < 0:
+            continue
+        vm = VM(id="vm%d" % len(placed), vmtype="sl", user="bench", network="private",
+                memory=memory, mementry=mementry, cpucores=cores, storage=storage)
+        cluster.add_vm(vm)
+        cluster.resource_checkout(vm)
+        placed.append((memory, cores, storage))
+    elapsed = time.time() - start
+    empty(pool)
+    return placed, elapsed
+
+
+def main(argv):
+    num_clusters = 20
+    load = 1.0
+    seed = 42
+    if len(argv) > 1:
+        num_clusters = int(argv[1])
+    if len(argv) > 2:
+        load = float(argv[2])
+    if len(argv) > 3:
+        seed = int(argv[3])
+
+    rng = random.Random(seed)
+    path = write_cloud_config(num_clusters, rng)
+    try:
+        config.setup(path=path)
+        pool = ResourcePool("Bench Pool")
+        pool.config_file = path
+        pool.setup()
+        empty(pool)
+
+        total_memory = sum([sum(cluster.max_mem) for cluster in pool.resources])
+        vms = make_vms(int(total_memory * load), rng)
+        total_slots = sum([cluster.vm_slots for cluster in pool.resources])
+        total_storage = sum([cluster.max_storageGB for cluster in pool.resources])
+        print "Placing up to %d VMs on %d clusters (%d MB memory, %d slots, %d GB storage)" % (
+                len(vms), num_clusters, total_memory, total_slots, total_storage)
+        print "  %-13s %6s %12s %12s %10s %10s %9s" % ("policy", "VMs", "VMs/GB mem",
+                "VMs/slot", "mem used", "disk used", "time")
+
+        for (name, policy, decreasing) in (("balanced", "balanced", False),
+                                           ("best_fit", "best_fit", False),
+                                           ("best_fit dec", "best_fit", True)):
+            placed, elapsed = simulate(pool, policy, vms, decreasing)
+            used_memory = sum([vm[0] for vm in placed])
+            used_storage = sum([vm[2] for vm in placed])
+            print "  %-13s %6d %12.3f %12.3f %9.1f%% %9.1f%% %8.3fs" % (name, len(placed),
+                    len(placed) * 1024.0 / total_memory, float(len(placed)) / total_slots,
+                    100.0 * used_memory / total_memory, 100.0 * used_storage / total_storage,
+                    elapsed)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
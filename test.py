@@ -201,6 +201,20 @@ class ConfigParserSetsCorrectValues(unittest.TestCase):
         self.assertRaises(ConfigParser.ParsingError,
                           cloudscheduler.config.setup, path=self.configfilename)
 
+    def test_placement_policy_is_validated(self):
+
+        configfile = open(self.configfilename, 'wb')
+        configfile.write("[global]\nplacement_policy: first_fit\n")
+        configfile.close()
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertRaises(SystemExit, cloudscheduler.config.setup, path=self.configfilename)
+        finally:
+            sys.stdout = stdout
+            cloudscheduler.config.placement_policy = "balanced"
+
     def tearDown(self):
         os.remove(self.configfilename)
 
@@ -305,9 +319,256 @@ class ResourcePoolSetup(unittest.TestCase):
                 found_cluster1 = True
         self.assertTrue(found_cluster1)
 
+    def test_fair_share_diff_types(self):
+        from fractions import Fraction
+        from cloudscheduler.cluster_tools import VM
+        from cloudscheduler.job_management import Job, JobPool
+        from cloudscheduler.fair_share import FairShare
+        job_pool = JobPool("testpool", condor_query_type="local")
+        job_pool.job_container.sync_jobs([Job(GlobalJobId="host#%d.0#1" % n, Owner=owner, JobStatus=1, VMType="sl")
+                                          for n, owner in enumerate(["alice", "bob", "bob"])])
+        cluster = self.test_pool.resources[0]
+        cluster.add_vm(VM(id="vm1", vmtype="sl", user="alice"))
+        fair_share = FairShare(self.test_pool, job_pool)
+
+        first = fair_share.get_diff_types()
+        self.assertEqual(first, {"alice:sl": Fraction(1, 2), "bob:sl": Fraction(-1, 2)})
+        self.assertTrue(isinstance(first["alice:sl"], Fraction))
+        self.assertTrue(fair_share.get_diff_types() is first)
+
+        cluster.add_vm(VM(id="vm2", vmtype="sl", user="bob"))
+        second = fair_share.get_diff_types()
+        self.assertEqual(second, {"alice:sl": 0, "bob:sl": 0})
+        self.assertEqual(second.current, {"alice:sl": Fraction(1, 2), "bob:sl": Fraction(1, 2)})
+
+        job_pool.job_container.ban_job(job_pool.job_container.get_job_by_id("host#0.0#1"), "TempBanned")
+        self.assertEqual(fair_share.get_diff_types(), {"alice:sl": 1, "bob:sl": Fraction(-1, 2)})
+
+    def test_vm_table_follows_clusters(self):
+        from cloudscheduler.cluster_tools import VM
+        cluster0 = self.test_pool.resources[0]
+        cluster1 = self.test_pool.resources[1]
+        vm1 = VM(id="vm1", vmtype="sl", user="alice", memory=2048, cpucores=2, storage=10)
+        vm2 = VM(id="vm2", vmtype="sl", user="alice", memory=1024, cpucores=4, storage=20, job_per_core=True)
+        vm3 = VM(id="vm3", vmtype="el", user="bob", memory=512, cpucores=1, storage=5)
+        cluster0.add_vm(vm1)
+        cluster0.add_vm(vm2)
+        cluster1.add_vm(vm3)
+
+        self.assertEqual(self.test_pool.vm_count(), 3)
+        self.assertEqual(self.test_pool.get_vmtypes_count_internal(), {"alice:sl": 2, "bob:el": 1})
+        self.assertEqual(self.test_pool.vmtype_resource_usage(),
+                         {"alice:sl": [3072, 6, 30], "bob:el": [512, 1, 5]})
+        self.assertEqual(self.test_pool.count_vm_slots("alice:sl", 1, 1024, 20), 4)
+        self.assertEqual(self.test_pool.count_vm_slots("alice:sl", 2, 2048, 10), 1)
+        self.assertEqual(len(self.test_pool.vm_slots_used()["alice:sl"]), 5)
+
+        generation = self.test_pool.get_vm_generation()
+        cluster0.remove_vm(vm1)
+        self.assertNotEqual(self.test_pool.get_vm_generation(), generation)
+        self.assertEqual(self.test_pool.vmtype_resource_usage(),
+                         {"alice:sl": [1024, 4, 20], "bob:el": [512, 1, 5]})
+        self.assertEqual(self.test_pool.count_vm_slots("alice:sl", 2, 2048, 10), 0)
+        self.assertEqual(self.test_pool.vm_table.vms[self.test_pool.vm_table.rows[id(vm3)]], vm3)
+
+        totals = dict(self.test_pool.vm_table.totals)
+        self.test_pool.vm_table.rebuild(self.test_pool.resources)
+        self.assertEqual(self.test_pool.get_vmtypes_count_internal(), {"alice:sl": 1, "bob:el": 1})
+        self.assertEqual(sorted(self.test_pool.vm_table.totals.values()), sorted(totals.values()))
+
+    def test_capacity_index(self):
+        from cloudscheduler.cluster_tools import VM, ICluster
+        cluster = ICluster(memory=[512, 2048, 1024, 2048])
+        self.assertEqual(cluster.find_mementry(2048), 1)
+        self.assertEqual(cluster.find_mementry(1000), 1)
+        self.assertEqual(cluster.find_mementry(600), 1)
+        self.assertEqual(cluster.find_mementry(4096), -1)
+        cluster._set_mementry(1, 0)
+        self.assertEqual(cluster.find_mementry(2048), 3)
+        self.assertEqual(cluster.find_mementry(600), 2)
+
+        # Same entry as a scan of 'memory': an exact fit, else the first that fits
+        import random
+        rng = random.Random(1)
+        def first_fit(memory, entries):
+            fits = [i for i in range(len(entries)) if entries[i] >= memory]
+            exact = [i for i in fits if entries[i] == memory]
+            return (exact + fits + [-1])[0]
+        cluster = ICluster(memory=[rng.choice([512, 1024, 2048, 4096]) for i in range(13)])
+        for n in range(200):
+            cluster._set_mementry(rng.randrange(13), rng.choice([0, 256, 512, 1024, 2048, 4096]))
+            memory = rng.choice([256, 512, 600, 1024, 3000, 4096, 5000])
+            self.assertEqual(cluster.find_mementry(memory), first_fit(memory, cluster.memory))
+
+        cluster0 = self.test_pool.get_cluster(self.cloud_name0)
+        cluster1 = self.test_pool.get_cluster(self.cloud_name1)
+        fits = lambda network, cpuarch: sorted([fitting.name for fitting in
+                self.test_pool.get_fitting_resources(network, cpuarch, 1024, 1, 10, "", "http://repo/image")])
+        self.assertEqual(fits("private", "x86"), [self.cloud_name0, self.cloud_name1])
+        self.assertEqual(fits("", "x86"), [self.cloud_name0, self.cloud_name1])
+        self.assertEqual(fits("public", "x86"), [])
+        self.assertEqual(fits("private", "x86_64"), [])
+
+        vm = VM(id="vm1", vmtype="sl", user="alice", network="private", memory=1024, mementry=0, storage=10)
+        cluster0.add_vm(vm)
+        cluster0.resource_checkout(vm)
+        self.assertEqual(self.test_pool.get_resourceBF("private", "x86", 1024, 1, 10, "", "http://repo/image"),
+                         (cluster1, cluster0))
+        self.assertEqual(self.test_pool.get_resourceBF("private", "x86", 2048, 1, 10, "", "http://repo/image"),
+                         (cluster1, None))
+        cluster0.resource_return(vm)
+        cluster0.remove_vm(vm)
+        self.assertEqual(self.test_pool.get_resourceBF("private", "x86", 2048, 1, 10, "", "http://repo/image",
+                                                       targets=[self.cloud_name0]), (cluster0, None))
+
+    def test_placement_cache(self):
+        from cloudscheduler.cluster_tools import VM
+        requirements = ("private", "x86", 1024, 1, 10, "", "http://repo/image", ())
+        first = self.test_pool._cached_fitting_resources(requirements)
+        self.assertTrue(self.test_pool._cached_fitting_resources(requirements) is first)
+        self.assertEqual(len(first), 2)
+
+        cluster0 = self.test_pool.get_cluster(self.cloud_name0)
+        vm = VM(id="vm1", vmtype="sl", user="alice", network="private", memory=1024, mementry=0, storage=10)
+        cluster0.add_vm(vm)
+        cluster0.resource_checkout(vm)
+        second = self.test_pool._cached_fitting_resources(requirements)
+        self.assertFalse(second is first)
+        self.assertEqual(second[0].name, self.cloud_name1)
+
+        self.test_pool.banned_job_resource["http://repo/image"] = [self.cloud_name1]
+        self.test_pool.ban_generation += 1
+        self.assertEqual([cluster.name for cluster in self.test_pool.get_fitting_resources(*requirements)],
+                         [self.cloud_name0])
+        del self.test_pool.banned_job_resource["http://repo/image"]
+        cluster0.resource_return(vm)
+        cluster0.remove_vm(vm)
+
+    def test_plan_placement(self):
+        from fractions import Fraction
+        from cloudscheduler.cluster_tools import VM
+        from cloudscheduler.fair_share import FairShare, DiffTypes
+        cluster0 = self.test_pool.get_cluster(self.cloud_name0)
+        cluster1 = self.test_pool.get_cluster(self.cloud_name1)
+        plan = lambda count: self.test_pool.plan_placement("private", "x86", 512, 1, 10, "", "http://repo/image", (), count)
+        self.assertEqual(plan(1), [(cluster0, 1)])
+        self.assertEqual(plan(5), [(cluster0, 3), (cluster1, 2)])
+        # Each cluster has memory for four 512MB VMs
+        self.assertEqual(plan(20), [(cluster0, 4), (cluster1, 4)])
+
+        vm = VM(id="vm1", vmtype="sl", user="bob", network="private", memory=512, mementry=0, storage=10)
+        cluster0.add_vm(vm)
+        cluster0.resource_checkout(vm)
+        self.assertEqual(plan(3), [(cluster1, 2), (cluster0, 1)])
+
+        fair_share = FairShare(self.test_pool, None)
+        diff_types = DiffTypes(None, {"bob:sl": 1}, {"alice:sl": Fraction(1, 2), "bob:sl": Fraction(1, 2)})
+        self.assertEqual(fair_share.vms_to_share(diff_types, "alice:sl"), 1)
+        self.assertEqual(fair_share.vms_to_share(DiffTypes(None, {}, {"alice:sl": 1}), "alice:sl"), None)
+        cluster1.add_vm(VM(id="vm2", vmtype="sl", user="bob"))
+        cluster1.add_vm(VM(id="vm3", vmtype="sl", user="bob"))
+        self.assertEqual(fair_share.vms_to_share(diff_types, "alice:sl"), 3)
+        cluster0.resource_return(vm)
+
+    def test_reconfig_retires_memory(self):
+        old_cluster = self.test_pool.get_cluster(self.cloud_name0)
+        self.assertEqual(old_cluster.find_mementry(512), 0)
+        self.test_pool.setup()
+        self.test_pool.setup()
+        self.assertEqual(old_cluster.find_mementry(512), -1)
+        self.assertEqual(old_cluster.find_best_mementry(512), -1)
+        self.assertEqual(self.test_pool.get_cluster(self.cloud_name0).find_mementry(512), 0)
+
+    def test_reconfig_empties_placement_cache(self):
+        get_resource = lambda: self.test_pool.get_resourceBF("private", "x86", 512, 1, 10, "", "http://repo/image", ())
+        self.assertNotEqual(get_resource(), (None, None))
+        during_setup = []
+        rebuild = self.test_pool.vm_table.rebuild
+        def rebuild_and_place(clusters):
+            during_setup.append(get_resource())
+            rebuild(clusters)
+        self.test_pool.vm_table.rebuild = rebuild_and_place
+        try:
+            self.test_pool.setup()
+        finally:
+            self.test_pool.vm_table.rebuild = rebuild
+        self.assertEqual(during_setup, [(None, None)])
+        self.assertEqual(get_resource()[0].name, self.cloud_name0)
+
+    def test_ban_file_round_trip(self):
+        from cloudscheduler.cluster_tools import EC2Cluster
+        from cloudscheduler.job_management import Job
+        ec2 = EC2Cluster(name="ec2", host="ec2.example.com", cloud_type="AmazonEC2",
+                         memory=[2048], cpu_archs=["x86"], vm_slots=10, storage=100,
+                         access_key_id="key", secret_access_key="secret")
+        job = Job(GlobalJobId="host#1.0#1", Owner="bob", VMAMI={"default": "ami-1", "ec2.example.com": "ami-2"})
+        (ban_fd, ban_filename) = tempfile.mkstemp()
+        os.close(ban_fd)
+        old_ban_file = cloudscheduler.config.ban_file
+        cloudscheduler.config.ban_file = ban_filename
+        try:
+            for n in range(cloudscheduler.config.ban_min_track):
+                self.test_pool.track_failures(job, [ec2], False)
+            self.test_pool.check_failures()
+            self.assertEqual(self.test_pool.banned_job_resource, {"ami-2": ["ec2"]})
+            self.test_pool.banned_job_resource = {}
+            self.test_pool.load_banned_job_resource()
+            self.assertEqual(self.test_pool.banned_job_resource, {"ami-2": ["ec2"]})
+        finally:
+            cloudscheduler.config.ban_file = old_ban_file
+            os.remove(ban_filename)
+
+    def test_best_fit_placement(self):
+        from cloudscheduler.cluster_tools import ICluster, VM
+        packed = ICluster(name="packed", memory=[512, 2048, 1024, 2048])
+        self.assertEqual(packed.find_best_mementry(600), 2)
+        self.assertEqual(packed.find_best_mementry(2048), 1)
+        self.assertEqual(packed.find_best_mementry(4096), -1)
+        self.assertEqual(packed.pick_mementry(600), 1)
+
+        cluster0 = self.test_pool.get_cluster(self.cloud_name0)
+        cluster1 = self.test_pool.get_cluster(self.cloud_name1)
+        vm = VM(id="vm1", vmtype="sl", user="bob", network="private", memory=1024, mementry=0, storage=10)
+        cluster1.add_vm(vm)
+        cluster1.resource_checkout(vm)
+        get_resource = lambda: self.test_pool.get_resourceBF("private", "x86", 512, 1, 10, "", "http://repo/image", ())
+        plan = lambda count: self.test_pool.plan_placement("private", "x86", 512, 1, 10, "", "http://repo/image", (), count)
+        self.assertEqual(get_resource(), (cluster0, cluster1))
+        cloudscheduler.config.placement_policy = "best_fit"
+        try:
+            self.assertEqual(packed.pick_mementry(600), 2)
+            # cluster1 has 1024MB left, so a 512MB VM fits it more tightly
+            self.assertEqual(get_resource(), (cluster1, cluster0))
+            self.assertEqual(plan(3), [(cluster1, 2), (cluster0, 1)])
+        finally:
+            cloudscheduler.config.placement_policy = "balanced"
+            cluster1.resource_return(vm)
+
+    def test_cluster_lookups(self):
+        from cloudscheduler.cluster_tools import VM
+        cluster0 = self.test_pool.get_cluster(self.cloud_name0)
+        cluster1 = self.test_pool.get_cluster(self.cloud_name1)
+        self.assertEqual(cluster0.name, self.cloud_name0)
+        self.assertEqual(self.test_pool.get_cluster("nosuchcloud"), None)
+        self.assertEqual(self.test_pool.filter_resources_by_names([self.cloud_name1, "nosuchcloud"]), [cluster1])
+
+        vm = VM(id="vm1", vmtype="sl", user="bob", network="private", memory=512, mementry=0, storage=10)
+        self.assertEqual(self.test_pool.get_cluster_with_vm(vm), None)
+        cluster1.add_vm(vm)
+        cluster1.resource_checkout(vm)
+        self.assertTrue(self.test_pool.get_cluster_with_vm(vm) is cluster1)
+        self.test_pool.setup()
+        self.assertTrue(self.test_pool.get_cluster(self.cloud_name1) is not cluster1)
+        self.assertTrue(self.test_pool.get_cluster_with_vm(vm) is self.test_pool.get_cluster(self.cloud_name1))
+        self.test_pool.get_cluster(self.cloud_name1).resource_return(vm)
+        self.test_pool.get_cluster(self.cloud_name1).remove_vm(vm)
+        self.assertEqual(self.test_pool.get_cluster_with_vm(vm), None)
 
     def tearDown(self):
         os.remove(self.configfilename)
+        # ResourcePool.resources is shared, so don't leave test VMs for the next pool
+        for cluster in self.test_pool.resources:
+            del cluster.vms[:]
 
 class NimbusXMLTests(unittest.TestCase):
 
@@ -1457,6 +1718,33 @@ xmlns:condor="urn:condor">
 
         self.assertEqual(parsed_server_time, ServerTime)
 
+    def test_condor_machine_xml_duplicate_attributes(self):
+        from lxml import etree
+        from cloudscheduler.utilities import xml_classad_attributes
+
+        condor_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+  <SOAP-ENV:Body>
+    <condor:queryStartdAdsResponse>
+      <result>
+        <item>
+          <item><name>Name</name><type>STRING-ATTR</type><value>vm1</value></item>
+          <item><name>VMType</name><type>STRING-ATTR</type><value>old</value></item>
+          <item><name>VMType</name><type>STRING-ATTR</type><value>new</value></item>
+        </item>
+      </result>
+    </condor:queryStartdAdsResponse>
+  </SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+        xml2native = cloudscheduler.cloud_management.ResourcePool._condor_machine_xml_to_machine_list
+        self.assertEqual(xml2native(condor_xml)[0]["VMType"], "new")
+
+        # Job ads keep the first value
+        classad = etree.fromstring(condor_xml).find(".//result/item")
+        self.assertEqual(xml_classad_attributes(classad)["VMType"], "old")
+        self.assertEqual(xml_classad_attributes(classad, keep_last=True)["VMType"], "new")
+
 class JobPoolTests(unittest.TestCase):
 
     def test_condor_local_parsing(self):
@@ -2267,6 +2555,129 @@ xmlns:condor="urn:condor">
         self.assertEqual(parsed_job.instance_type, test_job.instance_type)
         self.assertEqual(parsed_job.maximum_price, test_job.maximum_price)
 
+    def test_condorxml_to_native_two_jobs_empty_values(self):
+
+        condor_xml = """<?xml version="1.0" encoding="utf-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+  <SOAP-ENV:Body><condor:getJobAdsResponse><response>
+    <status><code>SUCCESS</code><message>Success</message></status>
+    <classAdArray>
+      <item>
+        <item><name>GlobalJobId</name><type>STRING-ATTR</type><value>host#1.0#1</value></item>
+        <item><name>Owner</name><type>STRING-ATTR</type><value>alice</value></item>
+        <item><name>JobPrio</name><type>INTEGER-ATTR</type><value>0</value></item>
+        <item><name>JobStatus</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ClusterId</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ProcId</name><type>INTEGER-ATTR</type><value>0</value></item>
+        <item><name>ServerTime</name><type>INTEGER-ATTR</type><value>1274118753</value></item>
+        <item><name>VMName</name><type>STRING-ATTR</type><value/></item>
+        <item><name>VMMem</name><type>STRING-ATTR</type><value> 1024 </value></item>
+      </item>
+      <item>
+        <item><name>GlobalJobId</name><type>STRING-ATTR</type><value>host#1.1#1</value></item>
+        <item><name>Owner</name><type>STRING-ATTR</type><value>bob</value></item>
+        <item><name>JobPrio</name><type>INTEGER-ATTR</type><value>0</value></item>
+        <item><name>JobStatus</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ClusterId</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ProcId</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ServerTime</name><type>INTEGER-ATTR</type><value>1274118753</value></item>
+        <item><name>Requirements</name><type>EXPRESSION-ATTR</type><value>VMType =?= "sl5"</value></item>
+      </item>
+    </classAdArray>
+  </response></condor:getJobAdsResponse></SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+        xml2native = cloudscheduler.job_management.JobPool._condor_job_xml_to_job_list
+        jobs = xml2native(condor_xml)
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(jobs[0].id, "host#1.0#1")
+        self.assertEqual(jobs[0].user, "alice")
+        self.assertEqual(jobs[0].req_image, cloudscheduler.config.default_VMName)
+        self.assertEqual(jobs[0].req_memory, 1024)
+        self.assertEqual(jobs[1].user, "bob")
+        self.assertEqual(jobs[1].req_vmtype, "sl5")
+
+    def test_parse_pool_chunks(self):
+        import cloudscheduler.parse_pool as parse_pool
+
+        ad = """      <item>
+        <item><name>GlobalJobId</name><type>STRING-ATTR</type><value>host#1.%d#1</value></item>
+        <item><name>Owner</name><type>STRING-ATTR</type><value>user%d</value></item>
+        <item><name>Cmd</name><type>STRING-ATTR</type><value>/bin/true</value></item>
+      </item>
+"""
+        condor_xml = """<?xml version="1.0" encoding="utf-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+  <SOAP-ENV:Body><condor:getJobAdsResponse><response>
+    <classAdArray>
+%s    </classAdArray>
+  </response></condor:getJobAdsResponse></SOAP-ENV:Body>
+</SOAP-ENV:Envelope>""" % "".join([ad % (i, i) for i in range(10)])
+
+        chunks = parse_pool.split_xml_classads(condor_xml, "classAdArray", 3)
+        self.assertEqual(len(chunks), 3)
+        ads = []
+        for chunk in chunks:
+            ads.extend(parse_pool._parse_xml_chunk((chunk, "classAdArray", ("GlobalJobId", "Owner"), False)))
+        self.assertEqual(len(ads), 10)
+        self.assertEqual(ads[9], {"GlobalJobId": "host#1.9#1", "Owner": "user9"})
+        self.assertEqual(parse_pool.split_xml_classads("<empty/>", "classAdArray", 3), [])
+
+        condor_q = "".join(["GlobalJobId = \"host#1.%d#1\"\nOwner = \"user%d\"\n\n" % (i, i) for i in range(5)])
+        chunks = list(parse_pool.split_text_classads(StringIO(condor_q), 2))
+        self.assertEqual(len(chunks), 3)
+        ads = []
+        for chunk in chunks:
+            ads.extend(parse_pool._parse_text_chunk((chunk, None)))
+        self.assertEqual([ad["Owner"] for ad in ads], ["user%d" % i for i in range(5)])
+
+    def test_condorxml_streamed_from_soap_request(self):
+        import threading
+        import BaseHTTPServer
+
+        condor_xml = """<?xml version="1.0" encoding="utf-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:condor="urn:condor">
+  <SOAP-ENV:Body><condor:getJobAdsResponse><response>
+    <classAdArray>
+%s    </classAdArray>
+  </response></condor:getJobAdsResponse></SOAP-ENV:Body>
+</SOAP-ENV:Envelope>""" % "".join(["""      <item>
+        <item><name>GlobalJobId</name><type>STRING-ATTR</type><value>host#1.%d#1</value></item>
+        <item><name>Owner</name><type>STRING-ATTR</type><value>alice</value></item>
+        <item><name>JobPrio</name><type>INTEGER-ATTR</type><value>0</value></item>
+        <item><name>JobStatus</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ClusterId</name><type>INTEGER-ATTR</type><value>1</value></item>
+        <item><name>ProcId</name><type>INTEGER-ATTR</type><value>%d</value></item>
+        <item><name>ServerTime</name><type>INTEGER-ATTR</type><value>1274118753</value></item>
+      </item>
+""" % (i, i) for i in range(3)])
+
+        requests = []
+        class SOAPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests.append(self.rfile.read(int(self.headers["Content-Length"])))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.end_headers()
+                self.wfile.write(condor_xml)
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), SOAPHandler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        response = utilities.condor_soap_request("http://127.0.0.1:%d" % server.server_port,
+                "getJobAds", (("transaction", None), ("constraint", "JobStatus < 3")))
+        try:
+            jobs = cloudscheduler.job_management.JobPool._condor_job_xml_to_job_list(response)
+        finally:
+            response.close()
+        thread.join()
+        server.server_close()
+
+        self.assertEqual([job.id for job in jobs], ["host#1.%d#1" % i for i in range(3)])
+        self.assertTrue("<condor:getJobAds><constraint>JobStatus &lt; 3</constraint></condor:getJobAds>" in requests[0])
+
     def test_condor_attr_list_to_dict(self):
         east_host = "us-east-1.ec2.amazonaws.com"
         east_ami = "ami-east"
@@ -2287,6 +2698,360 @@ xmlns:condor="urn:condor">
         job_pool = cloudscheduler.job_management.JobPool("testpool", condor_query_type="soap")
         self.assertEqual(job_pool.job_query, job_pool.job_query_SOAP)
 
+    def test_update_jobs(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="local")
+        job_pool.update_jobs([Job(GlobalJobId="host#1.0#1", JobStatus=1),
+                              Job(GlobalJobId="host#1.1#1", JobStatus=1),
+                              Job(GlobalJobId="host#1.2#1", JobStatus=1)])
+        self.assertEqual(job_pool.last_update_stats['added'], 3)
+
+        # Consecutive finished jobs must all be filtered out
+        job_pool.update_jobs([Job(GlobalJobId="host#1.0#1", JobStatus=4),
+                              Job(GlobalJobId="host#1.1#1", JobStatus=3),
+                              Job(GlobalJobId="host#1.2#1", JobStatus=2, RemoteHost="vm1"),
+                              Job(GlobalJobId="host#2.0#1", JobStatus=1)])
+        container = job_pool.job_container
+        self.assertFalse(container.has_job("host#1.0#1"))
+        self.assertFalse(container.has_job("host#1.1#1"))
+        self.assertEqual(container.get_job_by_id("host#1.2#1").remote_host, "vm1")
+        self.assertTrue(container.has_job("host#2.0#1"))
+        self.assertEqual(job_pool.last_update_stats['added'], 1)
+        self.assertEqual(job_pool.last_update_stats['removed'], 2)
+        self.assertEqual(job_pool.last_update_stats['changed'], 1)
+
+    def test_update_jobs_reuses_known_jobs(self):
+        from cloudscheduler.job_management import Job, JobPool, JobStatusUpdate
+        from cloudscheduler.job_management import _job_from_condor_q_classad
+        job_pool = JobPool("testpool", condor_query_type="local")
+        job = Job(GlobalJobId="host#1.0#1", JobStatus=1)
+        job_pool.update_jobs([job])
+
+        condor_q_output = """GlobalJobId = "host#1.0#1"
+JobStatus = 2
+RemoteHost = "vm1"
+ServerTime = 110
+
+GlobalJobId = "host#1.1#1"
+Owner = "bob"
+JobStatus = 1
+Requirements = VMType =?= "sl"
+"""
+        job_factory = lambda classad: job_pool._job_from_classad(classad, _job_from_condor_q_classad)
+        jobs = JobPool._condor_q_to_job_list(condor_q_output, job_factory)
+        self.assertTrue(isinstance(jobs[0], JobStatusUpdate))
+        self.assertTrue(isinstance(jobs[1], Job))
+
+        job_pool.update_jobs(jobs)
+        self.assertTrue(job_pool.job_container.get_job_by_id("host#1.0#1") is job)
+        self.assertEqual(job.job_status, JobPool.RUNNING)
+        self.assertEqual(job.remote_host, "vm1")
+        self.assertTrue(job_pool.job_container.has_job("host#1.1#1"))
+
+    def test_job_shared_values(self):
+        import gc
+        from cloudscheduler.job_management import Job, _shared_dicts
+        amis = {"default": "ami-shared", "ec2.example.com": "ami-cloud"}
+        jobs = [Job(GlobalJobId="host#%d.0#1" % n, Owner="bob", VMAMI=dict(amis)) for n in range(2)]
+        self.assertTrue(jobs[0].req_ami is jobs[1].req_ami)
+        self.assertEqual(jobs[0].req_ami, amis)
+        self.assertTrue(jobs[0].user is jobs[1].user)
+        del jobs
+        gc.collect()
+        self.assertFalse(frozenset(amis.iteritems()) in _shared_dicts)
+
+    def test_job_snapshot(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="local")
+        first = job_pool.get_snapshot()
+        self.assertEqual(len(first), 0)
+
+        job_pool.update_jobs([Job(GlobalJobId="host#1.0#1", JobStatus=1)])
+        second = job_pool.get_snapshot()
+        self.assertTrue(second.generation > first.generation)
+        self.assertEqual(len(second.get_unscheduled_jobs()), 1)
+
+        job_pool.update_jobs([])
+        self.assertEqual(len(job_pool.get_snapshot()), 0)
+        self.assertEqual(second.get_job_by_id("host#1.0#1").id, "host#1.0#1")
+
+        # Changes between polls are published straight away
+        job_pool.update_jobs([Job(GlobalJobId="host#1.1#1", JobStatus=1)])
+        job_pool.schedule(job_pool.get_snapshot().get_unscheduled_jobs()[0])
+        self.assertEqual([job.id for job in job_pool.get_snapshot().get_scheduled_jobs()], ["host#1.1#1"])
+        self.assertTrue(job_pool.get_snapshot() is job_pool.get_snapshot())
+
+    def test_job_container_view_sharing(self):
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import HashTableJobContainer
+        container = HashTableJobContainer()
+        alice = Job(GlobalJobId="host#1.0#1", Owner="alice", JobStatus=1)
+        bob = Job(GlobalJobId="host#1.1#1", Owner="bob", JobStatus=1)
+        container.add_job(alice)
+        container.add_job(bob)
+
+        first = container.get_view()
+        self.assertTrue(container.get_view() is first)
+        container.schedule_job(alice.id)
+        container.update_job_status(alice.id, 2, "vm1", 0, 0)
+        second = container.get_view()
+        self.assertTrue(second.generation > first.generation)
+        self.assertTrue(second.segments[("bob", "default")] is first.segments[("bob", "default")])
+        self.assertEqual(sorted([job.id for job in first.get_unscheduled_jobs()]), [alice.id, bob.id])
+        self.assertEqual(second.get_scheduled_jobs(), [alice])
+        self.assertEqual(second.get_running_jobs(), [alice])
+        self.assertEqual(first.get_running_jobs(), [])
+
+        # Only the changed (user, VM type) segment is rebuilt
+        alice_sl = Job(GlobalJobId="host#1.2#1", Owner="alice", JobStatus=1, VMType="sl")
+        container.add_job(alice_sl)
+        third = container.get_view()
+        self.assertTrue(third.segments[("alice", "default")] is second.segments[("alice", "default")])
+        self.assertEqual(sorted([job.id for job in third.get_jobs_for_user("alice")]), [alice.id, alice_sl.id])
+
+        container.remove_job(bob)
+        self.assertEqual(container.get_view().get_users(), ["alice"])
+        self.assertEqual(len(second), 2)
+
+    def test_sharded_job_container(self):
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import HashTableJobContainer, ShardedJobContainer
+        from cloudscheduler.job_containers import JobStatusUpdate
+        def make_jobs():
+            return [Job(GlobalJobId="host#%d.%d#1" % (user, proc), Owner="user%d" % user,
+                        JobPrio=proc, JobStatus=1, VMType="sl")
+                    for user in range(5) for proc in range(3)]
+        sharded = ShardedJobContainer(3)
+        plain = HashTableJobContainer()
+        for container in (sharded, plain):
+            container.sync_jobs(make_jobs())
+            (added, removed, changed) = container.sync_jobs(
+                    [JobStatusUpdate("host#0.0#1", 2, "vm1", 0, 0)] + make_jobs()[1:14])
+            self.assertEqual((len(added), len(removed), len(changed)), (0, 1, 1))
+            container.schedule_job("host#1.2#1")
+
+        ids = lambda jobs: sorted([job.id for job in jobs])
+        self.assertEqual(ids(sharded.get_all_jobs()), ids(plain.get_all_jobs()))
+        self.assertEqual(ids(sharded.get_running_jobs()), ["host#0.0#1"])
+        self.assertEqual(ids(sharded.get_scheduled_jobs()), ["host#1.2#1"])
+        self.assertEqual(sharded.get_required_vmtype_counts(), plain.get_required_vmtype_counts())
+        self.assertEqual([job.priority for job in sharded.get_unscheduled_jobs_by_type(prioritized=True)["sl"]],
+                         [job.priority for job in plain.get_unscheduled_jobs_by_type(prioritized=True)["sl"]])
+        self.assertEqual(ids(sharded.get_unscheduled_jobs_by_users()["user1"]), ["host#1.0#1", "host#1.1#1"])
+        self.assertEqual(len(sharded.get_view()), 14)
+        self.assertFalse(sharded.has_job("host#4.2#1"))
+
+        with sharded.lock:
+            sharded.remove_job_by_id("host#0.0#1")
+        self.assertEqual(sharded.get_job_by_id("host#0.0#1"), None)
+        self.assertEqual(len(sharded.get_view()), 13)
+
+    def test_sharded_job_container_moves(self):
+        import threading
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import ShardedJobContainer
+        sharded = ShardedJobContainer(4)
+        owners = ["user%d" % n for n in range(4)]
+        def churn(seed):
+            for n in range(300):
+                owner = owners[(seed + n) % len(owners)]
+                job = Job(GlobalJobId="host#%d.0#1" % (n % 7), Owner=owner, JobStatus=1, VMType="sl")
+                if n % 5 == 4:
+                    sharded.remove_job(job)
+                else:
+                    sharded.add_job(job)
+        threads = [threading.Thread(target=churn, args=(seed,)) for seed in range(4)]
+        # Switch threads as often as possible, to interleave the moves
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(check_interval)
+
+        # Each job is in exactly one shard, the one job_shards has for it
+        held = {}
+        for shard in sharded.shards:
+            for job in shard.get_all_jobs():
+                self.assertFalse(job.id in held)
+                held[job.id] = shard
+        self.assertEqual(set(held.keys()), set(sharded.job_shards.keys()))
+        for jobid, shard in held.iteritems():
+            self.assertTrue(sharded.job_shards[jobid] is shard)
+            self.assertTrue(sharded.shard_for_user(shard.get_job_by_id(jobid).user) is shard)
+
+    def test_job_container_bulk_schedule(self):
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import HashTableJobContainer, ShardedJobContainer
+        ids = lambda jobs: sorted([job.id for job in jobs])
+        for container in (HashTableJobContainer(), ShardedJobContainer(2)):
+            container.sync_jobs([Job(GlobalJobId="host#%d.0#1" % proc, Owner="user%d" % (proc % 2),
+                                    JobPrio=proc, JobStatus=1, VMType="sl", VMHighPriority=proc % 3 == 0)
+                                for proc in range(8)])
+            before = container.get_view().generation
+            self.assertEqual(container.schedule_many(["host#%d.0#1" % proc for proc in (0, 2, 3, 3, 4)] + ["nojob"]), 4)
+            self.assertEqual(container.schedule_many(["host#0.0#1"]), 0)
+            self.assertTrue(container.get_view().generation > before)
+            self.assertEqual(sorted(job.id for job in container.get_scheduled_jobs()),
+                             ["host#0.0#1", "host#2.0#1", "host#3.0#1", "host#4.0#1"])
+            self.assertEqual([job.id for job in container.get_unscheduled_jobs_by_users(prioritized=True)["user0"]],
+                             ["host#6.0#1"])
+            self.assertEqual([job.id for job in container.get_unscheduled_jobs_by_type(prioritized=True)["sl"]],
+                             ["host#7.0#1", "host#6.0#1", "host#5.0#1", "host#1.0#1"])
+            self.assertEqual(ids(container.find_unscheduled_jobs_with_matching_reqs("user0",
+                             container.get_job_by_id("host#0.0#1"))), ["host#6.0#1"])
+
+            self.assertEqual(container.unschedule_many(["host#0.0#1", "host#3.0#1", "host#5.0#1"]), 2)
+            self.assertEqual([job.id for job in container.get_unscheduled_jobs_by_type(prioritized=True)["sl"]],
+                             ["host#7.0#1", "host#6.0#1", "host#5.0#1", "host#3.0#1", "host#1.0#1", "host#0.0#1"])
+            self.assertEqual(ids(container.find_unscheduled_jobs_with_matching_reqs("user1",
+                             container.get_job_by_id("host#3.0#1"))), ["host#1.0#1", "host#3.0#1", "host#5.0#1", "host#7.0#1"])
+            self.assertEqual(container.get_job_by_id("host#3.0#1").status, "Unscheduled")
+
+    def test_federated_job_query(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="soap")
+        job_pool.schedd_urls = ["http://schedd1:8080", "http://schedd2:8080"]
+        known = Job(GlobalJobId="schedd2#1.0#1", JobStatus=1)
+        known.schedd = "http://schedd2:8080"
+        job_pool.update_jobs([known])
+
+        def schedd_query(url, constraint=None):
+            if url == "http://schedd1:8080":
+                job = Job(GlobalJobId="schedd1#1.0#1", JobStatus=1)
+                job.schedd = url
+                return [job]
+            return None
+        job_pool._schedd_job_query_SOAP = schedd_query
+
+        jobs = job_pool.job_query()
+        self.assertEqual(sorted([job.id for job in jobs]), ["schedd1#1.0#1", "schedd2#1.0#1"])
+
+        job_pool._schedd_job_query_SOAP = lambda url, constraint=None: None
+        self.assertEqual(job_pool.job_query(), None)
+
+    def test_update_jobs_delta(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="local")
+        job_pool.update_jobs([Job(GlobalJobId="host#1.0#1", JobStatus=1, ServerTime=100),
+                              Job(GlobalJobId="host#1.1#1", JobStatus=1, ServerTime=100)])
+        self.assertEqual(job_pool.last_server_time, 100)
+
+        job_pool.update_jobs_delta([Job(GlobalJobId="host#1.0#1", JobStatus=4, ServerTime=110),
+                                    Job(GlobalJobId="host#1.1#1", JobStatus=2, ServerTime=110),
+                                    Job(GlobalJobId="host#2.0#1", JobStatus=1, ServerTime=110)])
+        container = job_pool.job_container
+        self.assertFalse(container.has_job("host#1.0#1"))
+        self.assertEqual(container.get_job_by_id("host#1.1#1").job_status, JobPool.RUNNING)
+        self.assertTrue(container.has_job("host#2.0#1"))
+        self.assertEqual(job_pool.last_server_time, 110)
+
+    def test_job_container_priority_indexes(self):
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import HashTableJobContainer
+        container = HashTableJobContainer()
+        low = Job(GlobalJobId="host#1.0#1", Owner="alice", JobPrio=1, VMType="sl")
+        high = Job(GlobalJobId="host#1.1#1", Owner="alice", JobPrio=5, VMType="sl", VMHighPriority=1)
+        other = Job(GlobalJobId="host#1.2#1", Owner="alice", JobPrio=3, VMType="deb")
+        for job in (low, high, other):
+            container.add_job(job)
+
+        self.assertEqual(container.get_unscheduled_jobs_by_users(prioritized=True), {"alice": [high, other, low]})
+        self.assertEqual(container.get_unscheduled_user_jobs_by_type("alice"), {"sl": [high, low], "deb": [other]})
+        self.assertEqual(container.get_unscheduled_user_jobs_by_usertype("alice"), {"alice:sl": [high, low], "alice:deb": [other]})
+        self.assertEqual(container.get_unscheduled_jobs_by_type(), {"sl": [high, low], "deb": [other]})
+        self.assertEqual(container.get_unscheduled_high_priority_jobs_by_users(), {"alice": [high]})
+        self.assertEqual(container.find_unscheduled_jobs_with_matching_reqs("alice", low), [high, low])
+        self.assertEqual(container.find_unscheduled_jobs_with_matching_reqs("alice", low, 1), [high])
+        bigger = Job(GlobalJobId="host#2.0#1", Owner="alice", VMType="sl", VMMem=4096)
+        self.assertFalse(bigger.has_same_reqs(low))
+        self.assertEqual(container.find_unscheduled_jobs_with_matching_reqs("alice", bigger), [])
+
+        container.schedule_job(high.id)
+        self.assertEqual(container.get_unscheduled_jobs_by_usertype(), {"alice:sl": [low], "alice:deb": [other]})
+        self.assertEqual(container.get_unscheduled_jobs_by_type(), {"sl": [low], "deb": [other]})
+        self.assertEqual(container.get_unscheduled_high_priority_jobs_by_users(), {})
+        container.unschedule_job(high.id)
+        container.remove_job(low)
+        self.assertEqual(container.get_unscheduled_user_jobs_by_type("alice"), {"sl": [high], "deb": [other]})
+        self.assertEqual(container.get_unscheduled_user_jobs_by_type("bob"), {})
+
+    def test_job_container_required_type_counts(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="local")
+        container = job_pool.job_container
+        idle = Job(GlobalJobId="host#1.0#1", Owner="alice", JobStatus=1, VMType="sl")
+        running = Job(GlobalJobId="host#1.1#1", Owner="alice", JobStatus=2, VMType="sl")
+        held = Job(GlobalJobId="host#1.2#1", Owner="bob", JobStatus=5, VMType="sl")
+        job_pool.update_jobs([idle, running, held])
+
+        self.assertEqual(job_pool.get_required_uservmtypes_dict(), {"alice:sl": 2})
+        self.assertEqual(job_pool.get_required_vmtypes_dict(), {"sl": 2})
+        self.assertEqual(job_pool.get_required_vmtypes(), ["sl"])
+        self.assertTrue(container.ban_job(idle, "TempBanned"))
+        self.assertFalse(container.ban_job(idle, "TempBanned"))
+        self.assertEqual(idle.override_status, "TempBanned")
+        self.assertEqual(job_pool.get_required_uservmtypes_dict(), {"alice:sl": 1})
+
+        container.update_job_status(held.id, 1, None, 0, 0)
+        container.remove_job(running)
+        self.assertEqual(job_pool.get_required_uservmtypes(), ["bob:sl"])
+        self.assertEqual(job_pool.get_required_vmtypes_dict(), {"sl": 1})
+        container.remove_job(held)
+        container.remove_job(idle)
+        self.assertEqual(job_pool.get_required_vmtypes(), [])
+
+    def test_job_container_status_views(self):
+        from cloudscheduler.job_management import Job, JobPool
+        job_pool = JobPool("testpool", condor_query_type="local")
+        container = job_pool.job_container
+        idle = Job(GlobalJobId="host#1.0#1", JobStatus=1, VMHighPriority=1)
+        held = Job(GlobalJobId="host#1.1#1", JobStatus=5)
+        job_pool.update_jobs([idle, held])
+
+        self.assertEqual(container.get_idle_jobs(), [idle])
+        self.assertEqual(container.get_held_jobs(), [held])
+        self.assertEqual(container.get_high_priority_jobs(), [idle])
+        self.assertEqual(container.get_unscheduled_high_priority_jobs(), [idle])
+        self.assertEqual(job_pool.get_snapshot().get_held_jobs(), [held])
+
+        container.update_job_status(idle.id, 2, "vm1", 0, 0)
+        self.assertEqual(container.get_idle_jobs(), [])
+        self.assertEqual(container.get_running_jobs(), [idle])
+        container.remove_job(idle)
+        self.assertEqual(container.get_running_jobs(), [])
+        self.assertEqual(container.get_high_priority_jobs(), [])
+
+    def test_job_container_ban_expiry(self):
+        from cloudscheduler.job_management import Job
+        from cloudscheduler.job_containers import HashTableJobContainer
+        container = HashTableJobContainer()
+        job = Job(GlobalJobId="host#1.0#1", Owner="alice", VMType="sl", VMHighPriority=1)
+        container.add_job(job)
+
+        self.assertTrue(container.ban_job(job, "TempBanned"))
+        self.assertEqual(container.get_banned_jobs(), [job])
+        # Banned jobs are still unscheduled, but are never matched to a VM
+        self.assertEqual(container.get_unscheduled_jobs_by_users(), {"alice": [job]})
+        self.assertEqual(container.get_unscheduled_high_priority_jobs_by_users(), {"alice": [job]})
+        self.assertEqual(container.get_unscheduled_user_jobs_by_type("alice"), {"sl": [job]})
+        self.assertEqual(container.find_unscheduled_jobs_with_matching_reqs("alice", job), [])
+
+        self.assertEqual(container.expire_bans(job.ban_time), [])
+        timeout = cloudscheduler.config.job_ban_timeout
+        self.assertEqual(container.expire_bans(job.ban_time + timeout + 1), [job])
+        self.assertFalse(job.banned)
+        self.assertEqual(job.override_status, None)
+        self.assertEqual(container.get_banned_jobs(), [])
+        self.assertEqual(container.get_unscheduled_jobs_by_users(), {"alice": [job]})
+
+        container.ban_job(job, "TempBanned")
+        container.remove_job(job)
+        self.assertEqual(container.expire_bans(job.ban_time + timeout + 1), [])
+
 class GetOrNoneTests(unittest.TestCase):
 
     def setUp(self):